@@ -27,6 +27,32 @@ EXAMPLES:
     NOP
     HLT
 
+===labels, constants and directives====
+
+These are expanded before encoding, so a program using them assembles to the
+same binary as one with every instruction written out.
+
+    .equ N, 8               # a constant
+    start:                  # a label, the PC of the next instruction
+    RHM 0, 0, N
+    .repeat 3               # the lines up to .endr, 3 times (.repeats nest)
+        NOP
+    .endr
+    .macro LOAD addr, len   # a macro, invoked as LOAD 0, 8
+        RHM addr, 0, len
+    .endm
+    LOAD 2*N, N
+    .align 50               # NOPs up to the next PC that's a multiple of 50
+    .org start + 300        # NOPs up to PC start + 300
+    .word 0x07 << 104       # an instruction given as its 14-byte value
+    HLT
+
+Operands can be expressions over numbers, constants and labels using
++ - * // % << >> & | ^ and parentheses. Labels can be used before they're
+defined, except in .equ, .repeat, .align and .org, which are worked out in
+the first pass. expand() returns the symbol table, so a generator can take
+branch targets for its weight tiles from labels.
+
 ===binary encoding====
 
 INST is encoded in a little-endian format.
@@ -44,23 +70,36 @@ SRC/TAR takes 5B for memory operations to support at least 8GB addressing,
 """
 
 import argparse
+import ast
+import functools
+import operator
 import re
+from typing import Dict, Iterable, List, Tuple
 from isa import *
 
-args = None
-
 TOP_LEVEL_SEP = re.compile(r'[a-zA-Z]+\s+')
 
 SUFFIX = '.out'
+SYMBOLS_SUFFIX = '.sym'
 
 #ENDIANNESS = 'little'
 ENDIANNESS = 'big'
 
-def DEBUG(string):
-    if args.debug:
-        print(string)
-    else:
-        return
+LABEL = re.compile(r'([A-Za-z_]\w*)\s*:\s*(.*)')
+DIRECTIVE = re.compile(r'\.([A-Za-z]+)\s*(.*)')
+BLOCK_ENDS = {'repeat': 'endr', 'macro': 'endm'}
+
+BINARY_OPS = {ast.Add: operator.add, ast.Sub: operator.sub,
+              ast.Mult: operator.mul, ast.FloorDiv: operator.floordiv,
+              ast.Mod: operator.mod, ast.LShift: operator.lshift,
+              ast.RShift: operator.rshift, ast.BitAnd: operator.and_,
+              ast.BitOr: operator.or_, ast.BitXor: operator.xor}
+UNARY_OPS = {ast.USub: operator.neg, ast.UAdd: operator.pos,
+             ast.Invert: operator.invert}
+
+
+class AssemblyError(ValueError):
+    pass
 
 def putbytes(val, lo, hi):
     # Pack value 'val' into a byte range of lo..hi inclusive.
@@ -78,120 +117,328 @@ def format_instr(op, flags, length, addr, ubaddr):
            putbytes(addr, ADDR_START, ADDR_END-1) |\
            putbytes(ubaddr, UBADDR_START, UBADDR_END-1)
 
-def assemble(path, n):
-    """ Translates an assembly code file into a binary.
+# the binary for one line of code, or None if the line is blank or a comment.
+# programs repeat the same few lines (NOPs above all), so each distinct line is
+# only encoded once per process
+@functools.lru_cache(maxsize=65536)
+def assemble_line(line):
+    line = line.partition('#')[0]
+    if not line.strip():
+        return None
+    if line.startswith('.word'):
+        return int(line.split()[1]).to_bytes(INSTRUCTION_WIDTH_BYTES, byteorder=ENDIANNESS)
+    operands = TOP_LEVEL_SEP.split(line)[1]
+    operands = [int(op.strip(), 0) for op in operands.split(',')] if operands else []
+    opcode = line.split()[0].strip()
+    assert opcode
+    comps = opcode.split('.')
+    assert comps and len(comps) < 3
+    if len(comps) == 1:
+        opcode = comps[0]
+        flags = ''
+    else:
+        opcode = comps[0]
+        flags = comps[1]
+
+    flag = 0
+    if 'S' in flags:
+        flag |= SWITCH_MASK
+    if 'C' in flags:
+        flag |= CONV_MASK
+    if 'O' in flags:
+        flag |= OVERWRITE_MASK
+    if 'Q' in flags:
+        flag |= FUNC_SIGMOID_MASK
+    if 'R' in flags:
+        flag |= FUNC_RELU_MASK
+        
+    # binary for flags
+    bin_flags = flag.to_bytes(1, byteorder=ENDIANNESS)
+
+    opcode, n_src, n_dst, n_len = OPCODE2BIN[opcode]
+
+    if opcode == OPCODE2BIN['NOP'][0]:
+        instr = format_instr(op=opcode, flags=0, length=0, addr=0, ubaddr=0)
+    elif opcode == OPCODE2BIN['HLT'][0]:
+        instr = format_instr(op=opcode, flags=0, length=0, addr=0, ubaddr=0)
+    elif opcode == OPCODE2BIN['RW'][0]:
+        # RW instruction only has only operand (weight DRAM address)
+        instr = format_instr(op=opcode, flags=flag, length=0, addr=operands[0], ubaddr=0)
+    elif (opcode == OPCODE2BIN['RHM'][0]) or (opcode == OPCODE2BIN['ACT'][0]):
+        # RHM and ACT have UB-addr as their destination field
+        instr = format_instr(op=opcode, flags=flag, length=operands[2], addr=operands[0], ubaddr=operands[1])
+    else:
+        # WHM and MMC have UB-addr as their source field
+        instr = format_instr(op=opcode, flags=flag, length=operands[2], addr=operands[1], ubaddr=operands[0])
+
+    return instr.to_bytes(INSTRUCTION_WIDTH_BYTES, byteorder=ENDIANNESS)
+
+def evaluate(expr, symbols):
+    """ Works out an operand expression: a number, a label or constant, or
+    arithmetic on them.
     """
 
-    assert path
-    with open(path, 'r') as code:
-        lines = code.readlines()
-    code.close()
-    n = len(lines) if not n else n
-    write_path = path[:path.rfind('.')] if path.rfind('.') > -1 else path
-    bin_code = open(write_path + SUFFIX, 'wb')
-    counter = 0
-    for line in lines:
-        line = line.partition('#')[0]
-        if not line.strip():
+    expr = expr.strip()
+    try:
+        return int(expr, 0)
+    except ValueError:
+        pass
+    try:
+        tree = ast.parse(expr, mode='eval')
+    except SyntaxError:
+        raise AssemblyError("bad expression '{}'".format(expr)) from None
+
+    def value(node):
+        if isinstance(node, ast.Constant) and type(node.value) is int:
+            return node.value
+        if isinstance(node, ast.Name):
+            if node.id not in symbols:
+                raise AssemblyError("undefined symbol '{}'".format(node.id))
+            return symbols[node.id]
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPS:
+            return BINARY_OPS[type(node.op)](value(node.left), value(node.right))
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPS:
+            return UNARY_OPS[type(node.op)](value(node.operand))
+        raise AssemblyError("bad expression '{}'".format(expr))
+
+    return value(tree.body)
+
+# a line's label (or None), the code after it without the comment, and
+# whether that code is an instruction whose operands are all plain numbers (or
+# nothing), so it can be encoded as it is. lines like that are left alone,
+# which keeps the binaries of programs that use no labels, constants or
+# directives exactly as they were
+@functools.lru_cache(maxsize=65536)
+def parse_line(line):
+    code = line.partition('#')[0].strip()
+    label = None
+    match = LABEL.match(code)
+    if match:
+        label, code = match.group(1), match.group(2)
+    if code.startswith('.'):
+        return label, code, False
+    operands = code.split(None, 1)[1:]
+    try:
+        for op in operands[0].split(',') if operands else []:
+            int(op.strip(), 0)
+    except ValueError:
+        return label, code, False
+    return label, code, True
+
+
+# the first pass: runs the directives, expands .repeat blocks and macros,
+# and gives every label the PC of the instruction after it. the instructions
+# are collected in `code`, and the ones with operands left to work out once
+# every label is known in `unresolved`, as (PC, line number)
+class Expander(object):
+    def __init__(self):
+        self.symbols = {}
+        self.macros = {}
+        self.code = []
+        self.unresolved = []
+
+    def define(self, name, value):
+        if name in self.symbols:
+            raise AssemblyError("'{}' is already defined".format(name))
+        self.symbols[name] = value
+
+    # the lines after the .repeat or .macro at lines[start - 1] up to its
+    # .endr or .endm, and the index of the line after that
+    def block(self, lines, start, directive):
+        depth = 1
+        for i in range(start, len(lines)):
+            match = DIRECTIVE.match(parse_line(lines[i])[1])
+            if not match:
+                continue
+            if match.group(1) in BLOCK_ENDS:
+                depth += 1
+            elif match.group(1) in BLOCK_ENDS.values():
+                depth -= 1
+                if depth == 0:
+                    if match.group(1) != BLOCK_ENDS[directive]:
+                        raise AssemblyError(".{} closed by .{}".format(directive, match.group(1)))
+                    return start, i
+        raise AssemblyError(".{} without .{}".format(directive, BLOCK_ENDS[directive]))
+
+    def pad(self, pc):
+        if pc < len(self.code):
+            raise AssemblyError("can't pad back to PC {} from PC {}".format(pc, len(self.code)))
+        self.code += ['NOP'] * (pc - len(self.code))
+
+    # expand `lines`, numbered from `first` (or all numbered `first` if `same`
+    # is set, as a macro's lines are reported at the line that invoked it)
+    def run(self, lines, first=1, same=False):
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            lineno = first if same else first + i
+            i += 1
+            label, code, literal = parse_line(line)
+            if literal and label is None and not self.macros:
+                if code:
+                    self.code.append(line)
+                continue
+            try:
+                i = self.statement(lines, i, lineno, line, label, code, literal, first, same)
+            except AssemblyError as e:
+                if str(e).startswith('line '):
+                    raise
+                raise AssemblyError('line {}: {}'.format(lineno, e)) from None
+
+    # handle the line before lines[i]. returns the index of the next line to
+    # handle, which is past the end of the block if the line starts one
+    def statement(self, lines, i, lineno, line, label, code, literal, first, same):
+        if label is not None:
+            self.define(label, len(self.code))
+        if not code:
+            return i
+
+        match = DIRECTIVE.match(code)
+        if match:
+            directive, arg = match.groups()
+            if directive in BLOCK_ENDS:
+                start, end = self.block(lines, i, directive)
+                body_first = first if same else first + start
+            if directive == 'repeat':
+                for _ in range(evaluate(arg, self.symbols)):
+                    self.run(lines[start:end], body_first, same)
+            elif directive == 'macro':
+                name, _, params = arg.partition(' ')
+                if not name or name in OPCODE2BIN or name in self.macros:
+                    raise AssemblyError("bad macro name '{}'".format(name))
+                params = [p.strip() for p in params.split(',') if p.strip()]
+                self.macros[name] = (params, lines[start:end])
+            elif directive == 'equ':
+                name, _, expr = arg.replace(',', ' ', 1).partition(' ')
+                self.define(name, evaluate(expr, self.symbols))
+            elif directive == 'align':
+                size = evaluate(arg, self.symbols)
+                if size < 1:
+                    raise AssemblyError("alignment must be at least 1")
+                self.pad(-(-len(self.code) // size) * size)
+            elif directive == 'org':
+                self.pad(evaluate(arg, self.symbols))
+            elif directive == 'word':
+                word = evaluate(arg, self.symbols)
+                if not 0 <= word < 2**(8*INSTRUCTION_WIDTH_BYTES):
+                    raise AssemblyError("{} doesn't fit in an instruction".format(word))
+                self.code.append('.word {}'.format(word))
+            else:
+                raise AssemblyError("unknown directive .{}".format(directive))
+            return end + 1 if directive in BLOCK_ENDS else i
+
+        name, _, args = code.partition(' ')
+        if name in self.macros:
+            params, body = self.macros[name]
+            args = [a.strip() for a in args.split(',') if a.strip()]
+            if len(args) != len(params):
+                raise AssemblyError("{} takes {} arguments, got {}".format(name, len(params), len(args)))
+            # arguments go in whole, in brackets if they're expressions
+            args = [a if re.fullmatch(r'[\w.]+', a) else '({})'.format(a) for a in args]
+            subs = [(re.compile(r'(?<![\w.]){}(?!\w)'.format(p)), a) for p, a in zip(params, args)]
+            expanded = []
+            for body_line in body:
+                for pattern, a in subs:
+                    body_line = pattern.sub(lambda m: a, body_line)
+                expanded.append(body_line)
+            self.run(expanded, lineno, same=True)
+            return i
+
+        if not literal:
+            self.unresolved.append((len(self.code), lineno))
+        self.code.append(line if label is None else code)
+        return i
+
+def expand(lines: Iterable[str]) -> Tuple[List[str], Dict[str, int]]:
+    """ Expands the labels, constants and directives in lines of assembly
+    code. Returns the plain lines of code, one instruction each, and the
+    labels and constants with their values.
+    """
+
+    expander = Expander()
+    expander.run(lines if isinstance(lines, list) else list(lines))
+    code = expander.code
+    for pc, lineno in expander.unresolved:
+        mnemonic, _, operands = parse_line(code[pc])[1].partition(' ')
+        try:
+            values = [evaluate(op, expander.symbols) for op in operands.split(',')]
+        except AssemblyError as e:
+            raise AssemblyError('line {}: {}'.format(lineno, e)) from None
+        code[pc] = '{} {}'.format(mnemonic, ', '.join(str(v) for v in values))
+    return code, expander.symbols
+
+# the binary for plain lines of code, as expand returns them, keeping only
+# the first n instructions if n is given
+def encode(code, n=0, debug=False):
+    instrs = []
+    for line in code:
+        # the operand split expects every line to end in a newline
+        line = line.rstrip('\n') + '\n'
+        instr = assemble_line(line)
+        if instr is None:
             continue
-        counter += 1
-        operands = TOP_LEVEL_SEP.split(line)[1]
-        operands = [int(op.strip(), 0) for op in operands.split(',')] if operands else []
-        opcode = line.split()[0].strip()
-        assert opcode
-        comps = opcode.split('.')
-        assert comps and len(comps) < 3
-        if len(comps) == 1:
-            opcode = comps[0]
-            flags = ''
-        else:
-            opcode = comps[0]
-            flags = comps[1]
-
-        flag = 0
-        if 'S' in flags:
-            flag |= SWITCH_MASK
-        if 'C' in flags:
-            flag |= CONV_MASK
-        if 'O' in flags:
-            flag |= OVERWRITE_MASK
-        if 'Q' in flags:
-            flag |= FUNC_SIGMOID_MASK
-        if 'R' in flags:
-            flag |= FUNC_RELU_MASK
-            
-        # binary for flags
-        bin_flags = flag.to_bytes(1, byteorder=ENDIANNESS)
-
-        opcode, n_src, n_dst, n_len = OPCODE2BIN[opcode]
-
-        if opcode == OPCODE2BIN['NOP'][0]:
-            instr = format_instr(op=opcode, flags=0, length=0, addr=0, ubaddr=0)
-        elif opcode == OPCODE2BIN['HLT'][0]:
-            instr = format_instr(op=opcode, flags=0, length=0, addr=0, ubaddr=0)
-        elif opcode == OPCODE2BIN['RW'][0]:
-            # RW instruction only has only operand (weight DRAM address)
-            instr = format_instr(op=opcode, flags=flag, length=0, addr=operands[0], ubaddr=0)
-        elif (opcode == OPCODE2BIN['RHM'][0]) or (opcode == OPCODE2BIN['ACT'][0]):
-            # RHM and ACT have UB-addr as their destination field
-            instr = format_instr(op=opcode, flags=flag, length=operands[2], addr=operands[0], ubaddr=operands[1])
-        else:
-            # WHM and MMC have UB-addr as their source field
-            instr = format_instr(op=opcode, flags=flag, length=operands[2], addr=operands[1], ubaddr=operands[0])
-
-        bin_code.write(instr.to_bytes(14, byteorder=ENDIANNESS))
-            
-        '''
-        # binary representation for opcode
-        bin_opcode = opcode.to_bytes(1, byteorder=ENDIANNESS)
-        
-        # binary for oprands
-        bin_operands = b''
-        if len(operands) == 0:
-            bin_operands = b''
-        elif len(operands) == 1:
-            bin_operands = operands[0].to_bytes(n_src, byteorder=ENDIANNESS)
-        elif len(operands) == 3:
-            bin_operands += operands[0].to_bytes(n_src, byteorder=ENDIANNESS)
-            bin_operands += operands[1].to_bytes(n_tar, byteorder=ENDIANNESS)
-            bin_operands += operands[2].to_bytes(n_3rd, byteorder=ENDIANNESS)
-
-        # binary for instruction
-        #bin_rep = bin_flags + bin_operands + bin_opcode
-        bin_rep = bin_opcode + bin_operands + bin_flags
-
-        if len(bin_rep) < INSTRUCTION_WIDTH_BYTES:
-            x = 0
-            zeros = x.to_bytes(INSTRUCTION_WIDTH_BYTES - len(bin_rep), byteorder=ENDIANNESS)
-            #bin_rep = bin_flags + bin_operands + zeros + bin_opcode
-            bin_rep = bin_opcode + bin_operands + zeros + bin_flags
-
-        DEBUG(line[:-1])
-        DEBUG(bin_rep)
-
-        # write to file
-        bin_code.write(bin_rep)
-        '''
-
-        if counter == n:
+        if debug:
+            print(line[:-1])
+            print(instr)
+        instrs.append(instr)
+        if len(instrs) == n:
             break
-    bin_code.close()
+    return b''.join(instrs)
+
+def assemble_lines(lines: Iterable[str], n: int = 0, debug: bool = False) -> bytes:
+    """ Translates lines of assembly code, with or without their newlines,
+    into a binary. Only the first n instructions are kept if n is given.
+    """
 
+    return encode(expand(lines)[0], n, debug)
 
-def parse_args():
-    global args
+def assemble_text(text: str, n: int = 0, debug: bool = False) -> bytes:
+    """ Translates a string of assembly code into a binary.
+    """
+
+    return assemble_lines(text.splitlines(), n, debug)
+
+def assemble_many(texts: Iterable[str]) -> List[bytes]:
+    """ Translates many programs' assembly code into binaries in one go, for
+    generators that make thousands of small programs.
+    """
 
+    return [assemble_text(text) for text in texts]
+
+def assemble(path, n, debug=False, write_symbols=False):
+    """ Translates an assembly code file into a binary. Returns the labels
+    and constants with their values, which are also written to a .sym file
+    next to the binary if write_symbols is set.
+    """
+
+    assert path
+    with open(path, 'r') as source:
+        code, symbols = expand(source)
+    write_path = path[:path.rfind('.')] if path.rfind('.') > -1 else path
+    with open(write_path + SUFFIX, 'wb') as bin_code:
+        bin_code.write(encode(code, n, debug))
+    if write_symbols:
+        with open(write_path + SYMBOLS_SUFFIX, 'w') as f:
+            for name, value in symbols.items():
+                f.write('{} {}\n'.format(name, value))
+    return symbols
+
+
+def parse_args():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('path', action='store',
-                        help='path to source file.')
+    parser.add_argument('paths', nargs='+', metavar='path',
+                        help='path to source file. several are assembled in one go.')
     parser.add_argument('--n', action='store', type=int, default=0,
                         help='only parse first n lines of code, for dbg only.')
     parser.add_argument('--debug', action='store_true',
                         help='switch debug prints.')
-    args = parser.parse_args()
+    parser.add_argument('--symbols', action='store_true',
+                        help='write the labels and constants and their values to a .sym file.')
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    parse_args()
-    assemble(args.path, args.n)
+    args = parse_args()
+    for path in args.paths:
+        assemble(path, args.n, args.debug, args.symbols)
@@ -0,0 +1,68 @@
+import os
+from typing import Dict, List
+
+import numpy as np
+
+# the checkpoint files sim.py (TPUSim.checkpoint) and runtpu.py
+# (runtpu(checkpoint=...)) write, and restore from. a checkpoint is a
+# compressed .npz of plain arrays, with no pickled objects, plus two entries
+# saying which simulator wrote it and in which version of the format.
+#
+# a checkpoint holds everything the TPU can change: for TPUSim the pc, UB,
+# accumulators, weight FIFO, host memory and counters, and for runtpu the
+# register and memory values of the PyRTL simulation plus what runtpu.py
+# itself keeps between cycles. the program and the weight DRAM are never
+# written, so they come from the run that restores the checkpoint. that
+# run can be given a different program, as long as it starts the same way,
+# to fork variants from a shared warm state
+CHECKPOINT_VERSION = 1
+CHECKPOINT_KINDS = ["tpusim", "runtpu"]
+
+
+# the checkpoint is written to a temporary file and moved into place, so a
+# run killed while saving never leaves a cut-short checkpoint at `path`
+def save_checkpoint(path: str, kind: str, **arrays):
+    if kind not in CHECKPOINT_KINDS:
+        raise ValueError(f"Unknown checkpoint kind {kind}. Choose from {CHECKPOINT_KINDS}.")
+    # np.savez_compressed adds .npz to paths without it, so do the same here
+    if not path.endswith(".npz"):
+        path += ".npz"
+    tmp_path = f"{path[:-len('.npz')]}.tmp.npz"
+    np.savez_compressed(tmp_path, checkpoint_kind=np.array(kind),
+                        checkpoint_version=np.array(CHECKPOINT_VERSION), **arrays)
+    os.replace(tmp_path, path)
+
+# the arrays saved in a checkpoint of `kind`, as a dict
+def load_checkpoint(path: str, kind: str) -> Dict[str, np.ndarray]:
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    if "checkpoint_kind" not in arrays:
+        raise ValueError(f"{path} is not a checkpoint.")
+    if str(arrays["checkpoint_kind"]) != kind:
+        raise ValueError(f"{path} is a {arrays['checkpoint_kind']} checkpoint, not a {kind} one.")
+    if int(arrays["checkpoint_version"]) != CHECKPOINT_VERSION:
+        raise ValueError(f"{path} is a version {arrays['checkpoint_version']} checkpoint, "
+                         f"this is version {CHECKPOINT_VERSION}.")
+    del arrays["checkpoint_kind"], arrays["checkpoint_version"]
+    return arrays
+
+
+# PyRTL values can be far wider than 64 bits (a weight tile is
+# matsize*matsize*bitwidth bits), so they're stored as little-endian bytes.
+# `bitwidths` gives each value's width, which sets how many bytes it takes.
+# returns the bytes of every value, one after the other, as a uint8 array
+def ints_to_bytes(values: List[int], bitwidths: List[int]) -> np.ndarray:
+    data = b"".join(v.to_bytes((w + 7) // 8, "little") for v, w in zip(values, bitwidths))
+    return np.frombuffer(data, dtype=np.uint8)
+
+def bytes_to_ints(data: np.ndarray, bitwidths: List[int]) -> List[int]:
+    data = data.tobytes()
+    values = []
+    start = 0
+    for w in bitwidths:
+        end = start + (w + 7) // 8
+        values.append(int.from_bytes(data[start:end], "little"))
+        start = end
+    if start != len(data):
+        raise ValueError(f"Expected {start} bytes of values, got {len(data)}.")
+    return values
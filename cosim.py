@@ -0,0 +1,279 @@
+import argparse
+from datetime import datetime
+import sys
+from typing import Optional
+
+import numpy as np
+
+import isa
+from packing import pack_rows
+from runtpu import Observer, runtpu, BACKENDS
+from memmodels import MEMORY_MODELS
+from sim import TPUSim, Verbosity
+
+# lock-step co-simulation of the RTL (runtpu.py) and the functional simulator
+# (sim.py's TPUSim). runtpu runs the hardware as usual, and every time the
+# RTL's pc (tpu_pc_out) moves past an instruction, that instruction is
+# retired: TPUSim executes it too, and the run stops at the first point where
+# the two disagree.
+#
+# at each retire point the RTL must be about to leave the same pc TPUSim is
+# at. NOPs and SYNCs are skipped on both sides, since in N mode the RTL keeps
+# dispatching the NOPs after an ACT until a branch takes effect, where TPUSim
+# jumps straight away. the rows of the UB, accumulators and host memory the
+# instruction changed in TPUSim must then show the same values in the RTL
+# within `slack` cycles (plus the instruction's length), as the hardware takes
+# a while to finish an instruction after it's dispatched. when the TPU halts,
+# the final memories are compared too (see compare_final).
+#
+# without hazard detection, a program only runs the same on both if it has
+# enough NOPs between dependent instructions, so the mullifier examples need
+# HAZARD_DETECTION = True in config.py.
+
+SKIPPED_OPS = (isa.OPCODE2BIN['NOP'][0], isa.OPCODE2BIN['SYNC'][0])
+# rows listed in a report
+REPORT_ROWS = 8
+
+
+def format_instr(code, pc):
+    ops, flags, lengths, addrs, ubaddrs = code
+    if pc >= len(ops):
+        return "past the end of the program"
+    return (f"{isa.BIN2OPCODE[ops[pc]]} flags={flags[pc]:#04x} len={lengths[pc]} "
+            f"addr={addrs[pc]} ubaddr={ubaddrs[pc]}")
+
+
+# where the RTL and TPUSim first disagreed. kind is "control" (they're at
+# different instructions), "data" (an instruction's results didn't show up
+# in the RTL in time) or "final" (the memories differ when the TPU halts).
+# rows holds (memory, row, TPUSim's values, the RTL's values)
+class Divergence(object):
+    def __init__(self, kind: str, cycle: int, pc: int, instr: str, message: str,
+                 rows: Optional[list] = None):
+        self.kind = kind
+        self.cycle = cycle
+        self.pc = pc
+        self.instr = instr
+        self.message = message
+        self.rows = rows or []
+
+    def report(self) -> str:
+        lines = [f"Diverged ({self.kind}) at cycle {self.cycle}, PC {self.pc}: {self.instr}",
+                 f"  {self.message}"]
+        for mem, row, expected, actual in self.rows[:REPORT_ROWS]:
+            lines.append(f"  {mem}[{row}]: sim {list(expected)}")
+            lines.append(f"  {' ' * (len(mem) + len(str(row)) + 2)}  rtl {list(actual)}")
+        if len(self.rows) > REPORT_ROWS:
+            lines.append(f"  ... and {len(self.rows) - REPORT_ROWS} more rows")
+        return "\n".join(lines)
+
+
+# a row TPUSim has written that the RTL has to match by cycle `deadline`
+class PendingRow(object):
+    def __init__(self, mem, row, values, packed, deadline, pc):
+        self.mem = mem
+        self.row = row
+        self.values = values
+        self.packed = packed
+        self.deadline = deadline
+        self.pc = pc
+
+
+# the runtpu observer that steps TPUSim along with the RTL
+class LockstepChecker(Observer):
+    def __init__(self, tpusim: TPUSim, slack: int):
+        self.tpusim = tpusim
+        self.slack = slack
+        # TPUSim's own code is reported and stepped, so a caller can change
+        # it (see test/cosim) by loading it before making the checker
+        if tpusim.code is None:
+            tpusim.code = tpusim.load_code()
+            tpusim.handlers = tpusim.dispatch_table()
+        self.code = tpusim.code
+        # the program the RTL runs, which retire points are looked up in
+        self.program = tpusim.load_code()
+        self.prev_pc = None
+        self.pending = []
+        self.retired = 0
+        self.divergence = None
+
+    def on_cycle(self, view):
+        pc = view.inspect('tpu_pc_out')
+        if self.prev_pc is not None and pc != self.prev_pc:
+            self.retire(self.prev_pc, view)
+        self.prev_pc = pc
+        if self.divergence is None and self.pending:
+            self.check_pending(view, final=False)
+        return self.divergence is not None
+
+    def on_finish(self, view):
+        if self.divergence is not None or not view.inspect('tpu_halt'):
+            return
+        # the TPU halts as it dispatches HLT, without on_cycle seeing that
+        # cycle, so retire the instruction before it here. TPUSim then has to
+        # be at the HLT too
+        pc = view.inspect('tpu_pc_out')
+        if self.prev_pc is not None and pc != self.prev_pc:
+            self.retire(self.prev_pc, view)
+            self.prev_pc = pc
+        if self.divergence is None and self.catch_up(pc, view):
+            self.tpusim.step()
+            self.check_pending(view, final=True)
+
+    # skip TPUSim past NOPs to the next instruction, which has to be the one
+    # the RTL is at
+    def catch_up(self, pc, view):
+        ops = self.code[0]
+        while self.tpusim.pc < len(ops) and ops[self.tpusim.pc] in SKIPPED_OPS:
+            self.tpusim.step()
+        if self.tpusim.pc != pc:
+            self.divergence = Divergence(
+                "control", view.cycle, pc, format_instr(self.program, pc),
+                f"the RTL dispatched PC {pc}, but sim.py is at PC {self.tpusim.pc}: "
+                f"{format_instr(self.code, self.tpusim.pc)}")
+            return False
+        return True
+
+    def retire(self, pc, view):
+        ops = self.program[0]
+        if pc < len(ops) and ops[pc] in SKIPPED_OPS:
+            return
+        if not self.catch_up(pc, view):
+            return
+
+        sim = self.tpusim
+        before = {"ub": sim.ub.storage.copy(), "acc": sim.acc.storage.copy()}
+        if self.code[0][pc] == isa.OPCODE2BIN['WHM'][0]:
+            before["hm"] = sim.hm.storage.copy()
+        sim.step()
+        self.retired += 1
+
+        deadline = view.cycle + self.code[2][pc] + self.slack
+        mems = {"ub": sim.ub, "acc": sim.acc, "hm": sim.hm}
+        for name, old in before.items():
+            new = mems[name].storage
+            rows = changed_rows(old, new)
+            packed = pack_rows(new[rows], sim.bitwidth) if name != "acc" else [None] * len(rows)
+            for row, p in zip(rows.tolist(), packed):
+                self.pending.append(PendingRow(name, row, new[row].tolist(), p,
+                                               deadline, pc))
+
+    # drop the pending rows the RTL now matches. report the ones that are
+    # past their deadline, or all of those left if the TPU has halted
+    def check_pending(self, view, final):
+        ub = view.sim.inspect_mem(view._ubuffer)
+        late = []
+        remaining = []
+        for p in self.pending:
+            if p.mem == "ub":
+                matches = ub.get(p.row, 0) == p.packed
+            elif p.mem == "hm":
+                matches = (view.hostmem.read(p.row) or 0) == p.packed
+            else:
+                matches = view.accumulator_row(p.row) == p.values
+            if matches:
+                continue
+            if final or view.cycle > p.deadline:
+                late.append(p)
+            else:
+                remaining.append(p)
+        self.pending = remaining
+        if late and self.divergence is None:
+            first = late[0]
+            rows = [(p.mem, p.row, p.values, self.rtl_row(view, p.mem, p.row))
+                    for p in late if p.pc == first.pc]
+            when = "when the TPU halted" if final \
+                else f"{view.cycle - first.deadline + self.slack} cycles after it was retired"
+            self.divergence = Divergence(
+                "data", view.cycle, first.pc, format_instr(self.program, first.pc),
+                f"{len(rows)} rows sim.py wrote don't match the RTL {when}", rows)
+
+    def rtl_row(self, view, mem, row):
+        if mem == "ub":
+            return view.ubuffer_row(row)
+        if mem == "hm":
+            return view.hostmem_row(row)
+        return view.accumulator_row(row)
+
+
+# the rows where two versions of a memory's storage differ. rows past the end
+# of `old` count as zeros
+def changed_rows(old, new):
+    rows = min(len(old), len(new))
+    diff = np.flatnonzero((old[:rows] != new[:rows]).any(axis=1))
+    grown = rows + np.flatnonzero(new[rows:].any(axis=1))
+    return np.concatenate([diff, grown])
+
+
+# compare the host memory, UB and accumulators runtpu and TPUSim end with.
+# unlike compare_all_mems, rows only one side has count as 0s on the other
+# (sim.py's accumulator grows when ACT reads past its end, the RTL's only
+# has the rows it wrote), and the weight FIFO isn't compared, as the RTL's
+# buffers keep the tiles MMC has already used where sim.py pops them
+def compare_final(rtl_mems, tpusim, cycle, pc, code):
+    rtl_hm, _, rtl_ub, _, rtl_acc = rtl_mems
+    sim_hm, _, sim_ub, _, sim_acc = tpusim.get_mems()
+    for name, rtl, ctrl in [("hm", rtl_hm, sim_hm), ("ub", rtl_ub, sim_ub),
+                            ("acc", rtl_acc, sim_acc)]:
+        rows = max(len(rtl), len(ctrl))
+        rtl = np.pad(np.asarray(rtl, dtype=np.int64), ((0, rows - len(rtl)), (0, 0)))
+        ctrl = np.pad(ctrl.astype(np.int64), ((0, rows - len(ctrl)), (0, 0)))
+        diff = np.flatnonzero((rtl != ctrl).any(axis=1))
+        if len(diff):
+            return Divergence("final", cycle, pc, format_instr(code, pc),
+                              f"{len(diff)} rows of {name} differ at the end",
+                              [(name, r, ctrl[r].tolist(), rtl[r].tolist()) for r in diff])
+    return None
+
+
+# run `prog` on the RTL and TPUSim in lock step. returns None if they agreed
+# all the way to HLT, otherwise the first Divergence. runtpu's results go to
+# output_folder/runtpu.npz as usual (the memories at the point it stopped)
+# and TPUSim's to output_folder/sim.npz. `tpusim` can be a TPUSim to use
+# instead of a new one
+def cosim(prog: str, hostmem_filename: str, weightsmem_filename: str,
+          bitwidth: int, matsize: int, output_folder: str, backend: str = "fast",
+          memory_model: str = "array", slack: Optional[int] = None,
+          tpusim: Optional[TPUSim] = None) -> Optional[Divergence]:
+    if tpusim is None:
+        tpusim = TPUSim(prog, hostmem_filename, weightsmem_filename, bitwidth,
+                        matsize, output_folder, verbosity=Verbosity.SILENT)
+    if slack is None:
+        slack = 4*matsize + 64
+    checker = LockstepChecker(tpusim, slack)
+    rtl_mems = runtpu(prog, hostmem_filename, weightsmem_filename, bitwidth,
+                      matsize, output_folder, output_trace=False, backend=backend,
+                      observers=[checker], memory_model=memory_model)
+    tpusim.save()
+
+    divergence = checker.divergence
+    if divergence is None:
+        divergence = compare_final(rtl_mems, tpusim, checker.prev_pc, checker.prev_pc,
+                                   checker.program)
+    if divergence is None:
+        print(f"sim.py and the RTL agree: {checker.retired} instructions retired")
+    else:
+        print(divergence.report())
+    return divergence
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the PyRTL spec for the TPU and sim.py in lock step, stopping where they first disagree.")
+    parser.add_argument("prog", metavar="program.bin", help="A valid binary program for OpenTPU.")
+    parser.add_argument("hostmem", metavar="HostMemoryArray", help="A file containing a numpy array containing the initial contents of host memory. Each row represents one vector.")
+    parser.add_argument("weightsmem", metavar="WeightsMemoryArray", help="A file containing a numpy array containing the contents of the weights memroy. Each row represents one tile (the first row corresponds to the top row of the weights matrix).")
+    parser.add_argument("-b", "--bitwidth", type=int, default=32, help="The bitwidth of the data.")
+    parser.add_argument("-m", "--matsize", type=int, default=8, help="The size of the matrix.")
+    parser.add_argument("-f", "--folder", type=str, default=None, help="The output folder path.")
+    parser.add_argument("--slack", type=int, default=None, help="Cycles, on top of an instruction's length, the RTL has to show its results after it's dispatched. Defaults to 4*matsize + 64.")
+    parser.add_argument("--memory-model", choices=MEMORY_MODELS, default="array", help="How runtpu holds the host memory and weight DRAM (see runtpu.py).")
+    parser.add_argument("--backend", choices=BACKENDS, default="fast", help="The PyRTL simulator to use (see runtpu.py).")
+    args = parser.parse_args()
+
+    if not args.folder:
+        args.folder = f'{datetime.now().strftime("%Y-%m-%d_%H:%M:%S")}_{args.bitwidth}b_{args.matsize}m_cosim'
+
+    divergence = cosim(args.prog, args.hostmem, args.weightsmem, args.bitwidth,
+                       args.matsize, args.folder, backend=args.backend,
+                       memory_model=args.memory_model, slack=args.slack)
+    sys.exit(0 if divergence is None else 1)
@@ -0,0 +1,646 @@
+from datetime import datetime
+import math
+import os
+import argparse
+import numpy as np
+
+import config
+import isa
+from packing import pack_tiles, unpack_tiles
+from sim import activate, load_program
+from utils import print_mems
+
+# a cycle-accurate model of the hardware in tpu.py that runs without PyRTL.
+# every register of the design that can reach a memory, the pc or the halt
+# signal is kept here under the name of its PyRTL register, and step() computes
+# one clock cycle the same way the netlist does: same register widths, same
+# priorities between conditional assignments, and memory reads that see the
+# memories as they were before the cycle's writes. that gives the same latencies
+# as the RTL for free (UB -> systolic setup -> MM array -> accumulators, weight
+# FIFO fills, the RHM/WHM/ACT busy windows and the H-mode MMC/RW countdowns), so
+# run() reports the same cycle count and final memories as runtpu.py.
+#
+# the weight programming logic inside the MM array (wbuf1/wbuf2, tags,
+# progstep) is left out. the MACs multiply by the tile in fifo_buf4 directly, so
+# none of it reaches an output.
+
+
+# split a weight tile packed by runtpu.concat_tile (first value in the highest
+# bits) into a matsize x matsize array
+def unpack_tile(value, bitwidth, matsize):
+    return unpack_tiles([value], bitwidth, matsize)[0]
+
+
+# the inverse of unpack_tile
+def pack_tile(tile, bitwidth):
+    return pack_tiles(np.asarray(tile)[None], bitwidth)[0]
+
+
+class CycleSim(object):
+    # instrs: decoded program (sim.load_program). hostmem: 2d or 3d array of
+    # host memory rows. weightsmem: 3d array of weight tiles
+    def __init__(self, instrs, hostmem, weightsmem, bitwidth: int,
+                 matsize: int, hazard_detection: bool = config.HAZARD_DETECTION):
+        self.bitwidth = bitwidth
+        self.matsize = matsize
+        self.hazard_detection = hazard_detection
+        self.mask = (1 << bitwidth) - 1
+        self.pc_mask = 2**config.IMEM_ADDR_SIZE - 1
+        self.ub_mask = 2**config.UB_ADDR_SIZE - 1
+        self.acc_mask = 2**config.ACC_ADDR_SIZE - 1
+        self.host_mask = 2**config.HOST_ADDR_SIZE - 1
+        self.weight_addr_mask = 2**config.WEIGHT_DRAM_ADDR_SIZE - 1
+        self.split_point = int(math.log(matsize, 2))
+
+        # IMem. pcs past the end of the program read as 0, which is a NOP
+        self.imem = {pc: (int(i['op']), int(i['flags']), int(i['len']),
+                          int(i['addr']), int(i['ubaddr']))
+                     for pc, i in enumerate(instrs)}
+
+        # host and weight DRAMs, driven like runtpu.py drives them
+        hostmem = np.asarray(hostmem)
+        hostmem = hostmem.reshape(-1, hostmem.shape[-1]).astype(np.int64)
+        self.hostmem = {a: row.astype(np.uint64) & np.uint64(self.mask)
+                        for a, row in enumerate(hostmem)}
+        self.weightsmem = dict(enumerate(pack_tiles(weightsmem, bitwidth)))
+        self.weighttile = 0
+        self.chunkaddr = self.nchunks = max(matsize*matsize / 64, 1)
+
+        # UBuffer and acc_mems, with one past the highest row written so far
+        self.ubuffer = np.zeros((2**config.UB_ADDR_SIZE, matsize),
+                                dtype=np.uint64)
+        self.ub_rows = 0
+        self.acc_mems = np.zeros((2**config.ACC_ADDR_SIZE, matsize),
+                                 dtype=np.uint64)
+        self.acc_rows = 0
+
+        # tpu.py
+        self.tpu_pc = 0
+        self.tpu_rhm_busy = 0
+        self.tpu_whm_busy = 0
+        self.tpu_act_busy = 0
+        self.tpu_mmc_busy = 0
+        self.tpu_rw_busy = 0
+        self.tpu_mmc_N = 0
+        self.tpu_rw_N = 0
+        self.tpu_whm_N = 0
+        self.tpu_whm_ub_addr = 0
+        self.tpu_whm_addr = 0
+        self.tpu_whm_src_reg = 0
+        self.tpu_rhm_N = 0
+        self.tpu_rhm_addr = 0
+        self.tpu_rhm_ub_waddr = 0
+        self.tpu_rhm_src = 0
+
+        # activate.py
+        self.act_accum_addr = 0
+        self.act_ub_waddr = 0
+        self.act_N = 0
+        self.act_func = 0
+        self.act_first_cycle = 0
+        self.act_pc_incr_reg = 0
+
+        # MMU_top and MMU
+        self.mmu_top_accum_waddr = 0
+        self.mmu_top_overwrite_reg = 0
+        self.mmu_top_swap_reg = 0
+        self.busy_matrix = 0
+        self.mmu_top_N = 0
+        self.mmu_top_ub_raddr = 0
+        self.mmu_acc_done_countdown = 0
+
+        # FIFO. the buffers are kept as packed integers, like the registers
+        self.tilesize = matsize * matsize * bitwidth
+        self.fifo_topbuf_count = max(1, int(matsize * matsize / 64))
+        size = 1
+        while pow(2, size) < matsize * matsize / 64:
+            size = size + 1
+        self.fifo_state_mask = 2**size - 1
+        self.fifo_state = 0
+        self.fifo_startup = 0
+        self.fifo_topbuf = [0] * self.fifo_topbuf_count
+        self.fifo_droptile = 0
+        self.fifo_full = 0
+        self.fifo_buf2 = 0
+        self.fifo_buf3 = 0
+        self.fifo_buf4 = 0
+        self.fifo_empty2 = 0
+        self.fifo_empty3 = 0
+        self.fifo_empty4 = 0
+        self.cells = np.zeros((matsize, matsize), dtype=np.uint64)
+        self.cells_tile = 0
+
+        # systolic_setup. sys_rows[k] is the UB row read k+1 cycles ago; row r
+        # of the MM array gets element r of sys_rows[r]. sys_addr/we/clear[k]
+        # are MMU_top's accumulator write controls from k+1 cycles ago, which
+        # reach accumulator i after matsize+1+i cycles
+        self.sys_rows = np.zeros((matsize, matsize), dtype=np.uint64)
+        self.sys_addr = np.zeros(2*matsize, dtype=np.int64)
+        self.sys_we = np.zeros(2*matsize, dtype=bool)
+        self.sys_clear = np.zeros(2*matsize, dtype=bool)
+        self.diagonal = (np.arange(matsize), np.arange(matsize))
+        self.columns = np.arange(matsize)
+
+        # MMArray: mac_data_reg_i_j and mac_acc_reg_i_j
+        self.mac_data = np.zeros((matsize, matsize), dtype=np.uint64)
+        self.mac_acc = np.zeros((matsize, matsize), dtype=np.uint64)
+
+        # the FIFO registers as the final cycle saw them, which is what
+        # runtpu.py reads back with sim.inspect
+        self.seen_fifo = None
+
+        # outputs of the last cycle
+        self.halt = 0
+        self.hostmem_re = 0
+        self.hostmem_raddr = 0
+        self.hostmem_we = 0
+        self.hostmem_waddr = 0
+        self.hostmem_wdata = None
+        self.weights_dram_read = 0
+        self.weights_dram_raddr = 0
+
+    # simulate one clock cycle with the given top-level inputs
+    def step(self, weights_dram_in, weights_dram_valid, hostmem_rdata):
+        N = self.matsize
+        mask = self.mask
+        hd = self.hazard_detection
+        pc = self.tpu_pc
+        first_cycle = self.act_first_cycle
+
+        self.seen_fifo = (self.fifo_buf4, self.fifo_buf3, self.fifo_buf2,
+                          list(self.fifo_topbuf), self.fifo_empty4,
+                          self.fifo_empty3, self.fifo_empty2, self.fifo_full)
+
+        ############################################################
+        #  Decoder
+        ############################################################
+
+        op, iflags, ilength, memaddr, ubaddr = self.imem.get(pc, (0, 0, 0, 0, 0))
+        dispatch_mm = dispatch_act = dispatch_rhm = dispatch_whm = 0
+        dispatch_halt = dispatch_nop = weights_read = 0
+        whm_length = 0
+        if hd and (self.tpu_mmc_busy or self.tpu_act_busy or
+                   self.tpu_rhm_busy or self.tpu_whm_busy or self.tpu_rw_busy):
+            pass
+        elif op == isa.OPCODE2BIN['NOP'][0]:
+            dispatch_nop = int(hd)
+        elif op == isa.OPCODE2BIN['WHM'][0]:
+            dispatch_whm = 1
+            whm_length = ilength
+        elif op == isa.OPCODE2BIN['RW'][0]:
+            weights_read = 1
+        elif op == isa.OPCODE2BIN['MMC'][0]:
+            dispatch_mm = 1
+        elif op == isa.OPCODE2BIN['ACT'][0]:
+            dispatch_act = 1
+        elif op == isa.OPCODE2BIN['RHM'][0]:
+            dispatch_rhm = 1
+        elif op == isa.OPCODE2BIN['HLT'][0]:
+            dispatch_halt = 1
+        switch = iflags & isa.SWITCH_MASK
+
+        ############################################################
+        #  Memory reads, before this cycle's writes
+        ############################################################
+
+        ub2mm = self.ubuffer[self.mmu_top_ub_raddr].copy()
+        addrbuf = int(self.ubuffer[self.ub_mask][0])
+        vec_addr = addrbuf >> self.split_point
+        col_addr = addrbuf & ((1 << self.split_point) - 1)
+        ubuffer_out = self.ubuffer[self.tpu_whm_ub_addr]
+        accum_out = self.acc_mems[self.act_accum_addr]
+
+        ############################################################
+        #  Matrix Multiply Unit
+        ############################################################
+
+        vec_valid = int(not dispatch_mm and self.busy_matrix)
+
+        # MM array. the MACs multiply by whatever tile is in buf4 this cycle
+        if self.fifo_buf4 != self.cells_tile:
+            self.cells = unpack_tile(self.fifo_buf4, self.bitwidth, N)
+            self.cells_tile = self.fifo_buf4
+        data_in = np.empty_like(self.mac_data)
+        data_in[:, 0] = self.sys_rows[self.diagonal]
+        data_in[:, 1:] = self.mac_data[:, :-1]
+        acc_in = np.zeros_like(self.mac_acc)
+        acc_in[1:] = self.mac_acc[:-1]
+        mouts = self.mac_acc[-1]
+        mac_acc = (self.cells * data_in + acc_in) & np.uint64(mask)
+
+        # accumulators
+        we = self.sys_we[N:]
+        acc_cols = self.columns[we]
+        acc_waddrs = self.sys_addr[N:][we]
+        acc_values = np.where(self.sys_clear[N:][we], mouts[we],
+                              (mouts[we] + self.acc_mems[acc_waddrs, acc_cols])
+                              & np.uint64(mask))
+
+        ############################################################
+        #  Activate Unit
+        ############################################################
+
+        pc_incr_wv = 0
+        pc_absolute_update = 0
+        branch = 0
+        accum_mod = accum_out
+        if first_cycle:
+            code = int(accum_out[-1])
+            # branch
+            if code == 1:
+                if accum_out[-2] == 1:
+                    pc_incr_wv = (int(accum_out[0]) + 1) & self.pc_mask
+                else:
+                    pc_incr_wv = (int(accum_out[1]) + 1) & self.pc_mask
+                branch = 1
+            # equality check
+            elif code == 2:
+                accum_mod = accum_out.copy()
+                accum_mod[-1] = 0
+                accum_mod[0] = accum_out[0] == 0
+                accum_mod[1] = 0
+                pc_incr_wv = 1
+            # less than check. the hardware compares unsigned, so it's never
+            # true
+            elif code == 3:
+                accum_mod = accum_out.copy()
+                accum_mod[-1] = 0
+                accum_mod[0] = 0
+                pc_incr_wv = 1
+            # unconditional jump
+            elif code == 4:
+                accum_mod = np.zeros_like(accum_out)
+                pc_absolute_update = 1
+                pc_incr_wv = int(accum_out[1]) & self.pc_mask
+                branch = 1
+            # normal activation
+            else:
+                pc_incr_wv = 1
+
+        if not hd:
+            if self.act_N == 1 or branch:
+                pc_incr = pc_incr_wv if first_cycle else self.act_pc_incr_reg
+            else:
+                pc_incr = 1
+
+        ############################################################
+        #  Read/Write Host Memory
+        ############################################################
+
+        hostmem_raddr_whm = 0
+        hostmem_we = 0
+        hostmem_waddr = self.tpu_whm_addr
+        hostmem_wdata = None
+        if dispatch_whm:
+            if switch and ilength == 0:
+                hostmem_raddr_whm = vec_addr
+        elif self.tpu_whm_busy:
+            hostmem_we = 1
+            hostmem_wdata = ubuffer_out.copy()
+            if self.tpu_whm_src_reg:
+                hostmem_wdata = hostmem_rdata.copy()
+                hostmem_wdata[col_addr] = ubuffer_out[0]
+
+        # tpu.py writes this condition as
+        # `dispatch_whm & whm_switch & whm_length == 0`, and `==` binds looser
+        # than `&`, so it's the whole AND that gets compared with 0
+        hostmem_re = int(bool(dispatch_rhm or self.tpu_rhm_busy or
+                              (dispatch_whm & switch & whm_length) == 0))
+
+        hostmem_raddr_rhm = 0
+        rhm_row = None
+        if dispatch_rhm:
+            hostmem_raddr_rhm = vec_addr if switch else memaddr
+        elif self.tpu_rhm_busy:
+            hostmem_raddr_rhm = self.tpu_rhm_addr
+            rhm_row = np.zeros(N, dtype=np.uint64)
+            if self.tpu_rhm_src == 0:
+                rhm_row[:] = hostmem_rdata
+            elif self.tpu_rhm_src == 1:
+                rhm_row[0] = hostmem_rdata[col_addr]
+            elif self.tpu_rhm_src == 2:
+                # (pc + 1)[:DWIDTH].sign_extended(DWIDTH), pc + 1 being 13 bits
+                ret_width = min(self.bitwidth, config.IMEM_ADDR_SIZE + 1)
+                ret = (pc + 1) & ((1 << ret_width) - 1)
+                if ret >> (ret_width - 1):
+                    ret |= mask ^ ((1 << ret_width) - 1)
+                rhm_row[1] = ret
+                rhm_row[-1] = 4
+
+        if dispatch_rhm or self.tpu_rhm_busy:
+            hostmem_raddr = hostmem_raddr_rhm
+        else:
+            hostmem_raddr = hostmem_raddr_whm
+
+        ############################################################
+        #  Memory writes
+        ############################################################
+
+        if rhm_row is not None:
+            self.ubuffer[self.tpu_rhm_ub_waddr] = rhm_row
+            self.ub_rows = max(self.ub_rows, self.tpu_rhm_ub_waddr + 1)
+
+        # write the result of activate to the UB, as long as RHM isn't writing
+        # to the same address
+        if self.tpu_act_busy and not branch and \
+                (not self.tpu_rhm_busy or
+                 self.tpu_rhm_ub_waddr != self.act_ub_waddr):
+            self.ubuffer[self.act_ub_waddr] = \
+                activate(accum_mod[np.newaxis], self.act_func, self.bitwidth)[0]
+            self.ub_rows = max(self.ub_rows, self.act_ub_waddr + 1)
+
+        if len(acc_cols):
+            self.acc_mems[acc_waddrs, acc_cols] = acc_values
+            self.acc_rows = max(self.acc_rows, int(acc_waddrs.max()) + 1)
+
+        ############################################################
+        #  Registers
+        ############################################################
+
+        # FIFO
+        advance_fifo = self.mmu_acc_done_countdown == 1
+        cleartop = clear_droptile = 0
+        buf2, buf3, buf4 = self.fifo_buf2, self.fifo_buf3, self.fifo_buf4
+        empty2, empty3, empty4 = self.fifo_empty2, self.fifo_empty3, self.fifo_empty4
+        if not self.fifo_startup:
+            empty2 = empty3 = empty4 = 1
+        elif self.fifo_full and self.fifo_empty2:
+            buf2 = 0
+            for chunk in reversed(self.fifo_topbuf):
+                buf2 = (buf2 << (64*self.bitwidth)) | chunk
+            buf2 &= (1 << self.tilesize) - 1
+            cleartop = 1
+            empty2 = 0
+        elif self.fifo_empty3 and not self.fifo_empty2:
+            buf3 = self.fifo_buf2
+            empty3 = 0
+            empty2 = 1
+        elif self.fifo_empty4 and not self.fifo_empty3:
+            buf4 = self.fifo_buf3
+            empty4 = 0
+            empty3 = 1
+        elif self.fifo_droptile:
+            empty4 = 1
+            clear_droptile = 1
+        self.fifo_buf2, self.fifo_buf3, self.fifo_buf4 = buf2, buf3, buf4
+        self.fifo_empty2, self.fifo_empty3, self.fifo_empty4 = empty2, empty3, empty4
+        self.fifo_startup = 1
+
+        if advance_fifo:
+            self.fifo_droptile = 1
+        elif clear_droptile:
+            self.fifo_droptile = 0
+
+        if weights_dram_valid and self.fifo_state == self.fifo_topbuf_count - 1:
+            self.fifo_full = 1
+        elif cleartop:
+            self.fifo_full = 0
+
+        if weights_dram_valid:
+            if self.fifo_state < self.fifo_topbuf_count:
+                self.fifo_topbuf[self.fifo_topbuf_count - 1 - self.fifo_state] = \
+                    weights_dram_in & ((1 << (64*self.bitwidth)) - 1)
+            self.fifo_state = (self.fifo_state + 1) & self.fifo_state_mask
+        else:
+            self.fifo_state = 0
+
+        # MMU
+        if self.mmu_top_swap_reg:
+            self.mmu_acc_done_countdown = (self.mmu_top_N + 2*N) & 0xFFFFFFFF
+        elif self.mmu_acc_done_countdown > 0:
+            self.mmu_acc_done_countdown -= 1
+
+        # systolic setup and MM array
+        self.sys_rows[1:] = self.sys_rows[:-1]
+        self.sys_rows[0] = ub2mm
+        self.sys_addr[1:] = self.sys_addr[:-1]
+        self.sys_addr[0] = self.mmu_top_accum_waddr
+        self.sys_we[1:] = self.sys_we[:-1]
+        self.sys_we[0] = vec_valid
+        self.sys_clear[1:] = self.sys_clear[:-1]
+        self.sys_clear[0] = self.mmu_top_overwrite_reg
+        self.mac_data = data_in
+        self.mac_acc = mac_acc
+
+        # MMU_top
+        if dispatch_mm:
+            self.mmu_top_accum_waddr = ubaddr & self.acc_mask
+            self.mmu_top_overwrite_reg = (iflags >> isa.OVERWRITE_BIT) & 1
+            self.mmu_top_swap_reg = switch
+            self.busy_matrix = 1
+            self.mmu_top_N = ilength
+            self.mmu_top_ub_raddr = memaddr & self.ub_mask
+        elif self.busy_matrix:
+            self.mmu_top_swap_reg = 0
+            if self.mmu_top_N == 1:
+                self.mmu_top_overwrite_reg = 0
+                self.busy_matrix = 0
+            else:
+                self.mmu_top_ub_raddr = (self.mmu_top_ub_raddr + 1) & self.ub_mask
+                self.mmu_top_accum_waddr = (self.mmu_top_accum_waddr + 1) & self.acc_mask
+            self.mmu_top_N = (self.mmu_top_N - 1) & 0xFFFF
+
+        # in H mode, MMC stays busy for 2*matsize + 5 + length cycles
+        if hd:
+            if dispatch_mm:
+                self.tpu_mmc_busy = 1
+                self.tpu_mmc_N = (2*N + 5 + ilength) & 0xFFFF
+            elif self.tpu_mmc_busy:
+                if self.tpu_mmc_N == 1:
+                    self.tpu_mmc_busy = 0
+                self.tpu_mmc_N = (self.tpu_mmc_N - 1) & 0xFFFF
+
+        # WHM
+        if dispatch_whm:
+            self.tpu_whm_ub_addr = memaddr & self.ub_mask
+            self.tpu_whm_busy = 1
+            if switch:
+                self.tpu_whm_addr = vec_addr
+                self.tpu_whm_N = 1 if ilength == 0 else ilength
+                self.tpu_whm_src_reg = int(ilength == 0)
+            else:
+                self.tpu_whm_addr = ubaddr
+                self.tpu_whm_N = ilength
+                self.tpu_whm_src_reg = 0
+        elif self.tpu_whm_busy:
+            if self.tpu_whm_N == 1:
+                self.tpu_whm_busy = 0
+            self.tpu_whm_N = (self.tpu_whm_N - 1) & 0xFF
+            self.tpu_whm_ub_addr = (self.tpu_whm_ub_addr + 1) & self.ub_mask
+            self.tpu_whm_addr = (self.tpu_whm_addr + 1) & self.host_mask
+
+        # RHM
+        if dispatch_rhm:
+            self.tpu_rhm_busy = 1
+            self.tpu_rhm_ub_waddr = ubaddr & self.ub_mask
+            if switch:
+                self.tpu_rhm_N = 1 if ilength == 0 else ilength
+                self.tpu_rhm_addr = (vec_addr + 1) & self.host_mask
+                self.tpu_rhm_src = int(ilength == 0)
+            elif iflags & isa.CONV_MASK:
+                self.tpu_rhm_N = 1
+                self.tpu_rhm_addr = (memaddr + 1) & self.host_mask
+                self.tpu_rhm_src = 2
+            else:
+                self.tpu_rhm_N = ilength
+                self.tpu_rhm_addr = (memaddr + 1) & self.host_mask
+                self.tpu_rhm_src = 0
+        elif self.tpu_rhm_busy:
+            if self.tpu_rhm_N == 1:
+                self.tpu_rhm_busy = 0
+            self.tpu_rhm_N = (self.tpu_rhm_N - 1) & 0xFF
+            self.tpu_rhm_addr = (self.tpu_rhm_addr + 1) & self.host_mask
+            self.tpu_rhm_ub_waddr = (self.tpu_rhm_ub_waddr + 1) & self.ub_mask
+
+        # activate
+        if not hd and first_cycle:
+            self.act_pc_incr_reg = pc_incr_wv
+        self.act_first_cycle = dispatch_act
+        if dispatch_act:
+            self.act_accum_addr = memaddr & self.acc_mask
+            self.act_ub_waddr = ubaddr & self.ub_mask
+            self.act_N = ilength
+            self.act_func = (iflags & isa.ACT_FUNC_MASK) >> isa.FUNC_RELU_BIT
+            self.tpu_act_busy = 1
+        elif self.tpu_act_busy:
+            self.act_accum_addr = (self.act_accum_addr + 1) & self.acc_mask
+            self.act_ub_waddr = (self.act_ub_waddr + 1) & self.ub_mask
+            if self.act_N == 1 or branch:
+                self.tpu_act_busy = 0
+            self.act_N = (self.act_N - 1) & 0xFF
+
+        # in H mode, RW stays busy for ceil(matsize^2/64) + 5 cycles
+        if hd:
+            if weights_read:
+                self.tpu_rw_N = math.ceil(N*N/64) + 4
+                self.tpu_rw_busy = 1
+            elif self.tpu_rw_busy:
+                if self.tpu_rw_N == 1:
+                    self.tpu_rw_busy = 0
+                self.tpu_rw_N = (self.tpu_rw_N - 1) & self.weight_addr_mask
+
+        # PC
+        if hd:
+            if dispatch_mm or dispatch_rhm or dispatch_whm or weights_read or \
+                    dispatch_nop:
+                self.tpu_pc = (pc + 1) & self.pc_mask
+            elif dispatch_act:
+                pass
+            elif first_cycle:
+                if pc_absolute_update:
+                    self.tpu_pc = pc_incr_wv
+                else:
+                    self.tpu_pc = (pc + pc_incr_wv) & self.pc_mask
+        else:
+            if pc_absolute_update:
+                self.tpu_pc = pc_incr
+            else:
+                self.tpu_pc = (pc + pc_incr) & self.pc_mask
+
+        # outputs
+        self.halt = dispatch_halt
+        self.hostmem_re = hostmem_re
+        self.hostmem_raddr = hostmem_raddr & self.host_mask
+        self.hostmem_we = hostmem_we
+        self.hostmem_waddr = hostmem_waddr
+        self.hostmem_wdata = hostmem_wdata
+        self.weights_dram_read = weights_read
+        self.weights_dram_raddr = memaddr & self.weight_addr_mask
+
+    # run until the TPU raises halt, driving the host and weight DRAMs the same
+    # way runtpu.py does, and return the number of cycles simulated
+    def run(self):
+        N = self.matsize
+        chunkmask = pow(2, 64*self.bitwidth) - 1
+        zeros = np.zeros(N, dtype=np.uint64)
+
+        self.step(0, 0, zeros)
+        cycle = 0
+        while not self.halt:
+            weights_dram_in = weights_dram_valid = 0
+            hostmem_rdata = zeros
+
+            # read weights
+            if self.chunkaddr < self.nchunks:
+                shift = int((self.nchunks - self.chunkaddr - 1)*64*self.bitwidth)
+                weights_dram_in = (self.weighttile >> shift) & chunkmask
+                weights_dram_valid = 1
+                self.chunkaddr += 1
+
+            # read host memory
+            if self.hostmem_re and self.hostmem_raddr in self.hostmem:
+                hostmem_rdata = self.hostmem[self.hostmem_raddr]
+
+            # write host memory
+            if self.hostmem_we:
+                self.hostmem[self.hostmem_waddr] = self.hostmem_wdata
+
+            # start a weight read
+            if self.weights_dram_read:
+                self.weighttile = self.weightsmem[self.weights_dram_raddr]
+                self.chunkaddr = 0
+
+            self.step(weights_dram_in, weights_dram_valid, hostmem_rdata)
+            cycle += 1
+        return cycle
+
+    # the final memories, in the format runtpu.py returns them
+    def get_mems(self):
+        N = self.matsize
+        hm = np.zeros((max(self.hostmem.keys()) + 1, N), dtype=np.uint64)
+        for a, row in self.hostmem.items():
+            hm[a] = row
+
+        wm = unpack_tiles([self.weightsmem[a] for a in range(len(self.weightsmem))],
+                          self.bitwidth, N)
+
+        ub = self.ubuffer[:self.ub_rows]
+        acc = self.acc_mems[:self.acc_rows]
+
+        # the weight queue, front tile first
+        buf4, buf3, buf2, topbuf, empty4, empty3, empty2, full = self.seen_fifo
+        buf1 = 0
+        for chunk in reversed(topbuf):
+            buf1 = (buf1 << (64*self.bitwidth)) | chunk
+        full_slots = (not empty4) + (not empty3) + (not empty2) + full
+        wq = unpack_tiles((buf4, buf3, buf2, buf1)[:full_slots], self.bitwidth, N)
+
+        return tuple(m.astype(int) for m in (hm, wm, ub, wq, acc))
+
+
+def cyclesim(prog: str, hostmem_filename: str, weightsmem_filename: str,
+             bitwidth: int, matsize: int, output_folder: str,
+             hazard_detection: bool = config.HAZARD_DETECTION):
+    tpu = CycleSim(load_program(prog), np.load(hostmem_filename),
+                   np.load(weightsmem_filename), bitwidth, matsize,
+                   hazard_detection)
+    cycle = tpu.run()
+    print("Simulation terminated at cycle {}".format(cycle))
+
+    hm, wm, ub, wq, acc = tpu.get_mems()
+    os.makedirs(output_folder, exist_ok=True)
+    np.savez_compressed(f"{output_folder}/cyclesim", hm=hm, wm=wm, ub=ub,
+                        wq=wq, acc=acc)
+    return hm, wm, ub, wq, acc
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Run a cycle-accurate model of the TPU hardware on the indicated program, without PyRTL.")
+    parser.add_argument("prog", metavar="program.bin", help="A valid binary program for OpenTPU.")
+    parser.add_argument("hostmem", metavar="HostMemoryArray", help="A file containing a numpy array containing the initial contents of host memory. Each row represents one vector.")
+    parser.add_argument("weightsmem", metavar="WeightsMemoryArray", help="A file containing a numpy array containing the contents of the weights memroy. Each row represents one tile (the first row corresponds to the top row of the weights matrix).")
+    parser.add_argument("-b", "--bitwidth", type=int, default=32, help="The bitwidth of the data.")
+    parser.add_argument("-m", "--matsize", type=int, default=8, help="The size of the matrix.")
+    parser.add_argument("-f", "--folder", type=str, default=None, help="The output folder path.")
+    parser.add_argument("--hazard-detection", action="store_true", default=config.HAZARD_DETECTION, help="Model the hardware built with hazard detection (H mode). Defaults to config.HAZARD_DETECTION.")
+    args = parser.parse_args()
+
+    if not args.folder:
+        args.folder = f'{datetime.now().strftime("%Y-%m-%d_%H:%M:%S")}_{args.bitwidth}b_{args.matsize}m'
+
+    hm, wm, ub, fq, acc = cyclesim(args.prog, args.hostmem, args.weightsmem,
+                                   args.bitwidth, args.matsize, args.folder,
+                                   args.hazard_detection)
+
+    print_mems(hm, wm, ub, fq, acc, args.matsize)
@@ -1,26 +1,20 @@
-import pickle
+import os
+import sys
 from sys import stdout, set_int_max_str_digits
-import pyrtl
 
-set_int_max_str_digits(10000)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from streamtrace import TraceReader
 
-# load pyrtl traces from pickle file
-with open('../mmc_rw_empty_no_s_32b_32m_74d/trace.pkl', 'rb') as file:
-	sim_trace1 = pickle.load(file)
+set_int_max_str_digits(10000)
 
-with open('../mmc_rw_empty_no_s_32b_32m_75d/trace.pkl', 'rb') as file:
-	sim_trace2 = pickle.load(file)
+# open the traces written by runtpu.py. values are only read from disk when a
+# function below asks for them
+trace1 = TraceReader('../mmc_rw_empty_no_s_32b_32m_74d/trace')
+trace2 = TraceReader('../mmc_rw_empty_no_s_32b_32m_75d/trace')
 
 # get all the non-const wire names
-t1_wires = set()
-for wn in sim_trace1.trace:
-	if wn.find('const') != 0:
-		t1_wires.add(wn)
-
-t2_wires = set()
-for wn in sim_trace2.trace:
-	if wn.find('const') != 0:
-		t2_wires.add(wn)
+t1_wires = set(wn for wn in trace1.wire_names if wn.find('const') != 0)
+t2_wires = set(wn for wn in trace2.wire_names if wn.find('const') != 0)
 
 # union = t1_wires.union(t2_wires)
 # diff1 = t1_wires.difference(t2_wires)
@@ -28,43 +22,52 @@ for wn in sim_trace2.trace:
 # diff = diff1.union(diff2)
 # print(diff)
 
-# load all the shared wires into objs1 and objs2
-# objs1[i][j] is the value of wire i (in alphabetical order excluding wires not in sim_trace2) at cycle j
-# and vice-versa for objs2[i][j]
+# the wires in both traces, in alphabetical order
 wire_names = sorted(list(t1_wires.intersection(t2_wires)))
+common_cycle_len = min(len(trace1), len(trace2))
 
-t1_objs = []
-for wn in wire_names:
-	t1_objs.append(sim_trace1.trace[wn])
-
-t2_objs = []
-for wn in wire_names:
-	t2_objs.append(sim_trace2.trace[wn])
+# how many cycles of every wire to read at once
+WINDOW = 256
 
 
-# print all the differences between each wire in trace1 and trace2 for every cycle
-def print_all_diffs():
-	with open('differences.txt', 'w') as file:
-		diffs = False
+# read cycles lo to hi-1 of trace1 and the same number of cycles of trace2
+# starting `offset` cycles later, a window at a time. yields
+# (first cycle, trace1 values, trace2 values), each {wire name: values}
+def windows(lo, hi, offset=0, names=wire_names):
+	for first in range(lo, hi, WINDOW):
+		last = min(first + WINDOW, hi)
+		yield first, trace1.cycles(first, last, names), \
+			  trace2.cycles(first + offset, last + offset, names)
 
-		trace1_cycle_len = len(t1_objs[0])
-		trace2_cycle_len = len(t2_objs[0])
-		common_cycle_len = min(trace1_cycle_len, trace2_cycle_len)
-		wire_count = len(t1_objs)
 
-		# for each cycle...
-		for cycle in range(common_cycle_len):
+# print the wires that differ between trace1 at cycles lo to hi-1 and trace2
+# `offset` cycles later. returns whether anything differed
+def print_diffs(lo, hi, offset, file, ignore=lambda v1, v2: False):
+	diffs = False
+	for first, vals1, vals2 in windows(lo, hi, offset):
+		for i in range(len(vals1[wire_names[0]]) if wire_names else 0):
+			cycle = first + i
 			inequality = False
-			
-			# ...print each wire with a different value in the two traces
-			for wire_index in range(wire_count):
-				if t1_objs[wire_index][cycle] != t2_objs[wire_index][cycle] and not (t1_objs[wire_index][cycle] == 8 and t2_objs[wire_index][cycle] == 32):
+			for wn in wire_names:
+				v1, v2 = vals1[wn][i], vals2[wn][i]
+				if v1 != v2 and not ignore(v1, v2):
 					if not inequality: # only print cycle number if there are differences in that cycle, and only once
 						inequality = True
-						print(f"Cycle #{cycle}:", file=file)
-					print(f"\t{wire_names[wire_index]}: {t1_objs[wire_index][cycle]} vs {t2_objs[wire_index][cycle]}", file=file)
+						if offset:
+							print(f"Cycle #{cycle}, {cycle+offset}:", file=file)
+						else:
+							print(f"Cycle #{cycle}:", file=file)
+					print(f"\t{wn}: {v1} vs {v2}", file=file)
 					diffs = True
-		
+	return diffs
+
+
+# print all the differences between each wire in trace1 and trace2 for every cycle
+def print_all_diffs():
+	with open('differences.txt', 'w') as file:
+		diffs = print_diffs(0, common_cycle_len, 0, file,
+							ignore=lambda v1, v2: v1 == 8 and v2 == 32)
+
 		# print if there are no differences to rule out any bugs that would incorrectly leave the file empty
 		if not diffs: 
 			print("No differences found.", file=file)
@@ -74,45 +77,14 @@ def print_all_diffs():
 # this lets you see the true differences in two squishtest traces with different distances between i1 and i2
 def print_all_diffs_offset(start=0, offset=1, length=0, file=stdout):
 	with open('differences_offset.txt', 'w') as file:
-		diffs = False
-
-		trace1_cycle_len = len(t1_objs[0])
-		trace2_cycle_len = len(t2_objs[0])
-		common_cycle_len = min(trace1_cycle_len, trace2_cycle_len)
-		wire_count = len(t1_objs)
-
 		# print comparison for each wire in each trace up to the start point
-		for cycle in range(min(common_cycle_len, start)):
-			inequality = False
-			for wire_index in range(wire_count):
-				if t1_objs[wire_index][cycle] != t2_objs[wire_index][cycle]:
-					if not inequality:
-						inequality = True
-						print(f"Cycle #{cycle}:", file=file)
-					print(f"\t{wire_names[wire_index]}: {t1_objs[wire_index][cycle]} vs {t2_objs[wire_index][cycle]}", file=file)
-					diffs = True
+		diffs = print_diffs(0, min(common_cycle_len, start), 0, file)
 
 		# print the offset segments of traces 1 and 2
-		for cycle in range(start, min(common_cycle_len - offset, start + length - 1)):
-			inequality = False
-			for wire_index in range(wire_count):
-				if t1_objs[wire_index][cycle] != t2_objs[wire_index][cycle+offset]:
-					if not inequality:
-						inequality = True
-						print(f"Cycle #{cycle}, {cycle+offset}:", file=file)
-					print(f"\t{wire_names[wire_index]}: {t1_objs[wire_index][cycle]} vs {t2_objs[wire_index][cycle+offset]}", file=file)
-					diffs = True
+		diffs |= print_diffs(start, min(common_cycle_len - offset, start + length - 1), offset, file)
 
 		# for every value in the wire in each trace after the end point
-		for cycle in range(start + length + offset, common_cycle_len):
-			inequality = False
-			for wire_index in range(wire_count):
-				if t1_objs[wire_index][cycle] != t2_objs[wire_index][cycle]:
-					if not inequality:
-						inequality = True
-						print(f"Cycle #{cycle}:", file=file)
-					print(f"\t{wire_names[wire_index]}: {t1_objs[wire_index][cycle]} vs {t2_objs[wire_index][cycle]}", file=file)
-					diffs = True
+		diffs |= print_diffs(start + length + offset, common_cycle_len, 0, file)
 
 		# print if there are no differences to rule out any bugs that would incorrectly leave the file empty
 		if not diffs: 
@@ -124,8 +96,8 @@ def print_wire_2(wire_name, file=stdout):
 	if file != stdout:
 		file = open(file, 'w')
 	
-	vals1 = t1_objs[wire_names.index(wire_name)]
-	vals2 = t2_objs[wire_names.index(wire_name)]
+	vals1 = trace1.wire(wire_name)
+	vals2 = trace2.wire(wire_name)
 
 	# for every value in the wire in each trace, print their values and if they're the same or not
 	for i in range(min(len(vals1), len(vals2))):
@@ -146,24 +118,18 @@ def print_wire_2_prefix(wire_prefixes, file=stdout):
 	if type(wire_prefixes) != list:
 		wire_prefixes = [wire_prefixes]
 	
-	filtered_objs1 = []
-	filtered_objs2 = []
-	filtered_wire_names = []
-	for wn in wire_names:
-		for wire_prefix in wire_prefixes:
-			if wn.find(wire_prefix) == 0:
-				filtered_wire_names.append(wn)
-				filtered_objs1.append(t1_objs[wire_names.index(wn)])
-				filtered_objs2.append(t2_objs[wire_names.index(wn)])
+	filtered_wire_names = [wn for wn in wire_names 
+						   if any(wn.find(wire_prefix) == 0 for wire_prefix in wire_prefixes)]
 	
 	# for every value in the wire in each trace, print their values and if they're the same or not
-	for i in range(len(filtered_objs1[0])):
-		print(f"#{i}:", file=file)
-		for j in range(len(filtered_wire_names)):
-			if filtered_objs1[j][i] == filtered_objs2[j][i]:
-				print(f"\t{filtered_wire_names[j]} (same) = {filtered_objs1[j][i]}", file=file)
-			else:
-				print(f"\t{filtered_wire_names[j]} (diff) = {filtered_objs1[j][i]} vs {filtered_objs2[j][i]}", file=file)
+	for first, vals1, vals2 in windows(0, common_cycle_len, names=filtered_wire_names):
+		for i in range(len(vals1[filtered_wire_names[0]])):
+			print(f"#{first + i}:", file=file)
+			for wn in filtered_wire_names:
+				if vals1[wn][i] == vals2[wn][i]:
+					print(f"\t{wn} (same) = {vals1[wn][i]}", file=file)
+				else:
+					print(f"\t{wn} (diff) = {vals1[wn][i]} vs {vals2[wn][i]}", file=file)
 
 	if file != stdout:
 		file.close()
@@ -174,8 +140,8 @@ def print_wire_2_offset(wire_name, start=0, offset=1, length=0, file=stdout):
 	if file != stdout:
 		file = open(file, 'w')
 	
-	vals1 = t1_objs[wire_names.index(wire_name)]
-	vals2 = t2_objs[wire_names.index(wire_name)]
+	vals1 = trace1.wire(wire_name)
+	vals2 = trace2.wire(wire_name)
 
 	# for every value in the wire in each trace up to the start point
 	for i in range(min(len(vals1), len(vals2), start)):
@@ -217,9 +183,9 @@ def print_wire_1(trace_num, wire_name, file=stdout):
 
 	vals = []
 	if trace_num == 1:
-		vals = t1_objs[wire_names.index(wire_name)]
+		vals = trace1.wire(wire_name)
 	if trace_num == 2:
-		vals = t2_objs[wire_names.index(wire_name)]
+		vals = trace2.wire(wire_name)
 
 	for i in range(len(vals)):
 		print(f"#{i}: {wire_name} = {vals[i]}", file=file)
@@ -233,12 +199,10 @@ def full_cycle_1(trace_num, cycle_num, file=stdout):
 	if file != stdout:
 		file = open(file, 'w')
 
-	if trace_num == 1:
-		for i in range(len(t1_objs)):
-			print(f"{wire_names[i]} = {t1_objs[i][cycle_num]}", file=file)
-	if trace_num == 2:
-		for i in range(len(t2_objs)):
-			print(f"{wire_names[i]} = {t2_objs[i][cycle_num]}", file=file)
+	trace = trace1 if trace_num == 1 else trace2
+	vals = trace.cycles(cycle_num, cycle_num + 1, wire_names)
+	for wn in wire_names:
+		print(f"{wn} = {vals[wn][0]}", file=file)
 
 	if file != stdout:
 		file.close()
@@ -1,24 +1,17 @@
-import pickle
+import os
+import sys
 from sys import stdout
-import pyrtl
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from streamtrace import TraceReader
 
-# load pyrtl trace from pickle file
-with open('../f0/trace.pkl', 'rb') as file:
-	sim_trace = pickle.load(file)
 
-# get all the non-const wire names
-wires = set()
-for wn in sim_trace.trace:
-	if wn.find('const') != 0:
-		wires.add(wn)
+# open the trace written by runtpu.py. values are only read from disk when a
+# function below asks for them
+trace = TraceReader('../f0/trace')
 
-# load all the wires into objs
-# objs[i][j] is the value of wire i (in alphabetical order) at cycle j
-wire_names = sorted(list(wires))
-objs = []
-for wn in wire_names:
-	objs.append(sim_trace.trace[wn])
+# get all the non-const wire names, in alphabetical order
+wire_names = [wn for wn in trace.wire_names if wn.find('const') != 0]
 
 
 # print the values of wire_name for each cycle
@@ -26,7 +19,7 @@ def print_wire_1(wire_name, file=stdout):
 	if file != stdout:
 		file = open(file, 'w')
 
-	vals = objs[wire_names.index(wire_name)]
+	vals = trace.wire(wire_name)
 	for i in range(len(vals)):
 		print(f"#{i}: {wire_name} = {vals[i]}", file=file)
 
@@ -39,24 +32,17 @@ def print_wire_prefix(wire_prefixes, file=stdout):
 	if file != stdout:
 		file = open(file, 'w')
 
-	if type(wire_prefixes) != list:
-		wire_prefixes = [wire_prefixes]
-
 	# filter out wires that don't have the prefix
-	filtered_objs = []
-	filtered_wire_names = []
-	for wn in wire_names:
-		for wire_prefix in wire_prefixes:
-			if wn.find(wire_prefix) == 0:
-				filtered_wire_names.append(wn)
-				filtered_objs.append(objs[wire_names.index(wn)])
-
-	# print the values of the filtered wires for each cycle 
-	for i in range(len(filtered_objs[0])):
-		print(f"#{i}:", file=file)
-		for j in range(len(filtered_wire_names)):
-			print(f"\t{filtered_wire_names[j]} = {filtered_objs[j][i]}", file=file)
-			
+	filtered_wire_names = [wn for wn in trace.names_with_prefix(wire_prefixes)
+						   if wn in wire_names]
+
+	# print the values of the filtered wires for each cycle
+	for first, vals in trace.blocks(names=filtered_wire_names):
+		for i in range(len(vals[filtered_wire_names[0]])):
+			print(f"#{first + i}:", file=file)
+			for wn in filtered_wire_names:
+				print(f"\t{wn} = {vals[wn][i]}", file=file)
+
 	if file != stdout:
 		file.close()
 
@@ -66,31 +52,39 @@ def print_cycle_diff(file=stdout):
 	if file != stdout:
 		file = open(file, 'w')
 
-	# iterate through each cycle
-	for cycle in range(1, len(objs[0])):
-		print(f"Cycle {cycle-1} -> {cycle}:", file=file)
-		print(cycle, end = ' ') # log progress to console
-		
-		# go through each wire value and print if it has changed
-		for w_index, wn in enumerate(wire_names):	
-			if objs[w_index][cycle] != objs[w_index][cycle-1]: 
-				print(f"\t{wn}: {objs[wire_names.index(wn)][cycle-1]} -> {objs[wire_names.index(wn)][cycle]}", file=file)
-	
+	# iterate through each cycle, remembering the last one of the previous block
+	prev = None
+	for first, vals in trace.blocks(names=wire_names):
+		for i in range(len(vals[wire_names[0]])):
+			cycle = first + i
+			if prev is not None:
+				print(f"Cycle {cycle-1} -> {cycle}:", file=file)
+				print(cycle, end = ' ') # log progress to console
+
+				# go through each wire value and print if it has changed
+				for wn in wire_names:
+					if vals[wn][i] != prev[wn]:
+						print(f"\t{wn}: {prev[wn]} -> {vals[wn][i]}", file=file)
+			prev = {wn: vals[wn][i] for wn in wire_names}
+
 	if file != stdout:
 		file.close()
 
 
 # find all the unique wires that change between cycles start and end
 def find_changed_wires(start, end, file=stdout):
-	
-	# go through each cycle change (from start -> start+1 to end-1 -> end) 
+
+	# go through each cycle change (from start -> start+1 to end-1 -> end)
 	# and create a set of unique wires that change
 	changed_wires = set()
-	for cycle in range(start, end):
-		for w_index, wn in enumerate(wire_names):
-			if objs[w_index][cycle] != objs[w_index][cycle+1]:
+	prev = None
+	for first, vals in trace.blocks(start, end + 1, wire_names):
+		for wn in wire_names:
+			wire_vals = vals[wn] if prev is None else [prev[wn]] + vals[wn]
+			if any(a != b for a, b in zip(wire_vals, wire_vals[1:])):
 				changed_wires.add(wn)
-	
+		prev = {wn: vals[wn][-1] for wn in wire_names}
+
 	if file != stdout:
 		file = open(file, 'w')
 
@@ -0,0 +1,160 @@
+"""
+Turns program binaries back into assembly that assembler.py reads, with a
+comment on each line giving the PC and what the instruction does:
+
+    RHM 0, 0, 8                 # 0: host[0:8] -> UB[0:8]
+    RW 0                        # 1: weight tile 0 -> FIFO
+    MMC.SO 0, 0, 8              # 2: UB[0:8] x weights -> acc[0:8], overwrite, switch
+    ACT.R 0, 8, 8               # 3: relu(acc[0:8]) -> UB[8:16]
+    HLT                         # 4: halt
+
+Operands are written in the order the assembler takes them (see
+assembler.assemble_line), and flags as the letters it reads. A word that
+isn't an instruction the assembler can write (an unknown opcode, reserved
+flag bits, or fields an opcode doesn't use that aren't 0) comes out as
+`.word`, so assembling the output always gives back the same binary.
+
+Binaries are read memory-mapped and a chunk at a time, so they can be bigger
+than memory.
+
+    python disassembler.py prog.out [-o prog.dis.a] [--plain]
+"""
+
+import argparse
+import functools
+import io
+import sys
+from typing import Optional, TextIO
+
+import numpy as np
+
+from assembler import assemble_text
+from isa import *
+from program import INSTR_DTYPE, decode_records, map_program, raw_records
+
+# the flag letters the assembler reads, and the bits they set
+FLAG_LETTERS = [('S', SWITCH_MASK), ('C', CONV_MASK), ('O', OVERWRITE_MASK),
+                ('R', FUNC_RELU_MASK), ('Q', FUNC_SIGMOID_MASK)]
+KNOWN_FLAGS = SWITCH_MASK | CONV_MASK | OVERWRITE_MASK | ACT_FUNC_MASK
+
+ACT_FUNCS = {0: 'none', 1: 'relu', 2: 'sigmoid', 3: 'func 3'}
+
+# the number of instructions decoded at a time
+CHUNK = 1 << 16
+
+def word(op, flags, length, addr, ubaddr):
+    return op << (8*OP_START) | flags << (8*FLAGS_START) | \
+           length << (8*LEN_START) | addr << (8*ADDR_START) | ubaddr
+
+# the assembly for one decoded instruction, and a note on what it does
+@functools.lru_cache(maxsize=65536)
+def disassemble_instr(op, flags, length, addr, ubaddr):
+    name = BIN2OPCODE.get(op)
+    if name is None:
+        return '.word 0x{:028x}'.format(word(op, flags, length, addr, ubaddr)), \
+               'unknown opcode {}'.format(op)
+    if flags & ~KNOWN_FLAGS:
+        return '.word 0x{:028x}'.format(word(op, flags, length, addr, ubaddr)), \
+               '{} with reserved flag bits set'.format(name)
+
+    if name in ('NOP', 'HLT'):
+        if flags or length or addr or ubaddr:
+            return '.word 0x{:028x}'.format(word(op, flags, length, addr, ubaddr)), \
+                   '{} with fields set'.format(name)
+        return name, 'halt' if name == 'HLT' else ''
+
+    mnemonic = name
+    letters = ''.join(letter for letter, mask in FLAG_LETTERS if flags & mask)
+    if letters:
+        mnemonic += '.' + letters
+
+    if name == 'RW':
+        if length or ubaddr:
+            return '.word 0x{:028x}'.format(word(op, flags, length, addr, ubaddr)), \
+                   'RW with fields set'
+        return '{} {}'.format(mnemonic, addr), 'weight tile {} -> FIFO'.format(addr)
+
+    # RHM and ACT write the UB at ubaddr; WHM and MMC read it at addr and
+    # write host memory or the accumulators at ubaddr (see decoder.py)
+    if name in ('RHM', 'ACT'):
+        text = '{} {}, {}, {}'.format(mnemonic, addr, ubaddr, length)
+        ub = 'UB[{}:{}]'.format(ubaddr, ubaddr + length)
+    else:
+        text = '{} {}, {}, {}'.format(mnemonic, ubaddr, addr, length)
+        ub = 'UB[{}:{}]'.format(addr, addr + length)
+
+    if name == 'RHM':
+        note = 'host[{}:{}] -> {}'.format(addr, addr + length, ub)
+    elif name == 'WHM':
+        note = '{} -> host[{}:{}]'.format(ub, ubaddr, ubaddr + length)
+    elif name == 'MMC':
+        note = '{} x weights -> acc[{}:{}]'.format(ub, ubaddr, ubaddr + length)
+        note += ', overwrite' if flags & OVERWRITE_MASK else ', accumulate'
+        if flags & SWITCH_MASK:
+            note += ', switch'
+        if flags & CONV_MASK:
+            note += ', convolve'
+    elif name == 'ACT':
+        func = ACT_FUNCS[(flags & ACT_FUNC_MASK) >> FUNC_RELU_BIT]
+        note = '{}(acc[{}:{}]) -> {}'.format(func, addr, addr + length, ub)
+    else:
+        note = name.lower()
+    return text, note
+
+# write the assembly for raw instructions (as program.map_program or
+# raw_records give) to `out`, a chunk at a time
+def disassemble_records(raw: np.ndarray, out: TextIO, annotate: bool = True):
+    for start in range(0, len(raw), CHUNK):
+        fields = decode_records(raw[start:start + CHUNK], check_opcodes=False)
+        columns = [fields[name].tolist() for name in INSTR_DTYPE.names]
+        lines = []
+        for pc, instr in enumerate(zip(*columns), start):
+            text, note = disassemble_instr(*instr)
+            if annotate:
+                text = '{:<27} # {}'.format(text, pc) + (': ' + note if note else '')
+            lines.append(text + '\n')
+        out.write(''.join(lines))
+
+def disassemble(data: bytes, annotate: bool = True) -> str:
+    """ Translates a binary into assembly.
+    """
+
+    out = io.StringIO()
+    disassemble_records(raw_records(data), out, annotate)
+    return out.getvalue()
+
+def disassemble_file(path: str, out: TextIO, annotate: bool = True):
+    """ Translates the binary at `path` into assembly, written to `out`.
+    """
+
+    disassemble_records(map_program(path), out, annotate)
+
+def round_trip(data: bytes) -> Optional[int]:
+    """ Disassembles a binary and assembles the result. Returns None if that
+    gives back the same binary, or the first PC where it doesn't.
+    """
+
+    again = assemble_text(disassemble(data, annotate=False))
+    if again == data:
+        return None
+    for pc in range(0, max(len(data), len(again)), INSTRUCTION_WIDTH_BYTES):
+        if data[pc:pc + INSTRUCTION_WIDTH_BYTES] != again[pc:pc + INSTRUCTION_WIDTH_BYTES]:
+            return pc // INSTRUCTION_WIDTH_BYTES
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Turn a program binary back into assembly.')
+    parser.add_argument('path', help='path to the binary.')
+    parser.add_argument('-o', '--output', help='file to write the assembly to (default: stdout).')
+    parser.add_argument('--plain', action='store_true',
+                        help="leave out the comments with each instruction's PC and meaning.")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.output:
+        with open(args.output, 'w') as out:
+            disassemble_file(args.path, out, not args.plain)
+    else:
+        disassemble_file(args.path, sys.stdout, not args.plain)
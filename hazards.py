@@ -0,0 +1,426 @@
+"""
+Finds the hazards in a program for a TPU without hazard detection (config.py's
+HAZARD_DETECTION = False, N mode), and pads programs with as few NOPs as it
+takes to keep clear of them.
+
+In N mode the TPU issues an instruction every cycle whether or not the ones
+before it are done, so a program is only correct if every instruction is far
+enough from the earlier instructions it depends on. How far that is, is what
+the squishtest sweep measures (test/squish/entry_point.py): its results.json
+holds, for each pair of instruction kinds, matsize, lengths, placement of the
+second instruction's addresses relative to the first's and the number of
+weights in the FIFO, the smallest distance at which the pair still gave the
+right result. LatencyModel reads that table and answers, for any two
+instructions of a program, the distance they need:
+
+    - the kinds are those of the sweep: rhm, rhms (RHM.S of a cell),
+      rhmv (RHM.S of a vector), rhmc (RHM.C), whm, rw, mmc, mmcs (MMC.S), act
+      and hlt
+    - the addresses the two instructions touch in host memory, the UB and the
+      accumulators are compared; the distance is the longest the sweep
+      measured for pairs that overlap in the same memories (or, if it never
+      measured those, for any placement)
+    - lengths are rounded up to the next length the sweep measured
+    - the number of weights in the FIFO when the first instruction issues is
+      counted from the RWs and MMC.Ss before it, up to the FIFO's depth of 4.
+      The sweep's counts are of weights that have arrived, so an RW only
+      counts for certain once it's as far back as the longest RW to MMC
+      distance measured, and the distance is the longest over every count
+      the FIFO could have (an RW still on its way delays the weights before
+      it, which pairs alone don't show). The most it could have also counts
+      the RWs issued between the two instructions, with the first one's
+      MMC.S pop still to come: an RW that would overfill the FIFO waits for
+      that pop, and a weight queued behind an MMC.S delays the halt
+
+Anything the table has no measurement for (instruction kinds or lengths it
+didn't sweep, or pairs that failed at every distance it tried) gets the
+fixed distance the generators pad with, so the model only ever replaces
+padding with less where the sweep showed it was safe.
+
+pad() places each instruction as early as the distances to every instruction
+before it allow, which, for a fixed order, is the least padding that meets
+them all. find_hazards() lists the pairs of a program that are closer than
+they need to be.
+
+The programs are taken as straight-line code: ACT branches and jumps depend
+on the data, so they aren't followed. Padding moves every PC, so programs
+with RHM.C (which writes its own PC into the UB) are refused, and so are
+programs with ACT unless the caller says their ACTs never branch or jump
+(allow_act, --allow-act).
+
+    python hazards.py results.json prog.a [-m 8] [-o prog.padded.a] [--check] [--allow-act]
+"""
+
+import argparse
+import functools
+import json
+import sys
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+
+import config
+from assembler import assemble_text
+from disassembler import disassemble_instr
+from isa import *
+from program import INSTR_DTYPE, decode_program
+
+FIFO_DEPTH = 4
+
+# the distance generators put between instructions, and what the model falls
+# back on (test/squish/entry_point.py's base_distance)
+FIXED_DISTANCE = 150
+
+# one decoded instruction, with its sweep kind (None for NOP and SYNC)
+Instr = namedtuple('Instr', ['op', 'flags', 'length', 'addr', 'ubaddr', 'kind'])
+
+# one result from the sweep: the two lengths, instr2's start relative to
+# instr1's in each memory the test placed it in, the weights in the FIFO and
+# the smallest distance that worked
+Measurement = namedtuple('Measurement', ['l1', 'l2', 'offsets', 'fifo', 'distance'])
+
+# the distance between two instructions and where it came from
+Constraint = namedtuple('Constraint', ['distance', 'measured', 'overlap'])
+
+# the sweep kind of an instruction, as used in results.json's keys
+def kind(op, flags, length):
+    name = BIN2OPCODE[op]
+    if name == 'RHM':
+        if flags & SWITCH_MASK:
+            return 'rhmv' if length else 'rhms'
+        if flags & CONV_MASK:
+            return 'rhmc'
+        return 'rhm'
+    if name == 'WHM':
+        return 'whms' if flags & SWITCH_MASK else 'whm'
+    if name == 'MMC':
+        return 'mmcs' if flags & SWITCH_MASK else 'mmc'
+    if name in ('NOP', 'SYNC'):
+        return None
+    return name.lower()
+
+# the address ranges an instruction reads or writes, as {memory: [(start,
+# end)]}. RHM.S and WHM.S take their host memory row from the UB at run time,
+# so they could touch any of it
+def footprint(instr: Instr) -> Dict[str, list]:
+    length = max(1, instr.length)
+    name = BIN2OPCODE[instr.op]
+    if name == 'RHM':
+        if instr.kind == 'rhmc':
+            return {'ub': [(instr.ubaddr, instr.ubaddr + 1)]}
+        if instr.kind in ('rhms', 'rhmv'):
+            buf = 2**config.UB_ADDR_SIZE - 1
+            return {'hm': [(0, float('inf'))],
+                    'ub': [(instr.ubaddr, instr.ubaddr + length), (buf, buf + 1)]}
+        return {'hm': [(instr.addr, instr.addr + length)],
+                'ub': [(instr.ubaddr, instr.ubaddr + length)]}
+    if name == 'WHM':
+        if instr.kind == 'whms':
+            buf = 2**config.UB_ADDR_SIZE - 1
+            return {'hm': [(0, float('inf'))],
+                    'ub': [(instr.addr, instr.addr + length), (buf, buf + 1)]}
+        return {'ub': [(instr.addr, instr.addr + length)],
+                'hm': [(instr.ubaddr, instr.ubaddr + length)]}
+    if name == 'MMC':
+        return {'ub': [(instr.addr, instr.addr + length)],
+                'acc': [(instr.ubaddr, instr.ubaddr + length)]}
+    if name == 'ACT':
+        return {'acc': [(instr.addr, instr.addr + length)],
+                'ub': [(instr.ubaddr, instr.ubaddr + length)]}
+    return {}
+
+# the memories two instructions both touch at some address
+def overlap(first: Instr, second: Instr) -> frozenset:
+    a, b = footprint(first), footprint(second)
+    return frozenset(mem for mem in a.keys() & b.keys()
+                     if any(s1 < e2 and s2 < e1 for s1, e1 in a[mem] for s2, e2 in b[mem]))
+
+# the same for a measurement: instr1 covers [0, l1) and instr2 [offset,
+# offset + l2) of each memory the test placed instr2 in
+def measured_overlap(m: Measurement) -> frozenset:
+    return frozenset(mem for mem, offset in m.offsets.items()
+                     if -max(1, m.l2) < offset < max(1, m.l1))
+
+# the leaves of results.json as (path, value)
+def walk(d, path=()):
+    for key, value in d.items():
+        if isinstance(value, dict):
+            yield from walk(value, path + (key,))
+        else:
+            yield path + (key,), value
+
+# parse a results.json path, e.g. mmc_act/b32/m8/l1=4_l2=8/ub2=ub1-4/acc2=acc1+0/w2
+def parse_path(path, distance):
+    pair, bitwidth, matsize = path[0], int(path[1][1:]), int(path[2][1:])
+    lengths = {'l1': 1, 'l2': 1}
+    offsets = {}
+    fifo = 0
+    for part in path[3:]:
+        if part.startswith('w'):
+            fifo = int(part[1:])
+        elif part.startswith('l'):
+            for length in part.split('_'):
+                name, value = length.split('=')
+                lengths[name] = int(value)
+        elif not part.startswith('col'):
+            name, value = part.split('=')
+            mem = name[:-1]
+            offsets[mem] = int(value[len(mem) + 1:].rstrip('^'))
+    return (pair, bitwidth, matsize), \
+           Measurement(lengths['l1'], lengths['l2'], offsets, fifo, distance)
+
+
+class LatencyModel(object):
+    """ The distances instructions need between them, from a squishtest
+    results table (the dict in results.json) for one bitwidth and matsize.
+    """
+
+    def __init__(self, results: dict, matsize: int, bitwidth: int = 32,
+                 fixed_distance: int = FIXED_DISTANCE, base_distance: int = FIXED_DISTANCE):
+        self.matsize = matsize
+        self.bitwidth = bitwidth
+        self.fixed_distance = fixed_distance
+        # {pair: [Measurement]}. a distance of base_distance means the test
+        # failed at every distance the sweep tried, so it isn't a measurement
+        self.table = {}
+        self.unmeasured = 0
+        for path, distance in walk(results):
+            if type(distance) is not int:
+                continue  # H mode results are pass/fail
+            (pair, b, m), measurement = parse_path(path, distance)
+            if (b, m) != (bitwidth, matsize):
+                continue
+            if distance >= base_distance:
+                self.unmeasured += 1
+                continue
+            self.table.setdefault(pair, []).append(measurement)
+        self.max_distance = max([fixed_distance] + [m.distance for ms in self.table.values()
+                                                    for m in ms])
+        # how long a weight takes to get to the FIFO after its RW issues
+        self.weight_latency = max([m.distance for pair in ('rw_mmc', 'rw_mmcs')
+                                   for m in self.table.get(pair, [])] or [fixed_distance])
+
+    @classmethod
+    def load(cls, path: str, matsize: int, bitwidth: int = 32, **kwargs) -> 'LatencyModel':
+        with open(path) as f:
+            return cls(json.load(f), matsize, bitwidth, **kwargs)
+
+    def distance(self, first: Instr, second: Instr, fifo: Tuple[int, int]) -> Constraint:
+        """ The distance `second` needs after `first`, given the fewest
+        weights there could be in the FIFO when `first` issues and the most
+        there could be by the time `second` does.
+        """
+
+        return self.lookup(first.kind, second.kind, first.length, second.length,
+                           fifo, overlap(first, second))
+
+    @functools.lru_cache(maxsize=None)
+    def lookup(self, kind1, kind2, length1, length2, fifo, overlapping):
+        fixed = Constraint(self.fixed_distance, False, overlapping)
+        measurements = self.table.get(f"{kind1}_{kind2}")
+        if not measurements:
+            return fixed
+
+        # round the lengths up to ones the sweep measured
+        candidates = measurements
+        for attr, length in (('l1', length1), ('l2', length2)):
+            swept = sorted({getattr(m, attr) for m in candidates})
+            if swept == [1]:
+                continue  # the test doesn't vary this length
+            longer = [l for l in swept if l >= max(1, length)]
+            if not longer:
+                return fixed
+            candidates = [m for m in candidates if getattr(m, attr) == longer[0]]
+
+        same_fifo = [m for m in candidates if fifo[0] <= m.fifo <= fifo[1]]
+        candidates = same_fifo or candidates
+        same_overlap = [m for m in candidates if measured_overlap(m) == overlapping]
+        candidates = same_overlap or candidates
+        return Constraint(max(m.distance for m in candidates), True, overlapping)
+
+
+# decode an assembled program into Instrs
+def decode(data: bytes) -> List[Instr]:
+    fields = decode_program(data)
+    instrs = []
+    for op, flags, length, addr, ubaddr in zip(*(fields[name].tolist()
+                                                 for name in INSTR_DTYPE.names)):
+        instrs.append(Instr(op, flags, length, addr, ubaddr, kind(op, flags, length)))
+    return instrs
+
+# the weights in the FIFO as a program issues, as a range: RWs far enough
+# back for their weights to have arrived are certainly in it, the ones after
+# them might be. MMC.S takes one out
+class Fifo(object):
+    def __init__(self, weight_latency):
+        self.weight_latency = weight_latency
+        self.rws = []
+        self.arrived = 0
+        self.pops = 0
+
+    # (fewest, most) weights when an instruction issues at `pc`, and the pops
+    # before it
+    def at(self, pc):
+        while self.arrived < len(self.rws) and pc - self.rws[self.arrived] >= self.weight_latency:
+            self.arrived += 1
+        clamp = lambda count: max(0, min(count - self.pops, FIFO_DEPTH))
+        return clamp(self.arrived), clamp(len(self.rws)), self.pops
+
+    # the most weights there can be now, counting only the pops before the
+    # instruction `count` is from, since later MMC.Ss may not have popped yet
+    def queued(self, count):
+        return max(count[1], min(len(self.rws) - count[2], FIFO_DEPTH))
+
+    def issue(self, instr, pc):
+        if instr.kind == 'rw':
+            self.rws.append(pc)
+        elif instr.kind == 'mmcs':
+            self.pops += 1
+
+# the earliest PC `instr` can go at after the instructions in `kept` (indices
+# into `instrs`, in the order they issue), and the constraints from each of
+# them as [(i, Constraint)]. the look back goes as far as the longest distance
+# the model gives from `start`, by default the PC after the last one
+def earliest(instr, instrs, kept, pcs, counts, fifo, model, start=None):
+    pc = pcs[kept[-1]] + 1 if kept else 0
+    start = pc if start is None else start
+    found = []
+    if instr.kind is not None:
+        for i in reversed(kept):
+            if start - pcs[i] >= model.max_distance:
+                break
+            if instrs[i].kind is None:
+                continue
+            fifo_range = (counts[i][0], fifo.queued(counts[i]))
+            constraint = model.distance(instrs[i], instr, fifo_range)
+            found.append((i, constraint))
+            pc = max(pc, pcs[i] + constraint.distance)
+    return pc, found
+
+# the pairs a program has to keep apart, as (i, j, Constraint) with i and j
+# indices into `instrs`, given the PC of each (None for those left out).
+# `place(j, pc)` gets the earliest PC the instructions before j allow, and
+# returns the one j goes at
+def walk_constraints(instrs, model, pcs, place):
+    fifo = Fifo(model.weight_latency)
+    counts = [None] * len(instrs)
+    kept = []
+    for j, instr in enumerate(instrs):
+        if pcs[j] is None and BIN2OPCODE[instr.op] == 'NOP':
+            continue
+        pc, found = earliest(instr, instrs, kept, pcs, counts, fifo, model, pcs[j])
+        pcs[j] = place(j, pc, found)
+        counts[j] = fifo.at(pcs[j])
+        fifo.issue(instr, pcs[j])
+        kept.append(j)
+    return pcs
+
+# refuses programs whose instructions can't get new PCs: RHM.C writes its PC
+# into the UB, and an ACT whose result says so branches or jumps by a PC
+# offset taken from the data, which moving the instructions would break
+def check_movable(instrs: List[Instr], allow_act: bool = False):
+    if any(instr.kind == 'rhmc' for instr in instrs):
+        raise ValueError("RHM.C writes its PC into the UB, so the program can't be moved.")
+    if not allow_act and any(instr.kind == 'act' for instr in instrs):
+        raise ValueError("ACT can branch or jump by a PC offset from the data, so the "
+                         "program can't be moved. Pass allow_act=True (--allow-act) if "
+                         "its ACTs never do.")
+
+def pad(instrs: List[Instr], model: LatencyModel, allow_act: bool = False) -> List[int]:
+    """ Places every instruction other than NOPs as soon after the ones before
+    it as the model allows. Returns the new PC of each instruction (None for
+    NOPs, which are dropped). Programs with ACT are refused unless
+    `allow_act`, which says none of their ACTs branch or jump.
+    """
+
+    check_movable(instrs, allow_act)
+    return walk_constraints(instrs, model, [None] * len(instrs), lambda j, pc, found: pc)
+
+def find_hazards(instrs: List[Instr], model: LatencyModel, pcs: Optional[List[int]] = None):
+    """ The pairs of instructions that are closer than the model says they
+    need to be, as (i, j, Constraint) with i and j indices into `instrs`. The
+    PCs are the indices unless `pcs` are given.
+    """
+
+    pcs = list(range(len(instrs))) if pcs is None else list(pcs)
+    hazards = []
+    def place(j, pc, found):
+        hazards.extend((i, j, constraint) for i, constraint in found
+                       if pcs[j] - pcs[i] < constraint.distance)
+        return pcs[j]
+    walk_constraints(instrs, model, pcs, place)
+    return hazards
+
+def padded_text(instrs: List[Instr], pcs: List[int]) -> str:
+    """ The assembly for a padded program, with runs of NOPs as .repeat blocks.
+    """
+
+    lines = []
+    pc = 0
+    for instr, new_pc in zip(instrs, pcs):
+        if new_pc is None:
+            continue
+        gap = new_pc - pc
+        if gap == 1:
+            lines.append('NOP')
+        elif gap > 1:
+            lines += ['.repeat {}'.format(gap), 'NOP', '.endr']
+        lines.append(disassemble_instr(*instr[:5])[0])
+        pc = new_pc + 1
+    return ''.join(line + '\n' for line in lines)
+
+def fixed_length(instrs: List[Instr], distance: int = FIXED_DISTANCE) -> int:
+    """ The length of the program with every instruction other than NOPs
+    `distance` apart, as the generators pad them.
+    """
+
+    count = sum(BIN2OPCODE[instr.op] != 'NOP' for instr in instrs)
+    return (count - 1) * distance + 1 if count else 0
+
+
+def describe(instrs, i, j, constraint, pcs):
+    name = lambda k: disassemble_instr(*instrs[k][:5])[0]
+    shared = ', '.join(sorted(constraint.overlap)) or 'nothing'
+    source = 'measured' if constraint.measured else 'not in the table, fixed'
+    return '{}: {} -> {}: {}: {} apart, need {} (share {}; {})'.format(
+        pcs[i], name(i), pcs[j], name(j), pcs[j] - pcs[i], constraint.distance,
+        shared, source)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Check a program for N mode hazards or pad it with the fewest NOPs that avoid them.')
+    parser.add_argument('results', help='squishtest results.json to take the distances from.')
+    parser.add_argument('path', help='the assembly program.')
+    parser.add_argument('-m', '--matsize', type=int, default=8, help='matrix size of the TPU.')
+    parser.add_argument('-b', '--bitwidth', type=int, default=32, help='bitwidth of the TPU.')
+    parser.add_argument('-d', '--fixed-distance', type=int, default=FIXED_DISTANCE,
+                        help='distance to use where the table has no measurement.')
+    parser.add_argument('-o', '--output', help='where to write the padded program (default: path with .padded.a).')
+    parser.add_argument('--check', action='store_true',
+                        help='only list the hazards in the program as written.')
+    parser.add_argument('--allow-act', action='store_true',
+                        help="pad programs with ACT, whose results must then never branch or jump.")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    model = LatencyModel.load(args.results, args.matsize, args.bitwidth,
+                              fixed_distance=args.fixed_distance)
+    with open(args.path) as f:
+        instrs = decode(assemble_text(f.read()))
+
+    if args.check:
+        hazards = find_hazards(instrs, model)
+        pcs = list(range(len(instrs)))
+        for i, j, constraint in hazards:
+            print(describe(instrs, i, j, constraint, pcs))
+        print('{} hazards'.format(len(hazards)))
+        sys.exit(1 if hazards else 0)
+
+    pcs = pad(instrs, model, allow_act=args.allow_act)
+    output = args.output or args.path.rsplit('.', 1)[0] + '.padded.a'
+    with open(output, 'w') as f:
+        f.write(padded_text(instrs, pcs))
+    length = max(pc for pc in pcs if pc is not None) + 1
+    print('{} instructions as written, {} with fixed distance {}, {} padded ({})'.format(
+        len(instrs), fixed_length(instrs, args.fixed_distance), args.fixed_distance,
+        length, output))
@@ -0,0 +1,192 @@
+from typing import Dict, Optional
+
+import numpy as np
+
+from packing import mem_to_rows, mem_to_tiles, pack_rows, pack_tiles, \
+    to_unsigned, unpack_rows
+
+# models of the host memory and weight DRAM that runtpu.py drives the TPU's
+# memory ports from. the harness only asks a model for the row or tile at an
+# address when the TPU reads it (hostmem_raddr, weights_dram_raddr), hands it
+# the rows the TPU writes, and asks for the whole memory as an array once the
+# program halts.
+#
+#   "dict":  packs every row and tile up front into a dict, which is what
+#            runtpu.py always did
+#   "array": keeps the NumPy arrays and packs a row or tile the first time
+#            it's read
+#   "mmap":  like "array", but memory-maps the .npy files, so a host memory
+#            bigger than RAM is only read where the program reads it. the
+#            final host memory is written to a .npy file instead of memory
+MEMORY_MODELS = ["dict", "array", "mmap"]
+
+# rows converted at a time when writing out a memory-mapped host memory
+CHUNK_ROWS = 2**16
+
+
+# the interface runtpu.py uses. read returns None for host memory addresses
+# that were never loaded or written, which leaves hostmem_rdata at 0
+class HostMemory(object):
+    def read(self, addr: int) -> Optional[int]:
+        raise NotImplementedError
+
+    def write(self, addr: int, value: int):
+        raise NotImplementedError
+
+    # the memory as a (rows, matsize) int64 array of unsigned values, with a
+    # row for every address up to the highest one loaded or written
+    def to_np(self) -> np.ndarray:
+        raise NotImplementedError
+
+class WeightMemory(object):
+    # raises KeyError for an address with no tile
+    def read(self, addr: int) -> int:
+        raise NotImplementedError
+
+    # the tiles as a (tiles, matsize, matsize) int64 array of unsigned values
+    def to_np(self) -> np.ndarray:
+        raise NotImplementedError
+
+
+# a host memory held as {address: packed row}
+class DictHostMemory(HostMemory):
+    def __init__(self, rows: Dict[int, int], bitwidth: int, matsize: int):
+        self.rows = rows
+        self.bitwidth = bitwidth
+        self.matsize = matsize
+
+    @classmethod
+    def from_array(cls, array, bitwidth, matsize):
+        return cls(dict(enumerate(pack_rows(array, bitwidth))), bitwidth, matsize)
+
+    def read(self, addr):
+        return self.rows.get(addr)
+
+    def write(self, addr, value):
+        self.rows[addr] = value
+
+    def to_np(self):
+        return mem_to_rows(self.rows, self.bitwidth, self.matsize)
+
+# a host memory backed by a (rows, matsize) array, which is never written to.
+# rows are packed when first read, and the TPU's writes are kept as packed
+# rows on top of the array
+class ArrayHostMemory(HostMemory):
+    def __init__(self, array: np.ndarray, bitwidth: int, matsize: int):
+        self.array = array
+        self.bitwidth = bitwidth
+        self.matsize = matsize
+        self.packed = {}
+        self.written = {}
+
+    def read(self, addr):
+        if addr in self.written:
+            return self.written[addr]
+        if addr not in self.packed:
+            if addr >= len(self.array):
+                return None
+            self.packed[addr] = pack_rows(self.array[addr:addr+1], self.bitwidth)[0]
+        return self.packed[addr]
+
+    def write(self, addr, value):
+        self.written[addr] = value
+
+    def row_count(self):
+        return max(len(self.array), max(self.written, default=-1) + 1)
+
+    # with `out`, write the rows into it a chunk at a time instead of
+    # making a new array
+    def to_np(self, out: Optional[np.ndarray] = None):
+        if out is None:
+            out = np.zeros((self.row_count(), self.matsize), dtype=np.int64)
+        for start in range(0, len(self.array), CHUNK_ROWS):
+            chunk = self.array[start:start+CHUNK_ROWS]
+            out[start:start+len(chunk)] = to_unsigned(chunk, self.bitwidth).astype(np.int64)
+        if len(self.array) < len(out):
+            out[len(self.array):] = 0
+        if self.written:
+            addrs = np.fromiter(self.written.keys(), dtype=np.int64, count=len(self.written))
+            out[addrs] = unpack_rows(self.written.values(), self.bitwidth,
+                                     self.matsize).astype(np.int64)
+        return out
+
+# an ArrayHostMemory over a memory-mapped .npy file. to_np writes the final
+# memory to `result_path` the same way and returns it memory-mapped
+class MmapHostMemory(ArrayHostMemory):
+    def __init__(self, filename: str, bitwidth: int, matsize: int,
+                 result_path: str):
+        array = np.load(filename, mmap_mode='r')
+        super().__init__(array.reshape(-1, array.shape[-1]), bitwidth, matsize)
+        self.result_path = result_path
+
+    def to_np(self):
+        out = np.lib.format.open_memmap(self.result_path, mode='w+', dtype=np.int64,
+                                        shape=(self.row_count(), self.matsize))
+        super().to_np(out)
+        out.flush()
+        return out
+
+
+# a weight DRAM held as {address: packed tile}
+class DictWeightMemory(WeightMemory):
+    def __init__(self, tiles: Dict[int, int], bitwidth: int, matsize: int):
+        self.tiles = tiles
+        self.bitwidth = bitwidth
+        self.matsize = matsize
+
+    @classmethod
+    def from_array(cls, array, bitwidth, matsize):
+        return cls(dict(enumerate(pack_tiles(array, bitwidth))), bitwidth, matsize)
+
+    def read(self, addr):
+        return self.tiles[addr]
+
+    def to_np(self):
+        return mem_to_tiles(self.tiles, self.bitwidth, self.matsize)
+
+# a weight DRAM backed by a (tiles, matsize, matsize) array. tiles are
+# packed when first read
+class ArrayWeightMemory(WeightMemory):
+    def __init__(self, array: np.ndarray, bitwidth: int, matsize: int):
+        self.array = array
+        self.bitwidth = bitwidth
+        self.matsize = matsize
+        self.packed = {}
+
+    def read(self, addr):
+        if addr not in self.packed:
+            if addr >= len(self.array):
+                raise KeyError(addr)
+            self.packed[addr] = pack_tiles(self.array[addr:addr+1], self.bitwidth)[0]
+        return self.packed[addr]
+
+    def to_np(self):
+        return to_unsigned(self.array, self.bitwidth).astype(np.int64)
+
+
+# build the host memory and weight DRAM models named `model` from the .npy
+# files runtpu.py is given. a 3d host memory is flattened to one row per
+# vector. the mmap model writes the final host memory to `result_path`
+def load_memories(model: str, hostmem_filename: str, weightsmem_filename: str,
+                  bitwidth: int, matsize: int, result_path: Optional[str] = None):
+    if model not in MEMORY_MODELS:
+        raise ValueError(f"Unknown memory model {model}. Choose from {MEMORY_MODELS}.")
+    mmap_mode = 'r' if model == "mmap" else None
+    weightsarray = np.load(weightsmem_filename, mmap_mode=mmap_mode)
+    if weightsarray.ndim != 3:
+        raise ValueError(f"{weightsmem_filename} has shape {weightsarray.shape}, "
+                         "expected (tiles, matsize, matsize).")
+
+    if model == "mmap":
+        if result_path is None:
+            raise ValueError("The mmap memory model needs a result_path.")
+        return (MmapHostMemory(hostmem_filename, bitwidth, matsize, result_path),
+                ArrayWeightMemory(weightsarray, bitwidth, matsize))
+
+    hostarray = np.load(hostmem_filename)
+    hostarray = hostarray.reshape(-1, hostarray.shape[-1])
+    if model == "dict":
+        return (DictHostMemory.from_array(hostarray, bitwidth, matsize),
+                DictWeightMemory.from_array(weightsarray, bitwidth, matsize))
+    return (ArrayHostMemory(hostarray, bitwidth, matsize),
+            ArrayWeightMemory(weightsarray, bitwidth, matsize))
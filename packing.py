@@ -0,0 +1,99 @@
+from typing import Dict, List
+
+import numpy as np
+
+# converts between NumPy arrays and the packed integers the hardware's memories
+# hold, a whole memory at a time. a row of matsize values is packed with value
+# 0 in the lowest bits (like the host memory and UB rows), and a matsize x
+# matsize weight tile with value [0][0] in the highest bits. values are stored
+# in two's complement, bitwidth bits each, and unpacked as unsigned.
+#
+# widths of 8, 16, 32 and 64 bits are packed by casting the array to that
+# many bytes per value and reading each row's bytes as a little-endian
+# integer. other widths go through an array of bits instead.
+
+BYTE_WIDTHS = (8, 16, 32, 64)
+
+
+# the low `bitwidth` bits of each value, as uint64. floats are truncated
+# towards 0 first, like int()
+def to_unsigned(values, bitwidth: int) -> np.ndarray:
+    values = np.asarray(values)
+    if values.dtype != np.uint64:
+        values = values.astype(np.int64).view(np.uint64)
+    return values & np.uint64((1 << bitwidth) - 1)
+
+# (rows, values) uint64 -> (rows, bytes) uint8 of each row's packed value,
+# least significant byte first
+def rows_to_bytes(rows: np.ndarray, bitwidth: int) -> np.ndarray:
+    count, width = rows.shape
+    if bitwidth in BYTE_WIDTHS:
+        data = rows.astype(f"<u{bitwidth // 8}")
+        return data.view(np.uint8).reshape(count, width * bitwidth // 8)
+    bits = (rows[:, :, None] >> np.arange(bitwidth, dtype=np.uint64)) & np.uint64(1)
+    return np.packbits(bits.astype(np.uint8).reshape(count, width * bitwidth),
+                       axis=1, bitorder='little')
+
+# the inverse of rows_to_bytes
+def bytes_to_rows(data: np.ndarray, bitwidth: int, width: int) -> np.ndarray:
+    count = data.shape[0]
+    if bitwidth in BYTE_WIDTHS:
+        return data.view(f"<u{bitwidth // 8}").reshape(count, width).astype(np.uint64)
+    bits = np.unpackbits(data, axis=1, count=width * bitwidth, bitorder='little')
+    bits = bits.reshape(count, width, bitwidth).astype(np.uint64)
+    return (bits << np.arange(bitwidth, dtype=np.uint64)).sum(axis=2, dtype=np.uint64)
+
+
+# pack each row of a (rows, matsize) array into one integer
+# if bitwidth=8, then [[a, b, c, d]] -> [(256^3)*d + (256^2)*c + (256)*b + a]
+def pack_rows(rows, bitwidth: int) -> List[int]:
+    rows = to_unsigned(rows, bitwidth)
+    data = rows_to_bytes(rows, bitwidth)
+    row_bytes = data.shape[1]
+    buf = memoryview(data.tobytes())
+    return [int.from_bytes(buf[i*row_bytes:(i+1)*row_bytes], 'little')
+            for i in range(data.shape[0])]
+
+# unpack each integer into a row of matsize values. bits above the row are
+# ignored. returns a (len(values), matsize) uint64 array
+def unpack_rows(values, bitwidth: int, matsize: int) -> np.ndarray:
+    row_bytes = (matsize * bitwidth + 7) // 8
+    mask = (1 << (matsize * bitwidth)) - 1
+    buf = b"".join((int(v) & mask).to_bytes(row_bytes, 'little') for v in values)
+    data = np.frombuffer(buf, dtype=np.uint8).reshape(len(values), row_bytes)
+    return bytes_to_rows(data, bitwidth, matsize)
+
+# pack each tile of a (tiles, matsize, matsize) array into one integer
+# if bitwidth=8, then [[[a, b], [c, d]]] -> [(256^3)*a + (256^2)*b + (256)*c + d]
+def pack_tiles(tiles, bitwidth: int) -> List[int]:
+    tiles = np.asarray(tiles)
+    flat = tiles.reshape(len(tiles), int(np.prod(tiles.shape[1:])))
+    return pack_rows(flat[:, ::-1], bitwidth)
+
+# unpack each integer into a matsize x matsize tile. returns a
+# (len(values), matsize, matsize) uint64 array
+def unpack_tiles(values, bitwidth: int, matsize: int) -> np.ndarray:
+    flat = unpack_rows(values, bitwidth, matsize * matsize)
+    return np.ascontiguousarray(flat[:, ::-1]).reshape(len(values), matsize, matsize)
+
+
+# turn a memory image ({address: packed row}) into a (rows, matsize) int64
+# array, with zeros at the addresses that aren't in it. there are at least
+# row_count rows, more if the image has higher addresses. with a bitwidth of
+# 64, values from 2^63 up come out negative
+def mem_to_rows(mem: Dict[int, int], bitwidth: int, matsize: int,
+                row_count: int = 0) -> np.ndarray:
+    addrs = np.fromiter(mem.keys(), dtype=np.int64, count=len(mem))
+    row_count = max(row_count, int(addrs.max()) + 1 if len(mem) else 0)
+    rows = np.zeros((row_count, matsize), dtype=np.int64)
+    rows[addrs] = unpack_rows(mem.values(), bitwidth, matsize).astype(np.int64)
+    return rows
+
+# like mem_to_rows, for a memory of packed weight tiles. returns a
+# (tiles, matsize, matsize) int64 array
+def mem_to_tiles(mem: Dict[int, int], bitwidth: int, matsize: int) -> np.ndarray:
+    addrs = np.fromiter(mem.keys(), dtype=np.int64, count=len(mem))
+    tiles = np.zeros((int(addrs.max()) + 1 if len(mem) else 0, matsize, matsize),
+                     dtype=np.int64)
+    tiles[addrs] = unpack_tiles(list(mem.values()), bitwidth, matsize).astype(np.int64)
+    return tiles
@@ -0,0 +1,137 @@
+import os
+from typing import List, Optional, Union
+
+import numpy as np
+
+import isa
+
+# reading program binaries, as written by assembler.py: one
+# isa.INSTRUCTION_WIDTH_BYTES-byte big-endian instruction after another, laid
+# out as described in isa.py. runtpu.py loads the instructions into IMem as
+# integers (Program.words) and sim.py executes the decoded fields
+# (Program.fields)
+
+# one decoded instruction per record, with fields named after the binary
+# encoding in isa.py. 'addr' holds the host memory, weight DRAM or accumulator
+# address and 'ubaddr' is always a Unified Buffer address.
+INSTR_DTYPE = np.dtype([('op', np.uint8), ('flags', np.uint8),
+                        ('len', np.uint8), ('addr', np.uint64),
+                        ('ubaddr', np.uint32)])
+
+# how a single instruction is laid out in a program binary (big-endian, opcode
+# first). the 3-byte UB address has no matching integer type, so it's read as
+# bytes and combined in decode_program
+_BINARY_DTYPE = np.dtype([('op', 'u1', (isa.OP_SIZE,)),
+                          ('flags', 'u1', (isa.FLAGS_SIZE,)),
+                          ('len', 'u1', (isa.LEN_SIZE,)),
+                          ('addr', 'u1', (isa.ADDR_SIZE,)),
+                          ('ubaddr', 'u1', (isa.UB_ADDR_SIZE,))])
+assert _BINARY_DTYPE.itemsize == isa.INSTRUCTION_WIDTH_BYTES
+
+
+def check_length(data: bytes):
+    if len(data) % isa.INSTRUCTION_WIDTH_BYTES != 0:
+        raise ValueError(f"Program length {len(data)} is not a multiple of "
+                         f"{isa.INSTRUCTION_WIDTH_BYTES} bytes.")
+
+
+# combine a (n, k) array of big-endian bytes into n unsigned integers
+def _bytes_to_uint(fields):
+    values = np.zeros(fields.shape[0], dtype=np.uint64)
+    for i in range(fields.shape[1]):
+        values = (values << np.uint64(8)) | fields[:, i]
+    return values
+
+
+# split a program binary into one integer per instruction, in a single pass
+def program_words(data: bytes) -> List[int]:
+    check_length(data)
+    width = isa.INSTRUCTION_WIDTH_BYTES
+    view = memoryview(data)
+    return [int.from_bytes(view[i:i+width], isa.ENDIANNESS)
+            for i in range(0, len(view), width)]
+
+
+# decode raw instructions (an array of _BINARY_DTYPE, as map_program gives)
+# into a record array of INSTR_DTYPE. opcodes the ISA doesn't have are an
+# error unless check_opcodes is False
+def decode_records(raw: np.ndarray, check_opcodes: bool = True) -> np.recarray:
+    program = np.zeros(raw.shape[0], dtype=INSTR_DTYPE).view(np.recarray)
+    for field in INSTR_DTYPE.names:
+        program[field] = _bytes_to_uint(raw[field])
+
+    if check_opcodes:
+        bad = ~np.isin(program['op'], list(isa.BIN2OPCODE.keys()))
+        if bad.any():
+            pc = int(np.argmax(bad))
+            raise ValueError(f"Unknown opcode {program['op'][pc]} at PC {pc}.")
+    return program
+
+# a program binary's raw instructions, as decode_records takes them
+def raw_records(data: bytes) -> np.ndarray:
+    check_length(data)
+    return np.frombuffer(data, dtype=_BINARY_DTYPE)
+
+# decode a whole program binary at once into a record array of INSTR_DTYPE
+def decode_program(data: bytes) -> np.recarray:
+    return decode_records(raw_records(data))
+
+# the raw instructions of the binary at `path`, memory-mapped rather than read
+# in, for binaries too big to hold in memory. decode them a slice at a time
+# with decode_records
+def map_program(path: str) -> np.ndarray:
+    size = os.path.getsize(path)
+    if size % isa.INSTRUCTION_WIDTH_BYTES != 0:
+        raise ValueError(f"{path}: program length {size} is not a multiple of "
+                         f"{isa.INSTRUCTION_WIDTH_BYTES} bytes.")
+    if size == 0:
+        # an empty file can't be mapped
+        return np.zeros(0, dtype=_BINARY_DTYPE)
+    return np.memmap(path, dtype=_BINARY_DTYPE, mode='r')
+
+
+# a program binary. the length is checked up front, and the words and fields
+# are each worked out the first time they're asked for
+class Program(object):
+    def __init__(self, data: bytes, path: Optional[str] = None):
+        check_length(data)
+        self.data = bytes(data)
+        self.path = path
+        self._words = None
+        self._fields = None
+
+    def __len__(self):
+        return len(self.data) // isa.INSTRUCTION_WIDTH_BYTES
+
+    # the instructions as integers, as IMem holds them
+    @property
+    def words(self) -> List[int]:
+        if self._words is None:
+            self._words = program_words(self.data)
+        return self._words
+
+    # the decoded instructions (a record array of INSTR_DTYPE)
+    @property
+    def fields(self) -> np.recarray:
+        if self._fields is None:
+            self._fields = decode_program(self.data)
+        return self._fields
+
+
+def read_program(path: str) -> Program:
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        return Program(data, path)
+    except ValueError as e:
+        raise ValueError(f"{path}: {e}") from None
+
+
+# the Program `prog` names: a path to a binary, the binary itself (as
+# assembler.assemble_text returns it) or a Program
+def as_program(prog: Union[str, bytes, Program]) -> Program:
+    if isinstance(prog, Program):
+        return prog
+    if isinstance(prog, (bytes, bytearray, memoryview)):
+        return Program(prog)
+    return read_program(prog)
@@ -1,7 +1,11 @@
 from datetime import datetime
+import hashlib
 import math
 import os
 import pickle
+import shutil
+import sys
+from typing import Union
 from pyrtl import *
 import argparse
 import numpy as np
@@ -10,31 +14,25 @@ import numpy as np
 
 from tpu import tpu
 import config
+from checkpoint import bytes_to_ints, ints_to_bytes, load_checkpoint, \
+    save_checkpoint
+from memmodels import MEMORY_MODELS, load_memories
+from packing import mem_to_rows, mem_to_tiles, pack_rows, pack_tiles, \
+    unpack_rows, unpack_tiles
+from program import as_program
+from streamtrace import StreamingTrace
 from utils import print_mems
 
 
 # turns a vector of values into a single integer
 # if bitwidth=8, then [a, b, c, d] -> (256^3)*d + (256^2)*c + (256)*b + a
 def concat_vec(vec, bitwidth):
-    t = 0
-    mask = int('1'*bitwidth, 2)
-    for x in reversed(vec):
-        t = (t<<bitwidth) | (int(x) & mask)
-    # print(vec, t)
-    return t
+    return pack_rows(np.reshape(vec, (1, -1)), bitwidth)[0]
 
 # turns a 2d array (tile) of values into a single integer
 # if bitwidth=8, then [[a, b], [c, d]] -> (256^3)*a + (256^2)*b + (256)*c + d
 def concat_tile(tile, bitwidth):
-    val = 0
-    size = len(tile)
-    mask = int('1'*bitwidth, 2)
-    for row in tile:
-        for x in row:
-            val = (val<<bitwidth) | (int(x) & mask)
-        #print_weight_mem({0:val})
-    #return val & (size*size*bits)  # if negative, truncate bits to correct size
-    return val
+    return pack_tiles(np.asarray(tile)[None], bitwidth)[0]
 
 # turns a number into an appropriately lengthed vector of values in the 
 # specified bitwidth
@@ -49,23 +47,12 @@ def make_vec(value, bitwidth):
 
 # like make_vec, but the number of values will always be matsize
 def make_vec_2(value, bitwidth, matsize):
-    vec = []
-    mask = int('1'*bitwidth, 2)
-    for i in range(matsize):
-        vec.append(value & mask)
-        value = value >> bitwidth
-    return list(vec)
+    return unpack_rows([value], bitwidth, matsize)[0].tolist()
 
 # make a matsize*matsize tile of bitwidth-sized values from a single value
 # LSB is top-left corner, and it fills in normally from there.
 def make_tile(value, bitwidth, matsize):
-    tile = [[0] * matsize for _ in range(matsize)]
-    mask = int('1'*bitwidth, 2)
-    for i in range(matsize-1, -1, -1):
-        for j in range(matsize-1, -1, -1):
-            tile[i][j] = value & mask
-            value = value >> bitwidth
-    return tile
+    return unpack_tiles([value], bitwidth, matsize)[0].tolist()
 
 def print_mem(mem, bitwidth, matsize):
     ks = sorted(mem.keys())
@@ -97,49 +84,25 @@ def reverse_value(value, bitwidth):
 
 # convert hostmem to 2d numpy array
 def hostmem_to_np(hostmem, bitwidth, matsize):
-    keys = sorted(hostmem.keys())
-    hostmem_np = np.zeros((keys[-1]+1, matsize))
-    for k in keys:
-        hostmem_np[k] = make_vec_2(hostmem[k], bitwidth, matsize)
-    return hostmem_np.astype(int)
+    return mem_to_rows(hostmem, bitwidth, matsize)
 
 # convert weightsmem to 2d numpy array
 def weightsmem_to_np(weightsmem, bitwidth, matsize):
-    keys = sorted(weightsmem.keys())
-    if len(keys) == 0:
-        return np.zeros((0, matsize, matsize))
-    weightsmem_np = np.zeros((keys[-1]+1, matsize, matsize))
-    for k in keys:
-        weightsmem_np[k] = make_tile(weightsmem[k], bitwidth, matsize)
-    return weightsmem_np.astype(int)
+    return mem_to_tiles(weightsmem, bitwidth, matsize)
 
 # convert UBuffer to a 2d numpy array. convert the same number of rows as the 
 # number of rows in the host memory
 def ubuffer_to_np(sim, ubuffer, bitwidth, matsize, row_count):
-    ubuffer_dict = sim.inspect_mem(ubuffer)
-    keys = [k for k in sorted(ubuffer_dict.keys())]
-    if len(keys) > 0:
-        row_count = max(row_count, keys[-1]+1)
-
-    ubuffer_np = np.zeros((row_count, matsize))
-    for k in keys:
-        vec = make_vec_2(ubuffer_dict[k], bitwidth, matsize)
-        ubuffer_np[k] = vec
-    return ubuffer_np.astype(int)
+    return mem_to_rows(sim.inspect_mem(ubuffer), bitwidth, matsize, row_count)
 
 # convert weight queue to a 3d numpy array. each get converted to a 2d array of 
 # size matsize x matsize. weight 0 is the front, weight 3 is the back.
 def wqueue_to_np(sim, buf4, buf3, buf2, buf1, bitwidth, matsize):
-    wqueue_np = np.zeros((4, matsize, matsize))
-    for i, buf in enumerate([buf4, buf3, buf2]):
-        buf_tile = make_tile(sim.inspect(buf), bitwidth, matsize)
-        wqueue_np[i] = buf_tile
-
     buf1_val = 0
     for i in range(math.ceil(matsize*matsize/64)-1, -1, -1):
         buf1_val = (buf1_val << 64*bitwidth) | sim.inspect(buf1[i])
-    buf1_tile = make_tile(buf1_val, bitwidth, matsize)
-    wqueue_np[3] = buf1_tile
+    wqueue_np = unpack_tiles([sim.inspect(buf4), sim.inspect(buf3), 
+                              sim.inspect(buf2), buf1_val], bitwidth, matsize)
 
     full_slots = 0
     if sim.inspect('fifo_empty4') == 0: 
@@ -151,78 +114,418 @@ def wqueue_to_np(sim, buf4, buf3, buf2, buf1, bitwidth, matsize):
     if sim.inspect('fifo_full') == 1:
         full_slots += 1
 
-    return wqueue_np[:full_slots].astype(int)
+    return wqueue_np[:full_slots].astype(np.int64)
     
 # convert accumulator memory to a 2d numpy array. convert the same number of
 # rows as the number of rows in the host memory
 def accmem_to_np(sim, acc_mems, matsize, row_count):
     acc_mems_vals = [sim.inspect_mem(acc_mem) for acc_mem in acc_mems]
-
-    keys = set()
-    for i in range(len(acc_mems_vals)):
-        keys = keys.union(set(acc_mems_vals[i].keys()))
-    keys = sorted(list(keys))
-    if len(keys) > 0:
-        row_count = max(row_count, keys[-1]+1)
-    accmem_np = np.zeros((row_count, matsize))
-    for k in keys:
-        for i in range(matsize):
-            accmem_np[k][i] = acc_mems_vals[i].get(k, 0)
-    return accmem_np.astype(int)
-
-
-def runtpu(prog: str, hostmem_filename: str, weightsmem_filename: str, 
-           bitwidth: int, matsize: int, output_folder: str, output_trace: bool):
-    # Read the program and build an instruction list
-    with open(prog, 'rb') as f:
-        ins = [x for x in f.read()]  # create byte list from input
-
-    instrs = []
-    width = config.INSTRUCTION_WIDTH / 8
-    # This assumes instructions are strictly byte-aligned
-
-    for i in range(int(len(ins)/width)):  # once per instruction
-        val = 0
-        for j in range(int(width)):  # for each byte
-            val = (val << 8) | ins.pop(0)
-        instrs.append(val)
+    for vals in acc_mems_vals:
+        if len(vals) > 0:
+            row_count = max(row_count, max(vals.keys())+1)
+    accmem_np = np.zeros((row_count, matsize), dtype=np.int64)
+    for i, vals in enumerate(acc_mems_vals[:matsize]):
+        addrs = np.fromiter(vals.keys(), dtype=np.int64, count=len(vals))
+        accmem_np[addrs, i] = np.fromiter(vals.values(), dtype=np.int64, count=len(vals))
+    return accmem_np
+
+
+# PyRTL simulators runtpu can run the design on. "fast" is FastSimulation,
+# which turns the netlist into Python. "compiled" is CompiledSimulation, which
+# turns it into C, so it takes longer to start but steps much faster; it needs
+# gcc and a 64-bit Python. "auto" picks "compiled" when it's available
+BACKENDS = ["fast", "compiled", "auto"]
+
+def compiled_sim_available():
+    return shutil.which("gcc") is not None and sys.maxsize > 2**32
+
+# CompiledSimulation can only inspect Inputs and Outputs. drive a new Output
+# from each of `wires`, which CompiledSimulation.inspect follows back to the
+# wire, and from the address and enable of each write port of `mems`, so the
+# harness can see which addresses get written. returns the write port Outputs
+# as {mem: [(addr, enable), ...]}
+def expose_to_compiled_sim(wires, mems):
+    for w in wires:
+        out = Output(len(w), f"{w.name}_out")
+        out <<= w
+
+    # memories are usually unnamed, and the tracer skips "tmp" names
+    ports = {mem: [] for mem in mems}
+    for net in list(working_block().logic_subset('@')):
+        mem = net.op_param[1]
+        if mem not in ports:
+            continue
+        addr, _, enable = net.args
+        name = f"mem{mems.index(mem)}_{len(ports[mem])}"
+        addr_out = Output(len(addr), f"{name}_waddr_out")
+        addr_out <<= addr
+        enable_out = Output(1, f"{name}_we_out")
+        enable_out <<= enable
+        ports[mem].append((addr_out, enable_out))
+    return ports
+
+# a CompiledSimulation whose inspect_mem only returns the addresses that have
+# been written, like FastSimulation, for the memories in `write_ports` (see
+# expose_to_compiled_sim). CompiledSimulation's own inspect_mem covers every
+# address of the memory
+class WriteTrackingSimulation(CompiledSimulation):
+    def __init__(self, write_ports, **kwargs):
+        super().__init__(**kwargs)
+        self.write_ports = write_ports
+        self.written = {mem: set() for mem in write_ports}
+
+    def step(self, provided_inputs=None):
+        super().step(provided_inputs)
+        if isinstance(self.tracer, StreamingTrace):
+            self.tracer.step_done()
+        for mem, ports in self.write_ports.items():
+            for addr, enable in ports:
+                if self.inspect(enable):
+                    self.written[mem].add(self.inspect(addr))
+
+    def inspect_mem(self, mem):
+        values = super().inspect_mem(mem)
+        if mem not in self.written:
+            return values
+        return {a: values[a] for a in sorted(self.written[mem])}
+
+
+# the files tpu() builds the design from. a netlist saved on disk is only
+# reused if none of them have changed
+HARDWARE_SOURCES = ["tpu.py", "decoder.py", "matrix.py", "activate.py", "isa.py", "config.py"]
+
+# an elaborated TPU: the PyRTL block and the wires and memories tpu() returns.
+# write_ports is filled in by the first compiled-backend run that uses it, and
+# fast_sim_func and fast_sim_names by the first fast-backend one after that
+# (see WarmFastSimulation)
+class TPUNetlist(object):
+    def __init__(self, block, wires):
+        self.block = block
+        self.wires = wires
+        self.write_ports = None
+        self.fast_sim_func = None
+        self.fast_sim_names = None
+
+# a FastSimulation that reuses the function an earlier FastSimulation of the
+# same netlist generated and compiled, instead of checking the block and
+# building the function again. that's most of the cost of starting a run
+# (about 1.4s of 1.6s at matsize 16), and sim_func keeps no state between
+# calls, so any number of runs can share it. setting up without the code
+# generation means doing by hand what FastSimulation.__init__ does, which
+# pyrtl is free to change, so runs only start warm when
+# warm_fast_sim_supported() says the installed pyrtl still matches
+class WarmFastSimulation(FastSimulation):
+    def __init__(self, netlist, register_value_map=None, memory_value_map=None, 
+                 tracer=None):
+        if netlist.fast_sim_func is not None and warm_fast_sim_supported():
+            self._start_warm(netlist, register_value_map or {}, 
+                             memory_value_map or {}, tracer)
+            return
+        super().__init__(register_value_map=register_value_map, 
+                         memory_value_map=memory_value_map, tracer=tracer, 
+                         block=netlist.block)
+        netlist.fast_sim_func = self.sim_func
+        netlist.fast_sim_names = getattr(self, 'internal_names', None)
+
+    # what FastSimulation.__init__ sets up, less the code generation
+    def _start_warm(self, netlist, register_value_map, memory_value_map, tracer):
+        self.block = netlist.block
+        self.default_value = 0
+        self.tracer = tracer
+        self.sim_func = netlist.fast_sim_func
+        self.code_file = None
+        self.mems = {}
+        self.regs = {}
+        self.internal_names = netlist.fast_sim_names
+        for r in self.block.wirevector_subset(Register):
+            rval = register_value_map.get(r, r.reset_value)
+            self.regs[r.name] = self.default_value if rval is None else rval
+        self._initialize_mems(memory_value_map)
+        if self.tracer is not None:
+            self.tracer._set_initial_values(self.default_value, register_value_map, 
+                                            memory_value_map)
+
+# set up a FastSimulation of a small block with a register and a memory both
+# ways, and check they end up with the same attributes and take the same
+# steps. any difference, or an error, means this pyrtl's FastSimulation has
+# moved on from what _start_warm copies
+def probe_warm_fast_sim():
+    try:
+        with temp_working_block():
+            count = Register(4, 'probe_count')
+            count.next <<= count + 1
+            mem = MemBlock(4, 2, 'probe_mem')
+            mem[count[:2]] <<= count
+            out = Output(4, 'probe_out')
+            out <<= mem[count[1:3]]
+            netlist = TPUNetlist(working_block(), None)
+        cold = WarmFastSimulation(netlist, {count: 3}, {mem: {0: 5}}, 
+                                  SimulationTrace(block=netlist.block))
+        warm = WarmFastSimulation.__new__(WarmFastSimulation)
+        warm._start_warm(netlist, {count: 3}, {mem: {0: 5}}, 
+                         SimulationTrace(block=netlist.block))
+        if vars(cold).keys() != vars(warm).keys():
+            return False
+        for _ in range(6):
+            cold.step({})
+            warm.step({})
+        return (cold.regs == warm.regs and cold.mems == warm.mems and 
+                cold.outs == warm.outs and cold.tracer.trace == warm.tracer.trace)
+    except Exception:
+        return False
+
+_warm_fast_sim_supported = None
+
+# whether WarmFastSimulation can start runs warm with the installed pyrtl.
+# probed once per process
+def warm_fast_sim_supported():
+    global _warm_fast_sim_supported
+    if _warm_fast_sim_supported is None:
+        _warm_fast_sim_supported = probe_warm_fast_sim()
+    return _warm_fast_sim_supported
+
+# netlists built in this process, by netlist_key
+netlists = {}
+
+# the tpu() arguments for a run. runs with the same key share a netlist and
+# only differ in the memory contents they give the simulator
+def netlist_key(matsize, bitwidth):
+    return (matsize, config.HOST_ADDR_SIZE, config.UB_ADDR_SIZE, 
+            config.WEIGHT_DRAM_ADDR_SIZE, config.ACC_ADDR_SIZE, bitwidth, 
+            config.INSTRUCTION_WIDTH, config.IMEM_ADDR_SIZE, 
+            config.HAZARD_DETECTION)
+
+def netlist_filename(cache_dir, key):
+    sources = hashlib.sha1()
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in HARDWARE_SOURCES:
+        with open(os.path.join(base, name), 'rb') as f:
+            sources.update(f.read())
+    name = "_".join(str(int(x)) for x in key)
+    return os.path.join(cache_dir, f"tpu_{name}_{sources.hexdigest()[:12]}.pkl")
+
+# return the TPUNetlist for this configuration, elaborating it only the first
+# time it's needed in this process. with cache_dir, netlists are also pickled
+# there so later processes can load them instead of elaborating. either way
+# the netlist becomes the working block. the simulators check it, so it isn't
+# checked again here
+def get_netlist(matsize, bitwidth, cache_dir=None):
+    key = netlist_key(matsize, bitwidth)
+    if key in netlists:
+        set_working_block(netlists[key].block, no_sanity_check=True)
+        return netlists[key]
+
+    filename = netlist_filename(cache_dir, key) if cache_dir else None
+    if filename and os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            netlist = TPUNetlist(*pickle.load(f))
+    else:
+        reset_working_block()
+        wires = tpu(matsize, config.HOST_ADDR_SIZE, config.UB_ADDR_SIZE, 
+            config.WEIGHT_DRAM_ADDR_SIZE, config.ACC_ADDR_SIZE, bitwidth, 
+            config.INSTRUCTION_WIDTH, config.IMEM_ADDR_SIZE, 
+            config.HAZARD_DETECTION)
+        netlist = TPUNetlist(working_block(), wires)
+        if filename:
+            os.makedirs(cache_dir, exist_ok=True)
+            # write then rename, so parallel runs never read half a file
+            with open(f"{filename}.{os.getpid()}", 'wb') as f:
+                pickle.dump((netlist.block, netlist.wires), f, 
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{filename}.{os.getpid()}", filename)
+
+    set_working_block(netlist.block, no_sanity_check=True)
+    netlists[key] = netlist
+    return netlist
+
+# build everything a fast-backend run of this configuration needs before the
+# first one starts: the netlist and its simulation function. for processes
+# that will run many programs on the same TPU, like squishtest sweep workers
+def warm_up(matsize, bitwidth, cache_dir=None):
+    netlist = get_netlist(matsize, bitwidth, cache_dir)
+    if netlist.fast_sim_func is None:
+        WarmFastSimulation(netlist)
+    return netlist
+
+
+# checkpoints of a run (see checkpoint.py). runtpu reads the simulator's
+# outputs at the start of a cycle, and those come from the step before, so a
+# checkpoint at cycle N holds the registers and memories from before step
+# N-1 and that step's inputs, and restoring replays the step. the rest is
+# what runtpu keeps between cycles: the weight tile being sent and the host
+# memory. IMem isn't saved, it's loaded from the program being run. only
+# FastSimulation can read its registers, so checkpoints are written with the
+# "fast" backend, but either backend can restore one
+
+# the memories a checkpoint holds: all but IMem, in a fixed order
+def checkpoint_mems(block, imem):
+    mems = {net.op_param[1] for net in block.logic_subset('m@')}
+    return sorted((m for m in mems if m is not imem and not isinstance(m, RomBlock)),
+                  key=lambda m: m.name)
+
+def checkpoint_regs(block):
+    return sorted(block.wirevector_subset(Register), key=lambda r: r.name)
+
+# a hash of the registers and memories a checkpoint holds, so it's never
+# restored into a design it doesn't fit
+def netlist_fingerprint(block, mems):
+    fingerprint = hashlib.sha1()
+    for r in checkpoint_regs(block):
+        fingerprint.update(f"{r.name}:{r.bitwidth};".encode())
+    for m in mems:
+        fingerprint.update(f"{m.name}:{m.addrwidth}:{m.bitwidth};".encode())
+    return fingerprint.hexdigest()
+
+# copy the registers and memories of a FastSimulation
+def snapshot_sim(sim, mems):
+    return dict(sim.regs), {m: dict(sim.inspect_mem(m)) for m in mems}
+
+def save_rtl_checkpoint(path, block, mems, snapshot, inputs, cycle, chunkaddr,
+                        weighttile, hostmem_np, bitwidth, matsize):
+    regs, mem_values = snapshot
+    reg_list = checkpoint_regs(block)
+    arrays = {
+        "bitwidth": bitwidth, "matsize": matsize,
+        "fingerprint": np.array(netlist_fingerprint(block, mems)),
+        "cycle": cycle, "chunkaddr": int(chunkaddr),
+        "weighttile": ints_to_bytes([weighttile], [matsize*matsize*bitwidth]),
+        "regs": ints_to_bytes([regs[r.name] for r in reg_list], [r.bitwidth for r in reg_list]),
+        "input_names": np.array([w.name for w in inputs]),
+        "inputs": ints_to_bytes(list(inputs.values()), [w.bitwidth for w in inputs]),
+        "hm": hostmem_np,
+    }
+    for i, m in enumerate(mems):
+        addrs = sorted(mem_values[m])
+        arrays[f"mem{i}_addrs"] = np.array(addrs, dtype=np.int64)
+        arrays[f"mem{i}"] = ints_to_bytes([mem_values[m][a] for a in addrs], 
+                                          [m.bitwidth] * len(addrs))
+    save_checkpoint(path, "runtpu", **arrays)
+
+# the register_value_map, memory_value_map and replayed inputs to build the
+# simulator from, out of a loaded checkpoint
+def rtl_checkpoint_maps(state, path, block, mems, bitwidth, matsize):
+    if (int(state["bitwidth"]), int(state["matsize"])) != (bitwidth, matsize):
+        raise ValueError(f"{path} was saved with bitwidth {state['bitwidth']} and matsize "
+                         f"{state['matsize']}, not {bitwidth} and {matsize}.")
+    if str(state["fingerprint"]) != netlist_fingerprint(block, mems):
+        raise ValueError(f"{path} was saved from a different netlist. Checkpoints only "
+                         "restore into the design they were taken from.")
+    reg_list = checkpoint_regs(block)
+    register_value_map = dict(zip(reg_list, bytes_to_ints(state["regs"], 
+                                                          [r.bitwidth for r in reg_list])))
+    memory_value_map = {}
+    for i, m in enumerate(mems):
+        addrs = state[f"mem{i}_addrs"].tolist()
+        memory_value_map[m] = dict(zip(addrs, bytes_to_ints(state[f"mem{i}"], 
+                                                            [m.bitwidth] * len(addrs))))
+    wires = [block.get_wirevector_by_name(name) for name in state["input_names"].tolist()]
+    inputs = dict(zip(wires, bytes_to_ints(state["inputs"], [w.bitwidth for w in wires])))
+    return register_value_map, memory_value_map, inputs
+
+
+# what an Observer sees of the TPU on a cycle, before the simulator steps.
+# the memories are only read if an observer asks for them, and at most once
+# per cycle however many observers do. hostmem is the harness's host memory
+# model (see memmodels.py)
+class CycleView(object):
+    def __init__(self, sim, cycle, ubuffer, acc_mems, bitwidth, matsize,
+                 hostmem=None):
+        self.sim = sim
+        self.cycle = cycle
+        self.bitwidth = bitwidth
+        self.matsize = matsize
+        self.hostmem = hostmem
+        self._ubuffer = ubuffer
+        self._acc_mems = acc_mems
+        self._ub_snapshot = None
+        self._acc_snapshot = None
+
+    def inspect(self, wire):
+        return self.sim.inspect(wire)
+
+    # {address: packed row} for the UB rows written so far
+    def ubuffer(self):
+        if self._ub_snapshot is None:
+            self._ub_snapshot = dict(self.sim.inspect_mem(self._ubuffer))
+        return self._ub_snapshot
+
+    # a (rows, matsize+1) array of the accumulators. column 0 is the address
+    # and column i+1 is acc_mems[i]
+    def accumulators(self):
+        if self._acc_snapshot is None:
+            acc_vals = [self.sim.inspect_mem(m) for m in self._acc_mems]
+            max_addr = max((max(a.keys(), default=0) for a in acc_vals), default=0)
+            amems = np.zeros([max_addr+1, len(acc_vals)+1], dtype=np.int64)
+            amems[:, 0] = np.arange(max_addr+1)
+            for i, ami in enumerate(acc_vals):
+                for k, v in ami.items():
+                    amems[k][i+1] = v
+            self._acc_snapshot = amems
+        return self._acc_snapshot
+
+    # the values in one UB row, without copying the rest
+    def ubuffer_row(self, addr):
+        return make_vec_2(self.sim.inspect_mem(self._ubuffer).get(addr, 0),
+                          self.bitwidth, self.matsize)
+
+    # the values in one accumulator row
+    def accumulator_row(self, addr):
+        return [self.sim.inspect_mem(m).get(addr, 0) for m in self._acc_mems]
+
+    # the values in one host memory row
+    def hostmem_row(self, addr):
+        return make_vec_2(self.hostmem.read(addr) or 0, self.bitwidth, self.matsize)
+
+# hooks into runtpu's main loop. pass instances to runtpu(observers=[...]).
+# on_cycle runs every cycle before the simulator steps, and on_finish runs
+# once after the TPU halts. on_cycle can return True to stop the simulation
+# there instead; the memories are still saved as they are
+class Observer(object):
+    def on_cycle(self, view: CycleView) -> bool:
+        return False
+
+    def on_finish(self, view: CycleView):
+        pass
+
+# print the UB and accumulators every cycle (--print-mems)
+class PrintMemories(Observer):
+    def on_cycle(self, view):
+        print(f"UBuffer@{view.cycle}:")
+        ub = view.ubuffer()
+        for k in sorted(ub.keys()):
+            print(f"\t{k}: {make_vec_2(ub[k], view.bitwidth, view.matsize)}")
+        print(f"AccMems@{view.cycle}:")
+        with np.printoptions(linewidth=np.inf):
+            print(view.accumulators())
+        print("\n")
+
+
+def runtpu(prog: Union[str, bytes], hostmem_filename: str, weightsmem_filename: str, 
+           bitwidth: int, matsize: int, output_folder: str, output_trace: bool,
+           backend: str = "fast", netlist_cache_dir: str = None,
+           trace_prefixes: list = None, observers: list = None,
+           memory_model: str = "array", checkpoint: str = None,
+           checkpoint_at: int = 0, restore: str = None):
+    # Read the program (a .out file or the binary itself) and build an
+    # instruction list
+    instrs = as_program(prog).words
 
     #print(list(map(hex, instrs)))
 
-    # Read the dram files and build memory images
-    hostarray = np.load(hostmem_filename)
-    # print("Host array:")
-    # print(hostarray)
-    host_shape = hostarray.shape
-    # print(host_shape)
-    if len(host_shape) == 3:
-        flat_host = np.zeros((host_shape[0] * host_shape[1], host_shape[2]))
-        # print(flat_host.shape)
-        for i, arr in enumerate(hostarray):
-            flat_host[host_shape[1]*i: host_shape[1]*(i+1)] = arr
-    if len(host_shape) == 2:
-        flat_host = hostarray
-    # print("Flat host array:")
-    # print(flat_host)
-    hostmem = { a : concat_vec(vec, bitwidth) for a,vec in enumerate(flat_host) }
-    # print("Host memory start:")
-    # print(hostmem)
-    # print_mem(hostmem)
-
-    weightsarray = np.load(weightsmem_filename)
-    # print("Weightsarray")
-    # print(weightsarray)
-    # print(weightsarray.shape)
-    size = weightsarray.shape[-1]
-    weight_shape = weightsarray.shape
-    if len(weight_shape) == 3:
-        weightsmem = { a : concat_tile(tile, bitwidth) for a,tile in enumerate(weightsarray) }
-    if len(weight_shape) == 2:
-        weightsmem = np.zeros(())
-    #weightsmem = { a : concat_vec(vec, bitwidth) for a,vec in enumerate(weightsarray) }
-    # print("Weight memory:")
-    # print_weight_mem(weightsmem, size=size, bits=bitwidth)
-    # print(weightsmem)
+    # a restored run takes its host memory from the checkpoint, through a
+    # file so that every memory model can load it
+    state = None
+    if restore:
+        state = load_checkpoint(restore, "runtpu")
+        os.makedirs(output_folder, exist_ok=True)
+        hostmem_filename = f"{output_folder}/checkpoint_hm.npy"
+        np.save(hostmem_filename, state["hm"])
+
+    # Build the host memory and weight DRAM models. the "array" and "mmap"
+    # models only pack the rows and tiles the program reads
+    hostmem, weightsmem = load_memories(memory_model, hostmem_filename, 
+                                        weightsmem_filename, bitwidth, matsize,
+                                        result_path=f"{output_folder}/hm.npy")
 
     '''
     Left-most element of each vector should be left-most in memory: use concat_list for each vector
@@ -244,32 +547,84 @@ def runtpu(prog: str, hostmem_filename: str, weightsmem_filename: str,
             raise Exception("Reading more weights than are present in one tile?")
         return (tile >> int(((nchunks - chunkn - 1))*64*bitwidth)) & chunkmask
 
-    reset_working_block()
+    netlist = get_netlist(matsize, bitwidth, netlist_cache_dir)
     IMem, UBuffer, weights_dram_in, weights_dram_valid, hostmem_rdata, halt, \
         hostmem_re, hostmem_raddr, hostmem_we, hostmem_waddr, hostmem_wdata, \
         weights_dram_read, weights_dram_raddr, acc_mems, buf4, buf3, buf2, buf1, \
-        whm_src = tpu(matsize, config.HOST_ADDR_SIZE, config.UB_ADDR_SIZE, 
-        config.WEIGHT_DRAM_ADDR_SIZE, config.ACC_ADDR_SIZE, bitwidth, 
-        config.INSTRUCTION_WIDTH, config.IMEM_ADDR_SIZE, 
-        config.HAZARD_DETECTION)
-
+        whm_src = netlist.wires
 
-    # Run Simulation
-    sim_trace = SimulationTrace()
-    sim = FastSimulation(tracer=sim_trace, memory_value_map={ IMem : { a : v for a,v in enumerate(instrs)} })
+    if backend == "auto":
+        backend = "compiled" if compiled_sim_available() else "fast"
+    if checkpoint and backend != "fast":
+        raise ValueError("Checkpoints can only be written with the fast backend.")
 
+    mems = checkpoint_mems(netlist.block, IMem)
+    register_value_map = {}
+    memory_value_map = { IMem : { a : v for a,v in enumerate(instrs)} }
     din = {
         weights_dram_in : 0,
         weights_dram_valid : 0,
         hostmem_rdata : 0,
     }
-
+    first_inputs = din
     cycle = 0
     chunkaddr = nchunks
-    sim.step(din)
+    weighttile = 0
+    if state is not None:
+        register_value_map, restored_mems, first_inputs = rtl_checkpoint_maps(
+            state, restore, netlist.block, mems, bitwidth, matsize)
+        memory_value_map.update(restored_mems)
+        cycle = int(state["cycle"])
+        chunkaddr = int(state["chunkaddr"])
+        weighttile = bytes_to_ints(state["weighttile"], [matsize*matsize*bitwidth])[0]
+
+    # Run Simulation
+    # with output_trace, the wires starting with one of trace_prefixes (or all
+    # the named wires) are written to output_folder/trace as the simulation
+    # runs. debugging/explore_trace.py shows how to read it back
+    trace_path = f"{output_folder}/trace" if output_trace else None
+    if backend == "fast":
+        sim_trace = StreamingTrace(trace_path, trace_prefixes, block=netlist.block) if output_trace else None
+        sim = WarmFastSimulation(netlist, tracer=sim_trace, register_value_map=register_value_map, memory_value_map=memory_value_map)
+    elif backend == "compiled":
+        if not compiled_sim_available():
+            raise RuntimeError("The compiled backend needs gcc and a 64-bit Python.")
+        # only the Inputs and Outputs end up in the trace. a cached netlist
+        # keeps the Outputs from the first compiled run
+        if netlist.write_ports is None:
+            fifo_flags = [netlist.block.get_wirevector_by_name(name) for name in 
+                          ['fifo_empty4', 'fifo_empty3', 'fifo_empty2', 'fifo_full']]
+            netlist.write_ports = expose_to_compiled_sim([buf4, buf3, buf2] + buf1 + fifo_flags, 
+                                                         [UBuffer] + acc_mems)
+            # the new Outputs are part of the block now, and a fast sim_func
+            # generated before them doesn't compute them
+            netlist.fast_sim_func = None
+            netlist.fast_sim_names = None
+        # CompiledSimulation.inspect reads the trace, so it always tracks
+        # every wire it can, whatever trace_prefixes says
+        sim_trace = StreamingTrace(trace_path, block=netlist.block)
+        sim = WriteTrackingSimulation(netlist.write_ports, tracer=sim_trace, block=netlist.block, register_value_map=register_value_map, memory_value_map=memory_value_map)
+        for mem in sim.written:
+            sim.written[mem].update(memory_value_map.get(mem, {}))
+    else:
+        raise ValueError(f"Unknown simulation backend {backend}. Choose from {BACKENDS}.")
+
+    # with checkpoint, snapshot holds the simulator's state and inputs from
+    # the cycle before checkpoint_at until the checkpoint is written
+    snapshot = None
+    if checkpoint and checkpoint_at == cycle:
+        snapshot = (snapshot_sim(sim, mems), first_inputs)
+    sim.step(first_inputs)
     i = 0
     while True:
         i += 1
+        if snapshot is not None and cycle == checkpoint_at:
+            save_rtl_checkpoint(checkpoint, netlist.block, mems, snapshot[0], snapshot[1],
+                                cycle, chunkaddr, weighttile, hostmem.to_np(), bitwidth,
+                                matsize)
+            print(f"Checkpoint at cycle {cycle} saved to {checkpoint}")
+            snapshot = None
+
         # Halt signal
         if sim.inspect(halt):
             break
@@ -290,8 +645,9 @@ def runtpu(prog: str, hostmem_filename: str, weightsmem_filename: str,
             # print("Reading host memory")
             raddr = sim.inspect(hostmem_raddr)
             # print("Read Host Memory: addr {}".format(raddr))
-            if raddr in hostmem: #this causes a pre-mature read of hostmem[end+1] after an RHM read from [start:end]. only lasts for one cycle and doesn't seem to affect anything else
-                d[hostmem_rdata] = hostmem[raddr]
+            rdata = hostmem.read(raddr)
+            if rdata is not None: #this causes a pre-mature read of hostmem[end+1] after an RHM read from [start:end]. only lasts for one cycle and doesn't seem to affect anything else
+                d[hostmem_rdata] = rdata
 
         # Write host memory signal
         if sim.inspect(hostmem_we):
@@ -301,7 +657,7 @@ def runtpu(prog: str, hostmem_filename: str, weightsmem_filename: str,
             # print("wdata = ", sim.inspect('wdata'))
             waddr = sim.inspect(hostmem_waddr)
             wdata = sim.inspect(hostmem_wdata)
-            hostmem[waddr] = wdata
+            hostmem.write(waddr, wdata)
 
         # print(f"cycle {cycle}: hostmem[0] = {hostmem[0]}")
 
@@ -309,7 +665,7 @@ def runtpu(prog: str, hostmem_filename: str, weightsmem_filename: str,
         if sim.inspect(weights_dram_read):
             # print("Reading weights memory")
             weightaddr = sim.inspect(weights_dram_raddr)
-            weighttile = weightsmem[weightaddr]
+            weighttile = weightsmem.read(weightaddr)
             chunkaddr = 0
             # print("Read Weights: addr {}".format(weightaddr))
             #print(weighttile)
@@ -322,45 +678,34 @@ def runtpu(prog: str, hostmem_filename: str, weightsmem_filename: str,
         # print(f"mma_data_width_temp = {sim.inspect('mma_data_width_temp')}")
         # print(f"data_width_temp = {sim.inspect('data_width_temp')}")
         # print(f"act_acc_mems_wv_0 = {sim.inspect('act_acc_mems_wv_0')}")
-        # print(f"UBuffer@{cycle}:")
-        ub = sim.inspect_mem(UBuffer)
-        # for k in sorted(ub.keys()):
-        #     print(f"\t{k}: {make_vec_2(ub[k], bitwidth, matsize)}")
-
-        # print(f"AccMems@{cycle}:")
-        max_addrs = 0
-        for i in range(len(acc_mems)):
-            # print("keys = ", sim.inspect_mem(acc_mems[i]).keys())
-            max_addrs = max(max_addrs, max(sim.inspect_mem(acc_mems[i]).keys(), default=0))
-        # print(max_addrs)
-        amems = np.zeros([max_addrs+1, len(acc_mems)+1])
-        for i in range(len(acc_mems)):
-            ami = sim.inspect_mem(acc_mems[i])
-            for k in sorted(ami.keys()):
-                amems[k][i+1] = ami[k]
-        np.set_printoptions(linewidth=np.inf)
         # print(f"mmu_advance_fifo = {sim.inspect('mmu_advance_fifo')}")
-
-        # for i in range(MATSIZE):
-        #     print(f"AccMems[i][start_addr_reg] = {sim.inspect(f'act_acc_mems_at_start_addr_reg_{i}')}")
-        for i in range(amems.shape[0]):
-            amems[i][0] = i
-        # print(amems.astype(int))
-        # print("\n\n")
+        if observers:
+            view = CycleView(sim, cycle, UBuffer, acc_mems, bitwidth, matsize, hostmem)
+            stop = [observer.on_cycle(view) for observer in observers]
+            if any(stop):
+                print(f"Stopped by an observer at cycle {cycle}")
+                break
+        if checkpoint and checkpoint_at == cycle + 1:
+            snapshot = (snapshot_sim(sim, mems), d)
         sim.step(d)
         cycle += 1
 
     # print("\n\n")
     print("Simulation terminated at cycle {}".format(cycle))
+    if checkpoint and checkpoint_at > cycle:
+        print(f"Halted before cycle {checkpoint_at}, no checkpoint saved")
 
     os.makedirs(output_folder, exist_ok=True)
 
-    if output_trace:
-        with open(f'{output_folder}/trace.pkl', 'wb') as file:
-            pickle.dump(sim_trace, file)
+    if sim_trace is not None:
+        sim_trace.close()
+    if observers:
+        view = CycleView(sim, cycle, UBuffer, acc_mems, bitwidth, matsize, hostmem)
+        for observer in observers:
+            observer.on_finish(view)
 
-    hostmem_np = hostmem_to_np(hostmem, bitwidth, matsize)
-    weightsmem_np = weightsmem_to_np(weightsmem, bitwidth, matsize)
+    hostmem_np = hostmem.to_np()
+    weightsmem_np = weightsmem.to_np()
     ubuffer_np = ubuffer_to_np(sim, UBuffer, bitwidth, matsize, row_count=0)
     wqueue_np = wqueue_to_np(sim, buf4, buf3, buf2, buf1, bitwidth, matsize)
     accmems_np = accmem_to_np(sim, acc_mems, matsize, row_count=0)
@@ -380,6 +725,14 @@ if __name__ == '__main__':
     parser.add_argument("-b", "--bitwidth", type=int, default=32, help="The bitwidth of the data.")
     parser.add_argument("-m", "--matsize", type=int, default=8, help="The size of the matrix.")
     parser.add_argument("-f", "--folder", type=str, default=None, help="The output folder path.")
+    parser.add_argument("--netlist-cache", type=str, default=None, help="A folder to save elaborated netlists in and load them from, so runs with the same configuration skip building the design.")
+    parser.add_argument("--trace-prefix", action="append", default=None, help="Only trace wires whose names start with this prefix. Can be given more than once. Traces every named wire by default.")
+    parser.add_argument("--print-mems", action="store_true", help="Print the unified buffer and accumulators every cycle.")
+    parser.add_argument("--memory-model", choices=MEMORY_MODELS, default="array", help="How to hold the host memory and weight DRAM: packed up front into dicts, as NumPy arrays packed a row at a time as they're read, or memory-mapped from the .npy files for images too big for RAM.")
+    parser.add_argument("--backend", choices=BACKENDS, default="fast", help="The PyRTL simulator to use: FastSimulation, CompiledSimulation (needs gcc), or CompiledSimulation when it's available.")
+    parser.add_argument("--checkpoint", type=str, default=None, help="Write a checkpoint to this .npz file at cycle --checkpoint-at, then carry on. Needs the fast backend.")
+    parser.add_argument("--checkpoint-at", type=int, default=0, help="The cycle to write --checkpoint at.")
+    parser.add_argument("--restore", type=str, default=None, help="Start from a checkpoint written with --checkpoint instead of from cycle 0. Its host memory replaces HostMemoryArray.")
     args = parser.parse_args()
 
     if not args.folder:
@@ -387,6 +740,17 @@ if __name__ == '__main__':
 
     hm, wm, ub, fq, acc = runtpu(args.prog, args.hostmem, args.weightsmem, 
                                  args.bitwidth, args.matsize, args.folder, 
-                                 output_trace=True)
-
+                                 output_trace=True, backend=args.backend,
+                                 netlist_cache_dir=args.netlist_cache,
+                                 trace_prefixes=args.trace_prefix,
+                                 observers=[PrintMemories()] if args.print_mems else None,
+                                 memory_model=args.memory_model,
+                                 checkpoint=args.checkpoint, 
+                                 checkpoint_at=args.checkpoint_at,
+                                 restore=args.restore)
+
+    if args.memory_model == "mmap":
+        # printing the host memory would go through every row of it
+        print(f"Host memory: {hm.shape[0]} rows, in {args.folder}/hm.npy")
+        hm = hm[:0]
     print_mems(hm, wm, ub, fq, acc, args.matsize)
@@ -0,0 +1,194 @@
+"""
+Reorders a program's instructions so that independent ones fill the distances
+hazards.py would otherwise pad with NOPs, for a TPU without hazard detection
+(config.py's HAZARD_DETECTION = False, N mode).
+
+An MMC keeps the systolic array busy for about 2*matsize + 5 + length cycles,
+and an RW's weights take a while to make their way through the FIFO, so a
+program written in dependence order (read the rows, read the weights,
+multiply, activate, write back) spends most of its time on NOPs. Most of
+those could be RHMs, WHMs and RWs for the next tile instead. schedule() does
+list scheduling over the program's dependences:
+
+    - data: two instructions that touch the same addresses of the UB, the
+      accumulators or host memory keep their order if either of them writes
+      those addresses (RHM writes the UB, WHM host memory, MMC the
+      accumulators and ACT the UB). RHM.S and WHM.S could touch any host
+      memory row
+    - weights: RWs keep their order, as do MMC.Ss, since the n-th MMC.S pops
+      the n-th RW's weights. every MMC stays between the MMC.Ss it was
+      between (it multiplies by the weights at the front of the FIFO) and
+      after the RW that put them there, and an RW stays after the MMC.S that
+      makes room for it in the FIFO, which holds 4
+    - SYNC and HLT stay where they are, with everything before them before
+      them
+
+Every step places, out of the instructions whose dependences are placed, the
+one hazards.py's latency model lets issue soonest, and of those that can
+issue at the same PC the one with the longest chain of dependent distances
+after it, so RWs and RHMs go early and overlap the MMCs before them. The
+result is padded with hazards.earliest(), the same as pad(); a reordering
+that comes out no shorter than the written order padded is dropped.
+
+Like pad(), it takes the program as straight-line code: ACT branches on the
+data, so branching programs, and programs with RHM.C (which writes its own PC
+into the UB), are outside it. Programs with ACT are refused unless the caller
+says their ACTs never branch or jump (allow_act, --allow-act).
+
+    python scheduler.py results.json prog.a [-m 8] [-o prog.sched.a] [--allow-act]
+"""
+
+import argparse
+from typing import List
+
+from assembler import assemble_text
+from hazards import (FIFO_DEPTH, FIXED_DISTANCE, Fifo, Instr, LatencyModel, check_movable,
+                     decode, earliest, fixed_length, footprint, pad, padded_text)
+from isa import *
+
+# the memory each instruction writes; it reads the rest of its footprint
+WRITES = {'RHM': 'ub', 'WHM': 'hm', 'MMC': 'acc', 'ACT': 'ub'}
+
+# whether `second` has to stay after `first` for their data: they touch the
+# same addresses of a memory one of them writes
+def data_dependent(first: Instr, second: Instr, footprints) -> bool:
+    a, b = footprints
+    written = {WRITES.get(BIN2OPCODE[first.op]), WRITES.get(BIN2OPCODE[second.op])}
+    return any(s1 < e2 and s2 < e1 for mem in a.keys() & b.keys() if mem in written
+               for s1, e1 in a[mem] for s2, e2 in b[mem])
+
+def dependences(instrs: List[Instr]) -> List[List[int]]:
+    """ For each instruction, the earlier ones it has to stay after (None for
+    NOPs, which are dropped).
+    """
+
+    footprints = [footprint(instr) for instr in instrs]
+    preds = [None] * len(instrs)
+    rws, pops, users = [], [], []  # RWs and MMC.Ss so far, MMCs since the last MMC.S
+    barrier = None
+    since = []  # instructions since the last SYNC or HLT
+    for j, instr in enumerate(instrs):
+        name = BIN2OPCODE[instr.op]
+        if name == 'NOP':
+            continue
+        deps = set() if barrier is None else {barrier}
+        if name in ('SYNC', 'HLT'):
+            deps.update(since)
+            barrier, since = j, []
+            preds[j] = sorted(deps)
+            continue
+
+        deps.update(i for i in since
+                    if data_dependent(instrs[i], instr, (footprints[i], footprints[j])))
+        if instr.kind == 'rw':
+            if rws:
+                deps.add(rws[-1])
+            if len(rws) >= FIFO_DEPTH and len(pops) > len(rws) - FIFO_DEPTH:
+                deps.add(pops[len(rws) - FIFO_DEPTH])
+            rws.append(j)
+        elif name == 'MMC':
+            if len(rws) > len(pops):
+                deps.add(rws[len(pops)])
+            if pops:
+                deps.add(pops[-1])
+            if instr.kind == 'mmcs':
+                deps.update(users)
+                pops.append(j)
+                users = []
+            else:
+                users.append(j)
+        since.append(j)
+        preds[j] = sorted(deps)
+    return preds
+
+# for each instruction, the longest chain of distances through the
+# instructions that depend on it
+def priorities(instrs, preds, model):
+    longest = [0] * len(instrs)
+    for j in reversed(range(len(instrs))):
+        for i in preds[j] or ():
+            distance = model.distance(instrs[i], instrs[j], (0, FIFO_DEPTH)).distance
+            longest[i] = max(longest[i], distance + longest[j])
+    return longest
+
+# the cycles the instructions take in `order`, padded. schedule() has
+# already checked the program can be moved
+def placed_length(instrs, order, model):
+    pcs = pad([instrs[i] for i in order], model, allow_act=True)
+    return max(pcs) + 1 if pcs else 0
+
+def schedule(instrs: List[Instr], model: LatencyModel, allow_act: bool = False) -> List[int]:
+    """ An order for the instructions other than NOPs (as indices into
+    `instrs`) that keeps their dependences and takes as few cycles as the list
+    scheduler finds, padded with the model's distances. Programs with ACT are
+    refused unless `allow_act`, as for pad().
+    """
+
+    check_movable(instrs, allow_act)
+    preds = dependences(instrs)
+    longest = priorities(instrs, preds, model)
+    written = [j for j, deps in enumerate(preds) if deps is not None]
+
+    waiting = {j: len(preds[j]) for j in written}
+    succs = {j: [] for j in written}
+    for j in written:
+        for i in preds[j]:
+            succs[i].append(j)
+    ready = [j for j in written if not waiting[j]]
+
+    fifo = Fifo(model.weight_latency)
+    pcs, counts = [None] * len(instrs), [None] * len(instrs)
+    order = []
+    while ready:
+        soonest = {j: earliest(instrs[j], instrs, order, pcs, counts, fifo, model)[0]
+                   for j in ready}
+        pc = min(soonest.values())
+        j = min((j for j in ready if soonest[j] == pc), key=lambda j: (-longest[j], j))
+        ready.remove(j)
+        pcs[j] = pc
+        counts[j] = fifo.at(pc)
+        fifo.issue(instrs[j], pc)
+        order.append(j)
+        for k in succs[j]:
+            waiting[k] -= 1
+            if not waiting[k]:
+                ready.append(k)
+
+    if placed_length(instrs, order, model) >= placed_length(instrs, written, model):
+        return written
+    return order
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Reorder a program to hide N mode latencies and pad it with the fewest NOPs that avoid its hazards.')
+    parser.add_argument('results', help='squishtest results.json to take the distances from.')
+    parser.add_argument('path', help='the assembly program.')
+    parser.add_argument('-m', '--matsize', type=int, default=8, help='matrix size of the TPU.')
+    parser.add_argument('-b', '--bitwidth', type=int, default=32, help='bitwidth of the TPU.')
+    parser.add_argument('-d', '--fixed-distance', type=int, default=FIXED_DISTANCE,
+                        help='distance to use where the table has no measurement.')
+    parser.add_argument('-o', '--output', help='where to write the scheduled program (default: path with .sched.a).')
+    parser.add_argument('--allow-act', action='store_true',
+                        help="schedule programs with ACT, whose results must then never branch or jump.")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    model = LatencyModel.load(args.results, args.matsize, args.bitwidth,
+                              fixed_distance=args.fixed_distance)
+    with open(args.path) as f:
+        instrs = decode(assemble_text(f.read()))
+
+    order = schedule(instrs, model, allow_act=args.allow_act)
+    scheduled = [instrs[i] for i in order]
+    pcs = pad(scheduled, model, allow_act=args.allow_act)
+    output = args.output or args.path.rsplit('.', 1)[0] + '.sched.a'
+    with open(output, 'w') as f:
+        f.write(padded_text(scheduled, pcs))
+    written = [instr for instr in instrs if BIN2OPCODE[instr.op] != 'NOP']
+    print('{} instructions as written, {} with fixed distance {}, {} padded in order, '
+          '{} scheduled ({})'.format(
+              len(instrs), fixed_length(instrs, args.fixed_distance), args.fixed_distance,
+              max(pad(written, model, allow_act=args.allow_act)) + 1 if written else 0, max(pcs) + 1 if pcs else 0,
+              output))
@@ -1,14 +1,21 @@
 # coding=utf-8
 import argparse
 from datetime import datetime
+from enum import IntEnum
+import functools
+import glob
+import hashlib
 import os
 import sys
+from typing import List, Optional, Union
+import copy
 import numpy as np
 from collections import deque
-from math import exp
 import utils
 import config
 import isa
+from program import INSTR_DTYPE, as_program, decode_program
+from checkpoint import save_checkpoint, load_checkpoint
 
 SIGNED_DTYPES = {
     8: np.int8,
@@ -24,21 +31,282 @@ UNSIGNED_DTYPES = {
     64: np.uint64
 }
 
+# where to cache decoded programs, keyed by a hash of the binary, so repeated
+# runs of the same .out skip decoding. the cache is off unless this (or
+# another folder) is passed as decode_cache_dir, or --decode-cache is given
+DECODE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                                ".decode_cache")
+
+# the most decoded programs a cache folder keeps. the least recently used
+# ones beyond this are deleted
+DECODE_CACHE_ENTRIES = 256
+
+# the files decode_program's output depends on. a cached program is only used
+# if none of them have changed since it was decoded
+DECODER_SOURCES = ["program.py", "isa.py", "config.py"]
+
+HLT_OP = isa.OPCODE2BIN['HLT'][0]
+
+
+# a hash of DECODER_SOURCES, for the cache file names
+@functools.lru_cache(maxsize=None)
+def decoder_version():
+    sources = hashlib.sha1()
+    base = os.path.dirname(os.path.abspath(__file__))
+    for name in DECODER_SOURCES:
+        with open(os.path.join(base, name), 'rb') as f:
+            sources.update(f.read())
+    return sources.hexdigest()[:12]
+
+# delete all but the `keep` most recently used entries of a decode cache
+def trim_decode_cache(cache_dir, keep=DECODE_CACHE_ENTRIES):
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".npy"):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass  # another run trimmed it
+    for _, path in sorted(entries, reverse=True)[keep:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+# read and decode the program `prog` (a .out file or the binary itself). a
+# .out goes through the on-disk cache in `cache_dir` unless it's None; a
+# binary given in memory never does, so in-memory runs don't touch the disk
+def load_program(prog: Union[str, bytes], cache_dir: Optional[str] = None) -> np.recarray:
+    program = as_program(prog)
+    if cache_dir is None or not isinstance(prog, str):
+        return program.fields
+
+    cache_path = os.path.join(cache_dir, f"{hashlib.sha256(program.data).hexdigest()}"
+                                         f"_{decoder_version()}.npy")
+    if os.path.exists(cache_path):
+        fields = np.load(cache_path).view(np.recarray)
+        os.utime(cache_path)  # most recently used
+        return fields
+
+    # write to a temporary file first so parallel runs never see a partial file
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, program.fields)
+    os.replace(tmp_path, cache_path)
+    trim_decode_cache(cache_dir)
+    return program.fields
+
+
+# activation functions selected by the ACT function bits (isa.ACT_FUNC_MASK).
+# any other value passes the accumulator through unchanged
+ACT_RELU = 1
+ACT_SIGMOID = 2
+
+# sigmoid lookup table, copied from the RomBlock in activate.sigmoid. inputs
+# of 8 and up (including every negative value) saturate to 255, so clamping
+# the index to 8 covers the whole input range
+SIGMOID_TABLE = np.array([128, 187, 225, 243, 251, 254, 255, 255, 255], 
+                         dtype=np.uint8)
+
+
+# apply ACT function `func` to a block of accumulator rows, giving exactly the
+# UB rows activate.act_top writes. ReLU zeroes values whose sign bit is set and
+# keeps the low 8 bits of the rest; sigmoid is a table lookup.
+def activate(values, func, bitwidth):
+    if func == ACT_RELU:
+        signed = values.astype(SIGNED_DTYPES[bitwidth], copy=False)
+        out = np.where(signed < 0, 0, values & 0xFF).astype(np.uint8)
+    elif func == ACT_SIGMOID:
+        out = SIGMOID_TABLE[np.minimum(values, len(SIGMOID_TABLE) - 1)]
+    else:
+        return values
+    return pack_activated(out, bitwidth)
+
+
+# the hardware concatenates the 8-bit activation outputs of a row into one
+# value (first output in the lowest byte) and zero-extends it to a full UB row.
+# for bitwidths over 8 that puts several outputs in each UB cell, starting
+# from cell 0, and leaves the remaining cells 0. leading axes (like the batch
+# axis of BatchTPUSim) are kept
+def pack_activated(out, bitwidth):
+    *lead, matsize = out.shape
+    out = out.reshape(-1, matsize)
+    rows = out.shape[0]
+    per_cell = bitwidth // 8
+    cells = -(-matsize // per_cell)
+    row_bytes = np.zeros((rows, cells * per_cell), dtype=np.uint8)
+    row_bytes[:, :matsize] = out
+    packed = np.zeros((rows, matsize), dtype=UNSIGNED_DTYPES[bitwidth])
+    packed[:, :cells] = row_bytes.view(f"<u{per_cell}")
+    return packed.reshape(*lead, matsize)
+
+
+# a 2d memory of `width`-wide rows for the functional simulator. storage is
+# preallocated and doubled when a write runs past it, instead of resizing the
+# array on every instruction. everything past the written rows is kept at 0, so
+# reads inside the storage are plain views. `rows` is one past the highest row
+# ever written, which is how far the trimmed memory reported by get_mems goes
+class SimMemory(object):
+    def __init__(self, width: int, dtype, capacity: int = 0,
+                 data: Optional[np.ndarray] = None):
+        self.rows = 0 if data is None else data.shape[0]
+        self.storage = np.zeros((max(capacity, self.rows), width), dtype=dtype)
+        if data is not None:
+            self.storage[:self.rows] = data
+
+    # make sure rows [0, end) exist in the storage, doubling it if they don't
+    def _reserve(self, end):
+        capacity = self.storage.shape[0]
+        if end > capacity:
+            storage = np.zeros((max(end, 2*capacity), self.storage.shape[1]), 
+                               dtype=self.storage.dtype)
+            storage[:capacity] = self.storage
+            self.storage = storage
+
+    # rows [start, start+length). rows that were never written read as 0s. 
+    # this is a view of the storage unless the read runs past the end of it,
+    # in which case the missing rows are zero-filled in a copy rather than
+    # growing the storage
+    def read(self, start, length):
+        end = start + length
+        if end <= self.storage.shape[0]:
+            return self.storage[start:end]
+        res = np.zeros((length, self.storage.shape[1]), dtype=self.storage.dtype)
+        if start < self.storage.shape[0]:
+            res[:self.storage.shape[0] - start] = self.storage[start:]
+        return res
+
+    # writable view of rows [start, start+length), which now count as written
+    def write_view(self, start, length):
+        self._reserve(start + length)
+        self.rows = max(self.rows, start + length)
+        return self.storage[start:start + length]
+
+    def write(self, start, values):
+        self.write_view(start, len(values))[:] = values
+
+    # count every row below `end` as written without changing any values
+    def extend(self, end):
+        self._reserve(end)
+        self.rows = max(self.rows, end)
+
+    # the written rows, as a view of the storage
+    def trimmed(self):
+        return self.storage[:self.rows]
+
+
+# a SimMemory per sample of a batch, stored as one (batch, rows, width) array
+# so an instruction reads or writes every sample at once. reads and
+# write_views have the batch axis first. `rows` holds one high-water mark per
+# sample; writes can be limited to some samples with `mask`, a boolean array
+# or a sample index, and then only raise those samples' marks
+class BatchSimMemory(SimMemory):
+    def __init__(self, width: int, dtype, batch: int, capacity: int = 0,
+                 data: Optional[List[np.ndarray]] = None):
+        if data is None:
+            self.rows = np.zeros(batch, dtype=np.int64)
+        else:
+            self.rows = np.array([d.shape[0] for d in data], dtype=np.int64)
+        self.storage = np.zeros((batch, max(capacity, int(self.rows.max(initial=0))),
+                                 width), dtype=dtype)
+        for i, d in enumerate(data or []):
+            self.storage[i, :d.shape[0]] = d
+
+    def _reserve(self, end):
+        batch, capacity, width = self.storage.shape
+        if end > capacity:
+            storage = np.zeros((batch, max(end, 2*capacity), width), 
+                               dtype=self.storage.dtype)
+            storage[:, :capacity] = self.storage
+            self.storage = storage
+
+    def read(self, start, length):
+        end = start + length
+        batch, capacity, width = self.storage.shape
+        if end <= capacity:
+            return self.storage[:, start:end]
+        res = np.zeros((batch, length, width), dtype=self.storage.dtype)
+        if start < capacity:
+            res[:, :capacity - start] = self.storage[:, start:]
+        return res
+
+    def write_view(self, start, length, mask=None):
+        self._reserve(start + length)
+        if mask is None:
+            np.maximum(self.rows, start + length, out=self.rows)
+        else:
+            self.rows[mask] = np.maximum(self.rows[mask], start + length)
+        return self.storage[:, start:start + length]
+
+    # `values` may leave out the batch axis to write the same rows to every sample
+    def write(self, start, values, mask=None):
+        view = self.write_view(start, values.shape[-2], mask)
+        if mask is None:
+            view[:] = values
+        else:
+            view[mask] = values[mask] if values.ndim == 3 else values
+
+    def extend(self, end):
+        self._reserve(end)
+        np.maximum(self.rows, end, out=self.rows)
+
+    # the written rows of one sample
+    def trimmed(self, sample=0):
+        return self.storage[sample, :self.rows[sample]]
+
+    # a new BatchSimMemory holding a copy of the samples picked by `mask`
+    def select(self, mask):
+        mem = BatchSimMemory.__new__(BatchSimMemory)
+        mem.rows = self.rows[mask]
+        mem.storage = self.storage[mask]
+        return mem
+
+
+# how much TPUSim prints while running. each level includes everything printed
+# by the levels below it.
+#   SILENT:      nothing
+#   SUMMARY:     halt notice and instruction counts
+#   INSTRUCTION: PC and a one-line description of every instruction
+#   FULL:        every operand, weight and result matrix
+class Verbosity(IntEnum):
+    SILENT = 0
+    SUMMARY = 1
+    INSTRUCTION = 2
+    FULL = 3
+
+
+# placeholder compile_op returns for instructions that do nothing but advance the pc
+def _skip():
+    pass
+
+
 class TPUSim(object):
-    def __init__(self, prog: str, hostmem_filename: str, 
+    def __init__(self, prog: Union[str, bytes], hostmem_filename: str, 
                  weightsmem_filename: str, bitwidth: int, matsize: int, 
-                 output_folder: str):
-        self.program = open(prog, 'rb')
+                 output_folder: str, verbosity: Verbosity = Verbosity.SUMMARY,
+                 decode_cache_dir: Optional[str] = None,
+                 jit: bool = True):
+        self.program = prog
+        self.decode_cache_dir = decode_cache_dir
         self.weight_memory = np.load(weightsmem_filename).astype(UNSIGNED_DTYPES[bitwidth])
-        self.host_memory = np.load(hostmem_filename).astype(UNSIGNED_DTYPES[bitwidth])
+        host_memory = np.load(hostmem_filename).astype(UNSIGNED_DTYPES[bitwidth])
+        self.hm = SimMemory(host_memory.shape[1], host_memory.dtype, data=host_memory)
 
-        self.unified_buffer = np.zeros((0, matsize), dtype=UNSIGNED_DTYPES[bitwidth])
-        self.accumulator = np.zeros((0, matsize), dtype=UNSIGNED_DTYPES[bitwidth])
+        # the UB and accumulator are preallocated to their hardware sizes
+        self.ub = SimMemory(matsize, UNSIGNED_DTYPES[bitwidth],
+                            capacity=2**config.UB_ADDR_SIZE)
+        self.acc = SimMemory(matsize, UNSIGNED_DTYPES[bitwidth],
+                             capacity=2**config.ACC_ADDR_SIZE)
         self.weight_fifo = deque()
 
         self.bitwidth = bitwidth
         self.matsize = matsize
         self.output_folder = output_folder
+        self.verbosity = verbosity
+        # compiled blocks don't log, so they're only used when nothing per
+        # instruction would be printed
+        self.jit = jit and verbosity <= Verbosity.SUMMARY
 
         self.pc = 0
         self.pc_history = []
@@ -50,6 +318,17 @@ class TPUSim(object):
         self.prev_rw = None
         self.reload_count = 0
 
+        # the decoded program and handlers for step(), loaded on its first call
+        self.code = None
+        self.handlers = None
+
+    # print msg.format(*args) if the verbosity is at least `level`. formatting
+    # is deferred until the level check passes, so quiet runs never pay for
+    # turning NumPy arrays into strings
+    def log(self, level, msg, *args, **kwargs):
+        if self.verbosity >= level:
+            print(msg.format(*args), **kwargs)
+
     def get_mems(self):
         return self.host_memory, self.weight_memory, self.unified_buffer, \
                self.fifo_to_np(), self.accumulator
@@ -58,120 +337,287 @@ class TPUSim(object):
         return np.array(self.weight_fifo)\
                  .reshape((len(self.weight_fifo), self.matsize, self.matsize))
 
-    # resize the slice to fit shape. slice.shape and shape will always have
-    # the same width, and slice.shape's height will be less than or equal to 
-    # shape's height. if less, the extra rows will be filled with 0s. this lets
-    # memories get read beyond their current address without creating new rows,
-    # while writing non-existant 0-rows to the write memeory
-    def pad_zeros(self, slice, shape):
-        if slice.shape[0] < shape[0]:
-            print(f"padded with {shape[0] - slice.shape[0]} 0-rows")
-        res = np.zeros(shape, dtype=UNSIGNED_DTYPES[self.bitwidth])
-        res[:slice.shape[0]] = slice
-        return res
+    # the memories as NumPy arrays, trimmed to the rows written so far
+    @property
+    def host_memory(self):
+        return self.hm.trimmed()
+
+    @property
+    def unified_buffer(self):
+        return self.ub.trimmed()
+
+    @property
+    def accumulator(self):
+        return self.acc.trimmed()
+
+    # read rows [start, start+length) of a SimMemory. rows that haven't been
+    # written read as 0s without extending the memory. the result may be a view
+    # of the memory, so copy it before modifying it
+    def read_rows(self, mem, start, length):
+        padded = start + length - max(mem.rows, start)
+        if padded > 0:
+            self.log(Verbosity.INSTRUCTION, "padded with {} 0-rows", padded)
+        return mem.read(start, length)
+
+    # the decoded program as lists of Python ints, in the order execute takes them
+    def load_code(self):
+        program = load_program(self.program, self.decode_cache_dir)
+        return (program['op'].tolist(), program['flags'].tolist(), 
+                program['len'].tolist(), program['addr'].tolist(), 
+                program['ubaddr'].tolist())
 
     def run(self):
         # load program and execute instructions
-        instructions = self.decode()
-        opcodes, operands = instructions[0], instructions[1]
-
-        if (len(instructions[0]) != len(instructions[1])):
-            raise ValueError("Mismatched instruction and operand lengths.")
-        
-        # use self.pc to select next instruction, starting from 0, and finishing when halt is reached
-        while True:
-            # print(f'operands = {operands[self.pc]}')
-            print(f"PC = {self.pc}")
-            self.pc_history.append(self.pc)
-            if opcodes[self.pc] in ['RHM', 'WHM', 'RW']:
-                self.memops(opcodes[self.pc], *operands[self.pc])
-            elif opcodes[self.pc] == 'MMC':
-                self.matrix_multiply_convolve(*operands[self.pc])
-                self.mmc_count += 1
-            elif opcodes[self.pc] == 'ACT':
-                self.act(*operands[self.pc])
-                self.act_count += 1
-            elif opcodes[self.pc] == 'SYNC':
-                self.pc += 1
-            elif opcodes[self.pc] == 'NOP':
-                self.pc += 1
-            elif opcodes[self.pc] == 'HLT':
-                print('H A L T')
-                break
-            else:
-                raise Exception('WAT (╯°□°）╯︵ ┻━┻')
-            print()
+        self.execute(*self.load_code())
 
         # all done, exit
-        self.program.close()
+        self.log_counts()
+        self.save()
 
-        print("MMC Count: {}".format(self.mmc_count))
-        print("HM Count: {}".format(self.hm_count))
-        print("ACT Count: {}".format(self.act_count))
-        print("RW Count: {}".format(self.rw_count))
-        print("RW Reloads: {}".format(self.reload_count))
+        self.log(Verbosity.INSTRUCTION, "PC history:\n {}", self.pc_history)
 
+        self.log(Verbosity.SUMMARY, """\nALL DONE!
+        (•_•)
+        ( •_•)>⌐■-■
+        (⌐■_■)""")
+
+    # save the memories to output_folder/sim.npz
+    def save(self):
         os.makedirs(self.output_folder, exist_ok=True)
         np.savez_compressed(f"{self.output_folder}/sim", hm=self.host_memory, 
                             wm=self.weight_memory, ub=self.unified_buffer, 
                             wq=self.fifo_to_np(), acc=self.accumulator)
 
-        print("PC history:\n", self.pc_history)
+    # write everything an instruction can change to a checkpoint at `path`
+    # (see checkpoint.py). restore carries on from it in another TPUSim, for
+    # this program or one that starts the same way
+    def checkpoint(self, path):
+        save_checkpoint(path, "tpusim", bitwidth=self.bitwidth, matsize=self.matsize,
+                        pc=self.pc, pc_history=np.array(self.pc_history, dtype=np.int64),
+                        hm=self.host_memory, ub=self.unified_buffer,
+                        acc=self.accumulator, wq=self.fifo_to_np(),
+                        rw_count=self.rw_count, hm_count=self.hm_count,
+                        mmc_count=self.mmc_count, act_count=self.act_count,
+                        reload_count=self.reload_count,
+                        prev_rw=-1 if self.prev_rw is None else self.prev_rw)
 
-        print("""\nALL DONE!
-        (•_•)
-        ( •_•)>⌐■-■
-        (⌐■_■)""")
+    # pick up from a checkpoint written by checkpoint(). the next run() or
+    # step() starts at its pc
+    def restore(self, path):
+        state = load_checkpoint(path, "tpusim")
+        if (int(state["bitwidth"]), int(state["matsize"])) != (self.bitwidth, self.matsize):
+            raise ValueError(f"{path} was saved with bitwidth {state['bitwidth']} and matsize "
+                             f"{state['matsize']}, not {self.bitwidth} and {self.matsize}.")
+        dtype = UNSIGNED_DTYPES[self.bitwidth]
+        self.hm = SimMemory(state["hm"].shape[1], dtype, data=state["hm"])
+        self.ub = SimMemory(self.matsize, dtype, capacity=2**config.UB_ADDR_SIZE,
+                            data=state["ub"])
+        self.acc = SimMemory(self.matsize, dtype, capacity=2**config.ACC_ADDR_SIZE,
+                             data=state["acc"])
+        self.weight_fifo = deque(state["wq"].astype(self.weight_memory.dtype))
+
+        self.pc = int(state["pc"])
+        self.pc_history = state["pc_history"].tolist()
+        self.rw_count = int(state["rw_count"])
+        self.hm_count = int(state["hm_count"])
+        self.mmc_count = int(state["mmc_count"])
+        self.act_count = int(state["act_count"])
+        self.reload_count = int(state["reload_count"])
+        self.prev_rw = None if int(state["prev_rw"]) < 0 else int(state["prev_rw"])
 
-    # decode everything at once and return lists
-    def decode(self):
-        opcode_list = []
-        operand_list = []
-        current_opcode = ""
+    # step() through up to `count` instructions, stopping short of HLT.
+    # returns False if it got to HLT first
+    def advance(self, count):
+        if self.code is None:
+            self.code = self.load_code()
+            self.handlers = self.dispatch_table()
+        for _ in range(count):
+            if self.code[0][self.pc] == HLT_OP:
+                return False
+            self.step()
+        return True
 
+    def log_counts(self):
+        self.log(Verbosity.SUMMARY, "MMC Count: {}", self.mmc_count)
+        self.log(Verbosity.SUMMARY, "HM Count: {}", self.hm_count)
+        self.log(Verbosity.SUMMARY, "ACT Count: {}", self.act_count)
+        self.log(Verbosity.SUMMARY, "RW Count: {}", self.rw_count)
+        self.log(Verbosity.SUMMARY, "RW Reloads: {}", self.reload_count)
+
+    # execute instructions from self.pc until HLT
+    def execute(self, ops, flags, lengths, addrs, ubaddrs):
+        handlers = self.dispatch_table()
+        blocks = {}
+        
+        # use self.pc to select next instruction, starting from 0, and finishing when halt is reached
         while True:
-            bytes = self.program.read(isa.OP_SIZE)
-            if not bytes:
+            # run the compiled block starting at this pc, if there is one. it
+            # stops short of the next ACT, HLT or instruction it can't compile,
+            # which the interpreter below then executes
+            if self.jit:
+                if self.pc not in blocks:
+                    blocks[self.pc] = self.compile_block(self.pc, ops, flags, 
+                                                         lengths, addrs, ubaddrs)
+                block = blocks[self.pc]
+                if block is not None:
+                    block()
+
+            if not self.interpret(handlers, ops, flags, lengths, addrs, ubaddrs):
                 break
-            current_opcode = int.from_bytes(bytes, byteorder='big')
-            current_opcode = isa.BIN2OPCODE[current_opcode]
-            opcode_list.append(current_opcode)
-            current_flag = int.from_bytes(self.program.read(isa.FLAGS_SIZE), byteorder='big')
-            current_length = int.from_bytes(self.program.read(isa.LEN_SIZE), byteorder='big')
-            current_src_addr = int.from_bytes(self.program.read(isa.ADDR_SIZE), byteorder='big')
-            current_dest_addr = int.from_bytes(self.program.read(isa.UB_ADDR_SIZE), byteorder='big')
-            operand_list.append((current_src_addr, current_dest_addr, current_length, current_flag))
 
-        return opcode_list, operand_list
+    # interpret the instruction at self.pc. returns False, after logging the
+    # halt, if it's HLT
+    def interpret(self, handlers, ops, flags, lengths, addrs, ubaddrs):
+        pc = self.pc
+        self.log(Verbosity.INSTRUCTION, "PC = {}", pc)
+        self.pc_history.append(pc)
+        op = ops[pc]
+        if op == HLT_OP:
+            self.log(Verbosity.SUMMARY, 'H A L T')
+            return False
+        handlers[op](addrs[pc], ubaddrs[pc], lengths[pc], flags[pc])
+        self.log(Verbosity.INSTRUCTION, '')
+        return True
+
+    # execute the one instruction at self.pc, without compiling blocks, for
+    # callers that need to look at the state between instructions (see
+    # cosim.py). returns False if it's HLT
+    def step(self):
+        if self.code is None:
+            self.code = self.load_code()
+            self.handlers = self.dispatch_table()
+        return self.interpret(self.handlers, *self.code)
+
+    # map every integer opcode to the method that executes it. each handler
+    # takes the decoded (addr, ubaddr, length, flags) fields and advances the pc
+    def dispatch_table(self):
+        return {
+            isa.OPCODE2BIN['NOP'][0]:  self.nop,
+            isa.OPCODE2BIN['WHM'][0]:  self.write_host_memory,
+            isa.OPCODE2BIN['RW'][0]:   self.read_weights,
+            isa.OPCODE2BIN['MMC'][0]:  self.matrix_multiply_convolve,
+            isa.OPCODE2BIN['ACT'][0]:  self.act,
+            isa.OPCODE2BIN['SYNC'][0]: self.nop,
+            isa.OPCODE2BIN['RHM'][0]:  self.read_host_memory,
+        }
+
+    # compile the straight-line run of instructions starting at `start` into a
+    # single callable with the same effect as interpreting them: memories,
+    # weight FIFO, counters, pc and pc_history. the run ends before the first
+    # ACT (which may branch), HLT, or instruction compile_op can't handle.
+    # returns None if that's the very first instruction
+    def compile_block(self, start, ops, flags, lengths, addrs, ubaddrs):
+        fns = []
+        pc = start
+        while pc < len(ops):
+            fn = self.compile_op(pc, ops[pc], addrs[pc], ubaddrs[pc], lengths[pc], 
+                                 flags[pc])
+            if fn is None:
+                break
+            fns.append(fn)
+            pc += 1
+        if not fns:
+            return None
+
+        end = pc
+        pcs = range(start, end)
+        block_ops = ops[start:end]
+        hm_count = block_ops.count(isa.OPCODE2BIN['RHM'][0]) \
+                 + block_ops.count(isa.OPCODE2BIN['WHM'][0])
+        rw_count = block_ops.count(isa.OPCODE2BIN['RW'][0])
+        mmc_count = block_ops.count(isa.OPCODE2BIN['MMC'][0])
+        fns = [fn for fn in fns if fn is not _skip]
+
+        def block():
+            for fn in fns:
+                fn()
+            self.pc = end
+            self.pc_history.extend(pcs)
+            self.hm_count += hm_count
+            self.rw_count += rw_count
+            self.mmc_count += mmc_count
+        return block
+
+    # compile one instruction into a callable taking no arguments. NOPs compile
+    # to _skip. returns None for the instructions the interpreter has to run:
+    # ACT and HLT, and RHM.S/WHM.S, whose addresses come from the UB at run time
+    def compile_op(self, pc, op, addr, ubaddr, length, flag):
+        ub, hm, acc = self.ub, self.hm, self.acc
+        if op in (isa.OPCODE2BIN['NOP'][0], isa.OPCODE2BIN['SYNC'][0]):
+            return _skip
+
+        elif op == isa.OPCODE2BIN['RHM'][0]:
+            if flag & isa.SWITCH_MASK:
+                return None
+            if flag & isa.CONV_MASK:
+                # the pc return vector only depends on the pc, so build it now
+                read_data = np.zeros((1, self.matsize), dtype=ub.storage.dtype)
+                read_data[0][1] = pc + 2
+                read_data[0][-1] = 4
+                return lambda: ub.write(ubaddr, read_data)
+            return lambda: ub.write(ubaddr, hm.read(addr, length))
+
+        elif op == isa.OPCODE2BIN['WHM'][0]:
+            if flag & isa.SWITCH_MASK:
+                return None
+            return lambda: hm.write(ubaddr, ub.read(addr, length))
+
+        elif op == isa.OPCODE2BIN['RW'][0]:
+            def rw():
+                self.weight_fifo.append(self.weight_memory[addr])
+                if addr != self.prev_rw:
+                    self.reload_count += 1
+                    self.prev_rw = addr
+            return rw
+
+        elif op == isa.OPCODE2BIN['MMC'][0]:
+            signed = SIGNED_DTYPES[self.bitwidth]
+            unsigned = UNSIGNED_DTYPES[self.bitwidth]
+            pop = flag & isa.SWITCH_MASK
+            overwrite = flag & isa.OVERWRITE_MASK
+            def mmc():
+                weight_mat = self.weight_fifo[0]
+                if pop:
+                    self.weight_fifo.popleft()
+                out = np.matmul(ub.read(addr, length).astype(signed), 
+                                weight_mat.astype(signed)).astype(unsigned)
+                if overwrite:
+                    acc.write(ubaddr, out)
+                else:
+                    acc.write_view(ubaddr, length)[:] += out
+            return mmc
+
+        return None
 
     # opcodes
     def act(self, src, dest, length, flag):
-        print(f'ACT: read ACC[{src}:{src + length}], and write to UB[{dest}:{dest + length}]. Activation function:', end = ' ')
-
-        # extend the accumulator if needed
-        result = self.pad_zeros(self.accumulator[src:src+length], (length, self.matsize))
-        if flag & isa.FUNC_RELU_MASK:
-            print('RELU!!!!')
-            vfunc = np.vectorize(lambda x: 0 * x if x < 0. else x)
-        elif flag & isa.FUNC_SIGMOID_MASK:
-            print('SIGMOID')
-            vfunc = np.vectorize(lambda x: int(255./(1.+exp(-x))))
+        self.act_count += 1
+        self.log(Verbosity.INSTRUCTION, 'ACT: read ACC[{}:{}], and write to UB[{}:{}]. Activation function:',
+                 src, src + length, dest, dest + length, end = ' ')
+
+        # copy, since the branch/comparison logic below edits the result
+        result = self.read_rows(self.acc, src, length).copy()
+        func = (flag & isa.ACT_FUNC_MASK) >> isa.FUNC_RELU_BIT
+        if func == ACT_RELU:
+            self.log(Verbosity.INSTRUCTION, 'RELU!!!!')
+        elif func == ACT_SIGMOID:
+            self.log(Verbosity.INSTRUCTION, 'SIGMOID')
         else:
-            # print('None')
-            vfunc = np.vectorize(lambda x: x)
-            #raise Exception('(╯°□°）╯︵ ┻━┻ bad activation function!')
+            self.log(Verbosity.INSTRUCTION, 'None')
+
+        # like the hardware, branches and comparisons look at the raw
+        # accumulator values. the activation function is applied afterwards to
+        # whatever gets written back to the UB
 
-        print(f'Before activation:\n{result}')
-        result = vfunc(result)
-        print(f'After activation:\n{result}')
-        
         # branching/comparison logic
         if result[0][-1] == 1:
             if result[0][-2] == 1:
-                print(f"Branch from {self.pc} to {self.pc + 1 + result[0][0]}. No write to UB.")
+                self.log(Verbosity.INSTRUCTION, "Branch from {} to {}. No write to UB.", self.pc,
+                         self.pc + 1 + result[0][0])
                 self.pc = int(self.pc + 1 + result[0][0]) % 2**config.IMEM_ADDR_SIZE
             else:
-                print(f"Branch from {self.pc} to {self.pc + 1 + result[0][1]}. No write to UB.")
+                self.log(Verbosity.INSTRUCTION, "Branch from {} to {}. No write to UB.", self.pc,
+                         self.pc + 1 + result[0][1])
                 self.pc = int(self.pc + 1 + result[0][1]) % 2**config.IMEM_ADDR_SIZE
             return # don't to the UB write when there's a branch
         
@@ -179,10 +625,10 @@ class TPUSim(object):
         elif result[0][-1] == 2:
             result[0][-1] = 0
             if result[0][0] == 0:
-                print(f"Equality check, evaluates to True.")
+                self.log(Verbosity.INSTRUCTION, "Equality check, evaluates to True.")
                 result[0][0] = 1
             else:
-                print(f"Equality check, evaluates to False.")
+                self.log(Verbosity.INSTRUCTION, "Equality check, evaluates to False.")
                 result[0][0] = 0
             result[0][1] = 0
             self.pc += 1
@@ -191,169 +637,380 @@ class TPUSim(object):
         elif result[0][-1] == 3:
             result[0][-1] = 0
             if result[0][0] < 0:
-                print(f"Less than check, evaluates to True ({result[0][0]} < 0).")
+                self.log(Verbosity.INSTRUCTION, "Less than check, evaluates to True ({} < 0).",
+                         result[0][0])
                 result[0][0] = 1
             else:
-                print(f"Less than check, evaluates to False ({result[0][0]} !< 0).")
+                self.log(Verbosity.INSTRUCTION, "Less than check, evaluates to False ({} !< 0).",
+                         result[0][0])
                 result[0][0] = 0
             self.pc += 1
         
         # unconditional jump
         elif result[0][-1] == 4:
-            print(f"Unconditional jump from {self.pc} to {result[0][1]}. No write to UB.")
+            self.log(Verbosity.INSTRUCTION, "Unconditional jump from {} to {}. No write to UB.",
+                     self.pc, result[0][1])
             self.pc = int(result[0][1])
             return
 
         # normal activation
         else:
-            print(f"Normal activation.")
+            self.log(Verbosity.INSTRUCTION, "Normal activation.")
             self.pc += 1      
 
-        print("After branch/comparison/jump:")
-        print(result)
+        self.log(Verbosity.FULL, "After branch/comparison/jump:\n{}", result)
+        result = activate(result, func, self.bitwidth)
+        self.log(Verbosity.FULL, 'After activation:\n{}', result)
 
-        # extend the unified buffer if needed
-        if (self.unified_buffer.shape[0] < dest + length):
-            self.unified_buffer.resize((dest + length, self.matsize))
-        self.unified_buffer[dest:dest+length] = result
+        self.ub.write(dest, result)
 
-    def memops(self, opcode, src_addr, dest_addr, length, flag):
-        if opcode == 'RHM':
-            self.hm_count += 1
-            read_data = np.zeros((1, self.matsize))
+    def read_host_memory(self, src_addr, dest_addr, length, flag):
+        self.hm_count += 1
+        read_data = np.zeros((1, self.matsize))
 
-            if flag & isa.SWITCH_MASK:
-                # extending UB to 2^UB_SIZE-1 could cause mismatch between sim 
-                # and runtpu but hard to fix. fortunately it's hard to see a
-                # scenario where this would get read from but never written to
-                if (self.unified_buffer.shape[0] < 2**config.UB_ADDR_SIZE): 
-                    self.unified_buffer.resize((2**config.UB_ADDR_SIZE, self.matsize))
-                addr = self.unified_buffer[2**config.UB_ADDR_SIZE-1][0]
-                vec_addr = addr // self.matsize
-                column = addr % self.matsize
-                
-                if length == 0:
-                    print(f"RHM vec cell: read host memory [{vec_addr}][{column}] and pad with 0s, write to unified buffer [{dest_addr}]. Buffer addr is {addr} -> [{vec_addr}][{column}]. Flags? {flag}")
-                    read_data[0][0] = self.pad_zeros(self.host_memory[vec_addr:vec_addr+1], (1, self.matsize))[0][column]
-                    if (self.unified_buffer.shape[0] < dest_addr + 1):
-                        self.unified_buffer.resize((dest_addr + 1, self.matsize))
-                    print(read_data)
-                    self.unified_buffer[dest_addr] = read_data
-                
-                else:
-                    print(f"RHM vec matrix: read host memory [{vec_addr}:{vec_addr + length}], write to unified buffer [{dest_addr}:{dest_addr + length}]. Buffer addr is {addr} -> [{vec_addr}][{column}]. Flags? {flag}")
-                    if (self.unified_buffer.shape[0] < dest_addr + length):
-                        self.unified_buffer.resize((dest_addr + length, self.matsize))
-                    print(self.host_memory[vec_addr:vec_addr + length])
-                    res = self.pad_zeros(self.host_memory[vec_addr:vec_addr+length], (length, self.matsize))
-                    print(res)
-                    self.unified_buffer[dest_addr:dest_addr + length] = res
-
-            elif flag & isa.CONV_MASK:
-                print(f"RHM pc return: create curent pc vector, write to unified buffer [{dest_addr}]. Flags? {flag}")
-                read_data[0][1] = self.pc + 2
-                read_data[0][-1] = 4
-                print(read_data)
-                if (self.unified_buffer.shape[0] < dest_addr + 1):
-                    self.unified_buffer.resize((dest_addr + 1, self.matsize))
-                self.unified_buffer[dest_addr] = read_data
+        if flag & isa.SWITCH_MASK:
+            # extending UB to 2^UB_SIZE-1 could cause mismatch between sim 
+            # and runtpu but hard to fix. fortunately it's hard to see a
+            # scenario where this would get read from but never written to
+            self.ub.extend(2**config.UB_ADDR_SIZE)
+            addr = int(self.ub.storage[2**config.UB_ADDR_SIZE-1][0])
+            vec_addr = addr // self.matsize
+            column = addr % self.matsize
+            
+            if length == 0:
+                self.log(Verbosity.INSTRUCTION, "RHM vec cell: read host memory [{}][{}] and pad with 0s, write to unified buffer [{}]. Buffer addr is {} -> [{}][{}]. Flags? {}",
+                         vec_addr, column, dest_addr, addr, vec_addr, column, flag)
+                read_data[0][0] = self.read_rows(self.hm, vec_addr, 1)[0][column]
+                self.log(Verbosity.FULL, "{}", read_data)
+                self.ub.write(dest_addr, read_data)
             
             else:
-                print(f"RHM standard matrix: read host memory [{src_addr}:{src_addr + length}], write to unified buffer [{dest_addr}:{dest_addr + length}]. Flags? {flag}")
-                if (self.unified_buffer.shape[0] < dest_addr + length):
-                    self.unified_buffer.resize((dest_addr + length, self.matsize))
-                res = self.pad_zeros(self.host_memory[src_addr:src_addr+length], (length, self.matsize))
-                print(res)
-                self.unified_buffer[dest_addr:dest_addr + length] = res
-
-        elif opcode == 'WHM':
-            self.hm_count += 1
+                self.log(Verbosity.INSTRUCTION, "RHM vec matrix: read host memory [{}:{}], write to unified buffer [{}:{}]. Buffer addr is {} -> [{}][{}]. Flags? {}",
+                         vec_addr, vec_addr + length, dest_addr, dest_addr + length, addr, vec_addr, column, flag)
+                self.log(Verbosity.FULL, "{}", self.host_memory[vec_addr:vec_addr + length])
+                res = self.read_rows(self.hm, vec_addr, length)
+                self.log(Verbosity.FULL, "{}", res)
+                self.ub.write(dest_addr, res)
+
+        elif flag & isa.CONV_MASK:
+            self.log(Verbosity.INSTRUCTION, "RHM pc return: create curent pc vector, write to unified buffer [{}]. Flags? {}",
+                     dest_addr, flag)
+            read_data[0][1] = self.pc + 2
+            read_data[0][-1] = 4
+            self.log(Verbosity.FULL, "{}", read_data)
+            self.ub.write(dest_addr, read_data)
+        
+        else:
+            self.log(Verbosity.INSTRUCTION, "RHM standard matrix: read host memory [{}:{}], write to unified buffer [{}:{}]. Flags? {}",
+                     src_addr, src_addr + length, dest_addr, dest_addr + length, flag)
+            res = self.read_rows(self.hm, src_addr, length)
+            self.log(Verbosity.FULL, "{}", res)
+            self.ub.write(dest_addr, res)
+
+        self.pc += 1
+
+    def write_host_memory(self, src_addr, dest_addr, length, flag):
+        self.hm_count += 1
+        
+        if flag & isa.SWITCH_MASK:
+            self.ub.extend(2**config.UB_ADDR_SIZE)
+            addr = int(self.ub.storage[2**config.UB_ADDR_SIZE-1][0])
+            vec_addr = addr // self.matsize
+            column = addr % self.matsize
             
-            if flag & isa.SWITCH_MASK:
-                if (self.unified_buffer.shape[0] < 2**config.UB_ADDR_SIZE):
-                    self.unified_buffer.resize((2**config.UB_ADDR_SIZE, self.matsize))
-                addr = self.unified_buffer[2**config.UB_ADDR_SIZE-1][0]
-                vec_addr = addr // self.matsize
-                column = addr % self.matsize
-                
-                if length == 0:
-                    print(f"WHM vec cell: read unified buffer [{src_addr}][0], write to host memory [{vec_addr}][{column}]. Buffer addr is {addr} -> [{vec_addr}][{column}]. Flags? {flag}")
-                    if (self.host_memory.shape[0] < vec_addr + 1):
-                        self.host_memory.resize((vec_addr + 1, self.matsize))
-                    res = self.pad_zeros(self.unified_buffer[src_addr:src_addr+1], (1, self.matsize))
-                    print(f"UB[{src_addr}]: {res}")
-                    print(f"HM[{vec_addr}] before: {self.host_memory[vec_addr]}")
-                    self.host_memory[vec_addr][column] = res[0][0]
-                    print(f"HM[{vec_addr}]  after: {self.host_memory[vec_addr]}")
-                
-                else:
-                    print(f"WHM vec matrix: read unified buffer [{src_addr}:{src_addr + length}], write to host memory [{vec_addr}:{vec_addr + length}]. Buffer addr is {addr} -> [{vec_addr}][{column}]. Flags? {flag}")
-                    if (self.host_memory.shape[0] < vec_addr + length):
-                        self.host_memory.resize((vec_addr + length, self.matsize))
-                    res = self.pad_zeros(self.unified_buffer[src_addr:src_addr+length], (length, self.matsize))
-                    print(res)
-                    self.host_memory[vec_addr:vec_addr + length] = res
+            if length == 0:
+                self.log(Verbosity.INSTRUCTION, "WHM vec cell: read unified buffer [{}][0], write to host memory [{}][{}]. Buffer addr is {} -> [{}][{}]. Flags? {}",
+                         src_addr, vec_addr, column, addr, vec_addr, column, flag)
+                row = self.hm.write_view(vec_addr, 1)[0]
+                res = self.read_rows(self.ub, src_addr, 1)
+                self.log(Verbosity.FULL, "UB[{}]: {}", src_addr, res)
+                self.log(Verbosity.FULL, "HM[{}] before: {}", vec_addr, row)
+                row[column] = res[0][0]
+                self.log(Verbosity.FULL, "HM[{}]  after: {}", vec_addr, row)
             
             else:
-                print(f"WHM standard matrix: read unified buffer [{src_addr}:{src_addr + length}], write to host memory [{dest_addr}:{dest_addr + length}]. Flags? {flag}")
-                if (self.host_memory.shape[0] < dest_addr + length):
-                    self.host_memory.resize((dest_addr + length, self.matsize))
-                res = self.pad_zeros(self.unified_buffer[src_addr:src_addr+length], (length, self.matsize))
-                print(res)
-                self.host_memory[dest_addr:dest_addr + length] = res
+                self.log(Verbosity.INSTRUCTION, "WHM vec matrix: read unified buffer [{}:{}], write to host memory [{}:{}]. Buffer addr is {} -> [{}][{}]. Flags? {}",
+                         src_addr, src_addr + length, vec_addr, vec_addr + length, addr, vec_addr, column, flag)
+                res = self.read_rows(self.ub, src_addr, length)
+                self.log(Verbosity.FULL, "{}", res)
+                self.hm.write(vec_addr, res)
         
-        elif opcode == 'RW':
-            print(f'RW {src_addr}: read weight matrix {src_addr} into weight FIFO')
-            print(self.weight_memory[src_addr])
-            if src_addr != self.prev_rw:
-                self.reload_count += 1
-                self.prev_rw = src_addr
+        else:
+            self.log(Verbosity.INSTRUCTION, "WHM standard matrix: read unified buffer [{}:{}], write to host memory [{}:{}]. Flags? {}",
+                     src_addr, src_addr + length, dest_addr, dest_addr + length, flag)
+            res = self.read_rows(self.ub, src_addr, length)
+            self.log(Verbosity.FULL, "{}", res)
+            self.hm.write(dest_addr, res)
 
-            self.rw_count += 1
-            self.weight_fifo.append(self.weight_memory[src_addr])
+        self.pc += 1
+
+    def read_weights(self, src_addr, dest_addr, length, flag):
+        self.log(Verbosity.INSTRUCTION, 'RW {}: read weight matrix {} into weight FIFO', src_addr, src_addr)
+        self.log(Verbosity.FULL, '{}', self.weight_memory[src_addr])
+        if src_addr != self.prev_rw:
+            self.reload_count += 1
+            self.prev_rw = src_addr
+
+        self.rw_count += 1
+        self.weight_fifo.append(self.weight_memory[src_addr])
 
-        else:
-            raise Exception('WAT (╯°□°）╯︵ ┻━┻')
-        
+        self.pc += 1
+
+    def nop(self, src_addr, dest_addr, length, flag):
         self.pc += 1
 
     def matrix_multiply_convolve(self, ub_addr, accum_addr, size, flags):
-        print(f'MMC: multiply UB[{ub_addr}:{ub_addr + size}] with a weight, store in ACC[{accum_addr}:{accum_addr + size}]')
+        self.mmc_count += 1
+        self.log(Verbosity.INSTRUCTION, 'MMC: multiply UB[{}:{}] with a weight, store in ACC[{}:{}]',
+                 ub_addr, ub_addr + size, accum_addr, accum_addr + size)
 
-        inp = self.pad_zeros(self.unified_buffer[ub_addr:ub_addr + size], (size, self.matsize))
+        inp = self.read_rows(self.ub, ub_addr, size)
         weight_mat = self.weight_fifo[0]
         
         if isa.SWITCH_MASK & flags:
             self.weight_fifo.popleft()
 
-        print('MMC matrix: \n{}'.format(inp))
-        print('MMC weight: \n{}'.format(weight_mat))
+        self.log(Verbosity.FULL, 'MMC matrix: \n{}', inp)
+        self.log(Verbosity.FULL, 'MMC weight: \n{}', weight_mat)
 
         out = np.matmul(inp.astype(SIGNED_DTYPES[self.bitwidth]), 
                         weight_mat.astype(SIGNED_DTYPES[self.bitwidth]))\
                         .astype(UNSIGNED_DTYPES[self.bitwidth])
 
-        print('MMC output: \n{}'.format(out))
-
-        # extend the accumulator if needed
-        if (self.accumulator.shape[0] < accum_addr + size):
-            self.accumulator.resize((accum_addr + size, self.matsize))
+        self.log(Verbosity.FULL, 'MMC output: \n{}', out)
 
+        acc = self.acc.write_view(accum_addr, size)
         overwrite = isa.OVERWRITE_MASK & flags
         if overwrite:
-            print(f'Overwriting ACC[{accum_addr}:{accum_addr + size}]')
-            self.accumulator[accum_addr:accum_addr + size] = out
+            self.log(Verbosity.INSTRUCTION, 'Overwriting ACC[{}:{}]', accum_addr, accum_addr + size)
+            acc[:] = out
         else:
-            print(f'Accumulating with ACC[{accum_addr}:{accum_addr + size}]')
-            print(f'{self.accumulator[accum_addr: accum_addr + size]}')
-            self.accumulator[accum_addr:accum_addr + size] += out
+            self.log(Verbosity.INSTRUCTION, 'Accumulating with ACC[{}:{}]', accum_addr, accum_addr + size)
+            self.log(Verbosity.FULL, '{}', acc)
+            acc += out
         
-        print(f'After MMC + ACC: \n{self.accumulator[accum_addr:accum_addr + size]}')
+        self.log(Verbosity.FULL, 'After MMC + ACC: \n{}', acc)
+
+        self.pc += 1
+
+# raised by BatchTPUSim.act when the samples of a batch branch to different
+# pcs. `groups` holds one BatchTPUSim per target pc
+class _Diverged(Exception):
+    def __init__(self, groups):
+        super().__init__(groups)
+        self.groups = groups
+
 
+# runs one program with one weights file over many host memory files at once.
+# the host memory, UB and accumulator get a leading batch axis, so each RHM,
+# WHM and ACT moves every sample's rows in one NumPy operation and each MMC is
+# a single batched np.matmul. the samples share one pc and weight FIFO for as
+# long as every ACT branches the same way for all of them; when they don't, the
+# batch is split into a group per branch target and each group carries on
+# separately. results are saved per sample to {output_folder}/{input name}/sim.npz
+class BatchTPUSim(TPUSim):
+    def __init__(self, prog: Union[str, bytes], hostmem_filenames: List[str], 
+                 weightsmem_filename: str, bitwidth: int, matsize: int, 
+                 output_folder: str, verbosity: Verbosity = Verbosity.SUMMARY,
+                 decode_cache_dir: Optional[str] = None,
+                 jit: bool = True):
+        if not hostmem_filenames:
+            raise ValueError("BatchTPUSim needs at least one host memory file")
+        self.names = [os.path.splitext(os.path.basename(f))[0] 
+                      for f in hostmem_filenames]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError("host memory files in a batch need distinct names")
+
+        super().__init__(prog, hostmem_filenames[0], weightsmem_filename, 
+                         bitwidth, matsize, output_folder, verbosity, 
+                         decode_cache_dir, jit)
+        host_memories = [np.load(f).astype(UNSIGNED_DTYPES[bitwidth]) 
+                         for f in hostmem_filenames]
+        batch = len(host_memories)
+        self.hm = BatchSimMemory(host_memories[0].shape[1], 
+                                 UNSIGNED_DTYPES[bitwidth], batch, 
+                                 data=host_memories)
+        self.ub = BatchSimMemory(matsize, UNSIGNED_DTYPES[bitwidth], batch,
+                                 capacity=2**config.UB_ADDR_SIZE)
+        self.acc = BatchSimMemory(matsize, UNSIGNED_DTYPES[bitwidth], batch,
+                                  capacity=2**config.ACC_ADDR_SIZE)
+
+        # the indices of the samples this group is running, and after run, the
+        # group that finished each sample and the sample's index within it
+        self.samples = np.arange(batch)
+        self.groups = [self]
+        self.sample_groups = [(self, i) for i in range(batch)]
+
+    @property
+    def host_memory(self):
+        return self.hm.trimmed(0)
+
+    @property
+    def unified_buffer(self):
+        return self.ub.trimmed(0)
+
+    @property
+    def accumulator(self):
+        return self.acc.trimmed(0)
+
+    # a batch can split into groups at different PCs, which a checkpoint
+    # has no way to hold
+    def checkpoint(self, path):
+        raise NotImplementedError("BatchTPUSim can't write checkpoints.")
+
+    def restore(self, path):
+        raise NotImplementedError("BatchTPUSim can't restore checkpoints.")
+
+    # the same memories as TPUSim.get_mems, for one sample of the batch
+    def get_mems(self, sample=0):
+        group, i = self.sample_groups[sample]
+        return group.hm.trimmed(i), group.weight_memory, group.ub.trimmed(i), \
+               group.fifo_to_np(), group.acc.trimmed(i)
+
+    # the pcs executed for one sample of the batch
+    def sample_pc_history(self, sample=0):
+        return self.sample_groups[sample][0].pc_history
+
+    def read_rows(self, mem, start, length):
+        padded = start + length - max(int(mem.rows.min()), start)
+        if padded > 0:
+            self.log(Verbosity.INSTRUCTION, "padded with up to {} 0-rows", padded)
+        return mem.read(start, length)
+
+    # a copy of this group running only the samples picked by `mask`, from `pc`
+    def split(self, mask, pc):
+        group = copy.copy(self)
+        group.hm = self.hm.select(mask)
+        group.ub = self.ub.select(mask)
+        group.acc = self.acc.select(mask)
+        group.weight_fifo = deque(self.weight_fifo)
+        group.pc_history = list(self.pc_history)
+        group.samples = self.samples[mask]
+        group.pc = pc
+        return group
+
+    # run every group to HLT, starting with the whole batch. a group that
+    # diverges is replaced by its subgroups
+    def execute(self, *code):
+        pending = [self]
+        self.groups = []
+        while pending:
+            group = pending.pop()
+            try:
+                TPUSim.execute(group, *code)
+                self.groups.append(group)
+            except _Diverged as e:
+                self.log(Verbosity.SUMMARY, "Samples diverged at pc {}: {}", 
+                         group.pc_history[-1], 
+                         [g.samples.tolist() for g in e.groups])
+                pending.extend(e.groups)
+
+        self.sample_groups = [None] * len(self.names)
+        for group in self.groups:
+            for i, sample in enumerate(group.samples):
+                self.sample_groups[sample] = (group, i)
+
+    def run(self):
+        self.execute(*self.load_code())
+
+        for group in self.groups:
+            if len(self.groups) > 1:
+                self.log(Verbosity.SUMMARY, "Samples {}:", group.samples.tolist())
+            group.log_counts()
+
+        for sample, name in enumerate(self.names):
+            hm, wm, ub, wq, acc = self.get_mems(sample)
+            os.makedirs(f"{self.output_folder}/{name}", exist_ok=True)
+            np.savez_compressed(f"{self.output_folder}/{name}/sim", hm=hm, 
+                                wm=wm, ub=ub, wq=wq, acc=acc)
+
+        self.log(Verbosity.SUMMARY, "\nALL DONE! Ran {} samples in {} group(s).", 
+                 len(self.names), len(self.groups))
+
+    # TPUSim.act for every sample at once. the branch and comparison logic is
+    # the same, done with masks over the batch axis
+    def act(self, src, dest, length, flag):
+        self.act_count += 1
+        self.log(Verbosity.INSTRUCTION, 'ACT: read ACC[{}:{}], and write to UB[{}:{}] for {} samples',
+                 src, src + length, dest, dest + length, len(self.samples))
+
+        result = self.read_rows(self.acc, src, length).copy()
+        func = (flag & isa.ACT_FUNC_MASK) >> isa.FUNC_RELU_BIT
+
+        first = result[:, 0]
+        code = first[:, -1].copy()
+        value0 = first[:, 0].astype(np.int64)
+        value1 = first[:, 1].astype(np.int64)
+        branch = code == 1
+        jump = code == 4
+        equal = code == 2
+        less = code == 3
+
+        next_pc = np.full(len(code), self.pc + 1, dtype=np.int64)
+        offset = np.where(first[:, -2] == 1, value0, value1)
+        next_pc[branch] = (self.pc + 1 + offset[branch]) % 2**config.IMEM_ADDR_SIZE
+        next_pc[jump] = value1[jump]
+
+        first[equal | less, -1] = 0
+        first[equal, 0] = first[equal, 0] == 0
+        first[equal, 1] = 0
+        first[less, 0] = first[less, 0] < 0
+
+        # branches and jumps don't write to the UB
+        write = ~(branch | jump)
+        if write.any():
+            result = activate(result, func, self.bitwidth)
+            self.ub.write(dest, result, None if write.all() else write)
+
+        targets = np.unique(next_pc)
+        if len(targets) > 1:
+            raise _Diverged([self.split(next_pc == t, int(t)) for t in targets])
+        self.pc = int(targets[0])
+
+    # RHM.S and WHM.S read their host memory address from each sample's UB, so
+    # they're done one sample at a time. everything else is batched by TPUSim
+    def read_host_memory(self, src_addr, dest_addr, length, flag):
+        if not flag & isa.SWITCH_MASK:
+            return super().read_host_memory(src_addr, dest_addr, length, flag)
+
+        self.hm_count += 1
+        self.log(Verbosity.INSTRUCTION, "RHM vec: per sample, write to unified buffer [{}]. Flags? {}",
+                 dest_addr, flag)
+        self.ub.extend(2**config.UB_ADDR_SIZE)
+        for i, addr in enumerate(self.ub.storage[:, 2**config.UB_ADDR_SIZE-1, 0].tolist()):
+            vec_addr = addr // self.matsize
+            column = addr % self.matsize
+            if length == 0:
+                read_data = np.zeros((1, self.matsize))
+                read_data[0][0] = self.hm.read(vec_addr, 1)[i][0][column]
+                self.ub.write_view(dest_addr, 1, i)[i] = read_data
+            else:
+                self.ub.write_view(dest_addr, length, i)[i] = \
+                    self.hm.read(vec_addr, length)[i]
+        self.pc += 1
+
+    def write_host_memory(self, src_addr, dest_addr, length, flag):
+        if not flag & isa.SWITCH_MASK:
+            return super().write_host_memory(src_addr, dest_addr, length, flag)
+
+        self.hm_count += 1
+        self.log(Verbosity.INSTRUCTION, "WHM vec: per sample, read unified buffer [{}]. Flags? {}",
+                 src_addr, flag)
+        self.ub.extend(2**config.UB_ADDR_SIZE)
+        for i, addr in enumerate(self.ub.storage[:, 2**config.UB_ADDR_SIZE-1, 0].tolist()):
+            vec_addr = addr // self.matsize
+            column = addr % self.matsize
+            if length == 0:
+                value = self.ub.read(src_addr, 1)[i][0][0]
+                self.hm.write_view(vec_addr, 1, i)[i][0][column] = value
+            else:
+                self.hm.write_view(vec_addr, length, i)[i] = \
+                    self.ub.read(src_addr, length)[i]
         self.pc += 1
 
+
 def parse_args():
-    global args
+    global args, decode_cache_dir
 
     parser = argparse.ArgumentParser()
     parser.add_argument('prog', action='store', help='Path to assembly program file.')
@@ -362,7 +1019,23 @@ def parse_args():
     parser.add_argument('-b', "--bitwidth", type=int, default=32, help="The bitwidth of the data.")
     parser.add_argument('-m', "--matsize", type=int, default=8, help="The size of the matrix.")
     parser.add_argument('-f', "--folder", type=str, default=None, help="The output folder path.")
+    parser.add_argument('-v', "--verbosity", type=str, default="summary",
+                        choices=[v.name.lower() for v in Verbosity],
+                        help="How much to print while simulating.")
+    parser.add_argument("--batch", action='store_true',
+                        help="Treat hostmem as a glob pattern and run the program over every matching host file at once.")
+    parser.add_argument("--decode-cache", action='store_true',
+                        help=f"Cache the decoded program in {DECODE_CACHE_DIR}.")
+    parser.add_argument("--no-jit", action='store_true',
+                        help="Interpret every instruction instead of compiling straight-line blocks.")
+    parser.add_argument("--checkpoint", type=str, default=None,
+                        help="Write a checkpoint to this .npz file after --checkpoint-after instructions, then carry on.")
+    parser.add_argument("--checkpoint-after", type=int, default=0,
+                        help="How many instructions to run before writing --checkpoint.")
+    parser.add_argument("--restore", type=str, default=None,
+                        help="Start from a checkpoint written with --checkpoint instead of from PC 0.")
     args = parser.parse_args()
+    decode_cache_dir = DECODE_CACHE_DIR if args.decode_cache else None
 
 if __name__ == '__main__':
     if len(sys.argv) < 4:
@@ -373,8 +1046,34 @@ if __name__ == '__main__':
     if not args.folder:
         args.folder = f'{datetime.now().strftime("%Y-%m-%d_%H:%M:%S")}_{args.bitwidth}b_{args.matsize}m'
 
+    if args.batch:
+        if args.checkpoint or args.restore:
+            print('--checkpoint and --restore can\'t be used with --batch')
+            sys.exit(1)
+        hostmems = sorted(glob.glob(args.hostmem))
+        if not hostmems:
+            print(f'No host memory files match {args.hostmem}')
+            sys.exit(1)
+        tpusim = BatchTPUSim(args.prog, hostmems, args.weightsmem, args.bitwidth,
+                             args.matsize, args.folder, 
+                             Verbosity[args.verbosity.upper()], decode_cache_dir,
+                             jit=not args.no_jit)
+        tpusim.run()
+        print(f'Results for {len(hostmems)} host files saved under {args.folder}')
+        sys.exit(0)
+
     tpusim = TPUSim(args.prog, args.hostmem, args.weightsmem, args.bitwidth,
-                    args.matsize, args.folder)
+                    args.matsize, args.folder, 
+                    Verbosity[args.verbosity.upper()], decode_cache_dir,
+                    jit=not args.no_jit)
+    if args.restore:
+        tpusim.restore(args.restore)
+    if args.checkpoint:
+        if tpusim.advance(args.checkpoint_after):
+            tpusim.checkpoint(args.checkpoint)
+            print(f'Checkpoint at PC {tpusim.pc} saved to {args.checkpoint}')
+        else:
+            print(f'Halted before {args.checkpoint_after} instructions, no checkpoint saved')
     tpusim.run()
     utils.print_mems(tpusim.host_memory, tpusim.weight_memory, 
                      tpusim.unified_buffer, tpusim.fifo_to_np(), 
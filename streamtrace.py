@@ -0,0 +1,276 @@
+import json
+from operator import itemgetter
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from pyrtl import SimulationTrace, working_block
+
+# a trace on disk is a folder holding wires.json (the name, bitwidth and
+# position of each wire), index.json (the chunks written so far) and one file
+# per chunk of cycles. within a chunk the values are stored by wire: 'narrow' is a
+# (wires, cycles) uint64 array for the wires of 64 bits or less, and 'wide'
+# is a (bytes, cycles) uint8 array holding the little-endian bytes of the
+# wider ones. compressed chunks are chunk_NNNNN.npz; uncompressed ones are a
+# pair of .npy files the reader memory-maps.
+
+INDEX_FILE = "index.json"
+WIRES_FILE = "wires.json"
+FORMAT_VERSION = 1
+# how much wire data to buffer before writing a chunk
+DEFAULT_CHUNK_BYTES = 4 * 2**20
+
+
+def chunk_paths(path, i, compressed):
+    base = os.path.join(path, f"chunk_{i:05d}")
+    if compressed:
+        return [f"{base}.npz"]
+    return [f"{base}_narrow.npy", f"{base}_wide.npy"]
+
+def byte_width(bitwidth):
+    return (bitwidth + 7) // 8
+
+# the wires SimulationTrace tracks by default (the explicitly named ones)
+# whose names start with one of `prefixes`
+def wires_with_prefix(block, prefixes):
+    return [w for w in working_block(block).wirevector_set
+            if not w.name.startswith(("tmp", "const_")) and not w.name.endswith("'")
+            and w.name.startswith(tuple(prefixes))]
+
+
+# read the values of `names` out of a dict-like as a tuple
+def tuple_getter(names):
+    if len(names) == 1:
+        return lambda values: (values[names[0]],)
+    return itemgetter(*names) if names else lambda values: ()
+
+
+# a SimulationTrace that writes the trace to `path` a chunk at a time instead
+# of keeping it all in memory. only wires whose names start with one of
+# `prefixes` are recorded (all the named wires if it's None). with path=None
+# nothing is written. call close() after the last step.
+#
+# each step is buffered as a row of values until there's a chunk's worth.
+# FastSimulation's steps are read straight from its context. Simulation's
+# and CompiledSimulation's go through the usual trace lists, which are then
+# cut back to their latest value, as CompiledSimulation.inspect reads it
+# from there. CompiledSimulation appends to the lists itself, so whoever
+# steps it has to call step_done() afterwards
+class StreamingTrace(SimulationTrace):
+    def __init__(self, path: Optional[str], prefixes: Optional[List[str]] = None,
+                 compress: bool = True, chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                 block=None):
+        wires_to_track = None
+        if prefixes is not None:
+            wires_to_track = wires_with_prefix(block, prefixes)
+        super().__init__(wires_to_track, block=block)
+        self.path = path
+        self.compress = compress
+        self.chunk_bytes = chunk_bytes
+        self.cycles_written = 0
+        self.chunks = []
+        self.layout = None
+        self.narrow_rows = []
+        self.wide_rows = []
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def add_step(self, value_map):
+        super().add_step(value_map)
+        self.step_done()
+
+    def add_step_named(self, value_map):
+        super().add_step_named(value_map)
+        self.step_done()
+
+    def add_fast_step(self, fastsim):
+        if self.layout is None:
+            self.make_layout()
+        self.add_row(fastsim.context)
+
+    # decide where each wire goes in a chunk. this waits for the first step
+    # because CompiledSimulation drops the wires it can't trace when it starts
+    def make_layout(self):
+        narrow, wide = [], []
+        wide_bytes = 0
+        for name in sorted(self.trace):
+            bitwidth = len(self._wires[name])
+            if bitwidth <= 64:
+                narrow.append((name, bitwidth))
+            else:
+                wide.append((name, bitwidth, wide_bytes))
+                wide_bytes += byte_width(bitwidth)
+        self.layout = {"version": FORMAT_VERSION, "narrow": narrow, 
+                       "wide": wide, "wide_bytes": wide_bytes}
+        self.get_narrow = tuple_getter([name for name, _ in narrow])
+        self.get_wide = tuple_getter([name for name, _, _ in wide])
+        cycle_bytes = 8 * len(narrow) + wide_bytes
+        self.chunk_cycles = max(1, self.chunk_bytes // max(1, cycle_bytes))
+        if self.path is not None:
+            self.write_json(WIRES_FILE, self.layout)
+
+    # buffer one cycle, given a dict-like of {wire name: value}
+    def add_row(self, values):
+        if self.path is None:
+            return
+        self.narrow_rows.append(self.get_narrow(values))
+        self.wide_rows.append(self.get_wide(values))
+        if len(self.narrow_rows) >= self.chunk_cycles:
+            self.write_chunk()
+
+    # move the values of the step just taken from the trace lists to a row
+    def step_done(self):
+        if self.layout is None:
+            self.make_layout()
+        self.add_row({name: values[-1] for name, values in self.trace.items()})
+        for name in self.trace:
+            del self.trace[name][:-1]
+
+    def write_chunk(self):
+        pending = len(self.narrow_rows)
+        if pending == 0:
+            return
+        narrow = np.array(self.narrow_rows, dtype=np.uint64)
+        narrow = np.ascontiguousarray(narrow.reshape(pending, len(self.layout["narrow"])).T)
+        wide = np.zeros((self.layout["wide_bytes"], pending), dtype=np.uint8)
+        for i, (name, bitwidth, offset) in enumerate(self.layout["wide"]):
+            nbytes = byte_width(bitwidth)
+            data = b"".join(row[i].to_bytes(nbytes, 'little')
+                            for row in self.wide_rows)
+            wide[offset:offset+nbytes] = \
+                np.frombuffer(data, dtype=np.uint8).reshape(pending, nbytes).T
+
+        files = chunk_paths(self.path, len(self.chunks), self.compress)
+        if self.compress:
+            np.savez_compressed(files[0], narrow=narrow, wide=wide)
+        else:
+            np.save(files[0], narrow)
+            np.save(files[1], wide)
+        self.chunks.append({"start": self.cycles_written, "cycles": pending})
+        self.cycles_written += pending
+        self.narrow_rows = []
+        self.wide_rows = []
+        self.write_index()
+
+    def write_index(self):
+        self.write_json(INDEX_FILE, {"cycles": self.cycles_written, 
+                                     "compressed": self.compress,
+                                     "chunks": self.chunks})
+
+    # write then rename, so a reader never sees half a file
+    def write_json(self, filename, data):
+        with open(os.path.join(self.path, filename + ".tmp"), 'w') as f:
+            json.dump(data, f)
+        os.replace(os.path.join(self.path, filename + ".tmp"),
+                   os.path.join(self.path, filename))
+
+    # write whatever hasn't been written yet
+    def close(self):
+        if self.path is None:
+            return
+        if self.layout is None:
+            self.make_layout()
+        self.write_chunk()
+        self.write_index()
+
+
+# random access to a trace written by StreamingTrace. only the chunks that
+# cover the requested cycles are read, and the most recent one is kept
+#
+#   trace = TraceReader("output/trace")
+#   trace.wire("tpu_pc", 100, 200)      # values of one wire for cycles 100-199
+#   trace.cycles(150, 151)              # every wire for cycle 150
+#   for first, values in trace.blocks(): ...  # the whole trace, chunk by chunk
+class TraceReader(object):
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, WIRES_FILE)) as f:
+            layout = json.load(f)
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            index = json.load(f)
+        if layout["version"] != FORMAT_VERSION:
+            raise ValueError(f"{path} has trace format version {layout['version']}, "
+                             f"expected {FORMAT_VERSION}")
+        self.compressed = index["compressed"]
+        self.chunks = index["chunks"]
+        self.bitwidths = {}
+        self.narrow_rows = {}
+        self.wide_rows = {}
+        for i, (name, bitwidth) in enumerate(layout["narrow"]):
+            self.bitwidths[name] = bitwidth
+            self.narrow_rows[name] = i
+        for name, bitwidth, offset in layout["wide"]:
+            self.bitwidths[name] = bitwidth
+            self.wide_rows[name] = slice(offset, offset + byte_width(bitwidth))
+        self.wire_names = sorted(self.bitwidths)
+        self.cycle_count = index["cycles"]
+        self.loaded = (None, None)
+
+    def __len__(self):
+        return self.cycle_count
+
+    def __contains__(self, name):
+        return name in self.bitwidths
+
+    # the names of the wires starting with any of `prefixes`
+    def names_with_prefix(self, prefixes) -> List[str]:
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        return [n for n in self.wire_names if any(n.startswith(p) for p in prefixes)]
+
+    # (narrow, wide) arrays for chunk i
+    def chunk(self, i):
+        if self.loaded[0] != i:
+            files = chunk_paths(self.path, i, self.compressed)
+            if self.compressed:
+                with np.load(files[0]) as data:
+                    arrays = (data["narrow"], data["wide"])
+            else:
+                arrays = (np.load(files[0], mmap_mode='r'),
+                          np.load(files[1], mmap_mode='r'))
+            self.loaded = (i, arrays)
+        return self.loaded[1]
+
+    # yield (chunk index, first cycle, last cycle + 1) relative to the chunk
+    # for the chunks covering cycles start to stop-1
+    def chunk_ranges(self, start, stop):
+        for i, chunk in enumerate(self.chunks):
+            lo = max(start, chunk["start"])
+            hi = min(stop, chunk["start"] + chunk["cycles"])
+            if lo < hi:
+                yield i, lo - chunk["start"], hi - chunk["start"]
+
+    def column(self, name, narrow, wide, lo, hi) -> List[int]:
+        if name in self.narrow_rows:
+            return [int(v) for v in narrow[self.narrow_rows[name], lo:hi]]
+        data = np.ascontiguousarray(wide[self.wide_rows[name], lo:hi].T)
+        return [int.from_bytes(row.tobytes(), 'little') for row in data]
+
+    # the values of `name` for cycles start to stop-1 (to the end by default)
+    def wire(self, name: str, start: int = 0, stop: Optional[int] = None) -> List[int]:
+        return self.cycles(start, stop, [name])[name]
+
+    # {wire name: values} for cycles start to stop-1, for `names` (every
+    # wire by default)
+    def cycles(self, start: int = 0, stop: Optional[int] = None,
+               names: Optional[List[str]] = None) -> Dict[str, List[int]]:
+        names = self.wire_names if names is None else names
+        values = {name: [] for name in names}
+        for _, block in self.blocks(start, stop, names):
+            for name in names:
+                values[name] += block[name]
+        return values
+
+    # like cycles(), but a chunk at a time so scanning a whole trace never
+    # holds more than one chunk. yields (first cycle, {wire name: values})
+    def blocks(self, start: int = 0, stop: Optional[int] = None,
+               names: Optional[List[str]] = None):
+        stop = self.cycle_count if stop is None else min(stop, self.cycle_count)
+        names = self.wire_names if names is None else names
+        for name in names:
+            if name not in self.bitwidths:
+                raise KeyError(f"{name} is not in the trace at {self.path}")
+        for i, lo, hi in self.chunk_ranges(start, stop):
+            narrow, wide = self.chunk(i)
+            yield self.chunks[i]["start"] + lo, \
+                {name: self.column(name, narrow, wide, lo, hi) for name in names}
@@ -0,0 +1,140 @@
+# benchmark for checkpoints: a sweep of program variants that share a long
+# prefix, run from the start every time against running the prefix once,
+# writing a checkpoint at its end and restoring it for each variant
+# run from anywhere, with HAZARD_DETECTION = False in config.py:
+#   python bench_checkpoint.py [matsize]
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# add base folder (OPENTGPTPU) to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from assembler import assemble
+from runtpu import runtpu
+from sim import TPUSim, Verbosity
+
+bitwidth = 32
+rows = 64
+# blocks of RHM, RW, MMC, ACT and WHM in the shared prefix. with 8 blocks
+# and the variant's block the program fills most of IMem at matsize 8
+prefix_blocks = 8
+# the weight tile and activation function of each variant's last block
+variants = [("RW 0", "ACT"), ("RW 0", "ACT.R"), ("RW 1", "ACT"), ("RW 1", "ACT.Q")]
+
+# one block, with NOPs after each instruction so it has finished before the
+# next starts, as in test/runtpu_backends
+def block(rw, act, matsize):
+    pad = ["NOP"] * (rows + 2*matsize + 8)
+    lines = []
+    for instr in [f"RHM 0, 0, {rows}", rw, f"MMC.S 0, 0, {rows}",
+                  f"{act} 0, {rows}, {rows}", f"WHM {rows}, {rows}, {rows}"]:
+        lines += [instr] + pad
+    return lines
+
+# write the variants' programs, a host memory and weights. returns the
+# program file names, the other two files and the prefix's length
+def make_workload(path, matsize):
+    prefix = block("RW 0", "ACT.R", matsize) * prefix_blocks
+    programs = []
+    for i, (rw, act) in enumerate(variants):
+        with open(f"{path}/variant{i}.a", 'w') as f:
+            f.write("\n".join(prefix + block(rw, act, matsize) + ["HLT"]) + "\n")
+        assemble(f"{path}/variant{i}.a", 0)
+        programs.append(f"{path}/variant{i}.out")
+
+    rng = np.random.default_rng(0)
+    np.save(f"{path}/hostmem.npy",
+            rng.integers(-128, 128, (2*rows, matsize)).astype(np.int32))
+    np.save(f"{path}/weights.npy",
+            rng.integers(-128, 128, (2, matsize, matsize)).astype(np.int32))
+    return programs, f"{path}/hostmem.npy", f"{path}/weights.npy", len(prefix)
+
+# run fn quietly. returns (its result, seconds taken)
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def same_mems(a, b):
+    return all(np.array_equal(x, y) for x, y in zip(a, b))
+
+def bench_runtpu(programs, hostmem, weights, prefix_length, matsize, path):
+    # build the netlist once, so no run below pays for it
+    timed(runtpu, programs[0], hostmem, weights, bitwidth, matsize, path, output_trace=False)
+    checkpoint = f"{path}/rtl_checkpoint.npz"
+
+    full = []
+    full_time = 0
+    for prog in programs:
+        mems, t = timed(runtpu, prog, hostmem, weights, bitwidth, matsize, path,
+                        output_trace=False)
+        full.append(mems)
+        full_time += t
+
+    # without hazard detection the TPU dispatches one instruction a cycle, so
+    # the cycle the prefix ends at is its length
+    _, prefix_time = timed(runtpu, programs[0], hostmem, weights, bitwidth, matsize, path,
+                           output_trace=False, checkpoint=checkpoint,
+                           checkpoint_at=prefix_length)
+    restored_time = 0
+    agree = True
+    for prog, expected in zip(programs, full):
+        mems, t = timed(runtpu, prog, hostmem, weights, bitwidth, matsize, path,
+                        output_trace=False, restore=checkpoint)
+        agree = agree and same_mems(mems, expected)
+        restored_time += t
+    return full_time, prefix_time, restored_time, os.path.getsize(checkpoint), agree
+
+def bench_sim(programs, hostmem, weights, prefix_length, matsize, path):
+    checkpoint = f"{path}/sim_checkpoint.npz"
+
+    def run(prog, restore=None):
+        tpusim = TPUSim(prog, hostmem, weights, bitwidth, matsize, path,
+                        verbosity=Verbosity.SILENT)
+        if restore:
+            tpusim.restore(restore)
+        tpusim.run()
+        return tpusim.get_mems()
+
+    def run_prefix(prog):
+        tpusim = TPUSim(prog, hostmem, weights, bitwidth, matsize, path,
+                        verbosity=Verbosity.SILENT)
+        tpusim.advance(prefix_length)
+        tpusim.checkpoint(checkpoint)
+
+    full = []
+    full_time = 0
+    for prog in programs:
+        mems, t = timed(run, prog)
+        full.append(mems)
+        full_time += t
+    _, prefix_time = timed(run_prefix, programs[0])
+    restored_time = 0
+    agree = True
+    for prog, expected in zip(programs, full):
+        mems, t = timed(run, prog, checkpoint)
+        agree = agree and same_mems(mems, expected)
+        restored_time += t
+    return full_time, prefix_time, restored_time, os.path.getsize(checkpoint), agree
+
+
+if __name__ == "__main__":
+    matsize = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    with tempfile.TemporaryDirectory() as path:
+        programs, hostmem, weights, prefix_length = make_workload(path, matsize)
+        print(f"matsize {matsize}, {len(programs)} variants, {prefix_length}-instruction "
+              f"shared prefix, {prefix_length + len(block('', '', matsize)) + 1} instructions each")
+        print(f"{'':<8}{'from start':>12}{'prefix':>10}{'restored':>10}{'speedup':>9}"
+              f"{'checkpoint':>12}  results")
+        for name, bench in [("runtpu", bench_runtpu), ("sim.py", bench_sim)]:
+            full, prefix, restored, size, agree = bench(programs, hostmem, weights,
+                                                        prefix_length, matsize, path)
+            print(f"{name:<8}{full:>11.2f}s{prefix:>9.2f}s{restored:>9.2f}s"
+                  f"{full / (prefix + restored):>8.1f}x{size / 1024:>9.1f} KB  "
+                  f"{'agree' if agree else 'DIFFER'}", flush=True)
@@ -0,0 +1,108 @@
+# check that runs restored from a checkpoint end the same as runs that never
+# stopped. for every mullifier example, runtpu writes checkpoints at a few
+# cycles, and each is restored with the fast backend (and the first with the
+# compiled one, if gcc is around) and run to the end. TPUSim does the same
+# at a few instruction counts. prints each failure and exits with 1 if there
+# were any. the examples are assembled from their open_tpu.a in memory
+# run from anywhere, with either setting of HAZARD_DETECTION:
+#   python check_checkpoint.py [example ...]
+import contextlib
+import glob
+import io
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+# add base folder (OPENTGPTPU) to sys.path
+base = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.append(base)
+
+from assembler import assemble_text
+from runtpu import runtpu, compiled_sim_available
+from sim import TPUSim, Verbosity
+
+examples_path = os.path.join(base, "test/mullifier_examples")
+bitwidth = 32
+matsize = 8
+
+failures = 0
+
+def check(ok, what):
+    global failures
+    if not ok:
+        failures += 1
+        print(f"FAIL: {what}")
+
+def same_mems(a, b):
+    return all(np.array_equal(x, y) for x, y in zip(a, b))
+
+# run runtpu quietly. returns its memories and the cycle it stopped at
+def quiet_runtpu(files, output_folder, **kwargs):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        mems = runtpu(*files, bitwidth, matsize, output_folder, output_trace=False, **kwargs)
+    stopped = [l for l in out.getvalue().splitlines() if l.startswith("Simulation terminated")]
+    return mems, int(stopped[-1].split()[-1])
+
+def check_runtpu(name, files, path):
+    full, cycles = quiet_runtpu(files, f"{path}/full")
+    backends = ["fast", "compiled"] if compiled_sim_available() else ["fast"]
+    for at in sorted({0, 1, cycles // 3, 2 * cycles // 3, cycles}):
+        checkpoint = f"{path}/rtl_{at}.npz"
+        mems, stopped = quiet_runtpu(files, f"{path}/a", checkpoint=checkpoint,
+                                     checkpoint_at=at)
+        check(os.path.exists(checkpoint), f"{name}: no checkpoint at cycle {at}")
+        check(same_mems(mems, full) and stopped == cycles,
+              f"{name}: writing a checkpoint at cycle {at} changed the run")
+        for backend in backends:
+            mems, stopped = quiet_runtpu(files, f"{path}/b", restore=checkpoint, backend=backend)
+            check(same_mems(mems, full) and stopped == cycles,
+                  f"{name}: {backend} run restored at cycle {at} ended differently "
+                  f"(cycle {stopped}, not {cycles})")
+        backends = ["fast"]
+    return cycles
+
+def new_tpusim(files, path):
+    return TPUSim(*files, bitwidth, matsize, path, verbosity=Verbosity.SILENT)
+
+def tpusim_state(tpusim):
+    return (tpusim.pc, tpusim.pc_history, tpusim.rw_count, tpusim.hm_count,
+            tpusim.mmc_count, tpusim.act_count, tpusim.reload_count, tpusim.prev_rw)
+
+def check_tpusim(name, files, path):
+    full = new_tpusim(files, path)
+    full.run()
+    steps = len(full.pc_history) - 1
+    for at in sorted({0, 1, steps // 3, 2 * steps // 3, steps}):
+        checkpoint = f"{path}/sim_{at}.npz"
+        tpusim = new_tpusim(files, path)
+        check(tpusim.advance(at) or at == steps, f"{name}: TPUSim halted before {at} instructions")
+        tpusim.checkpoint(checkpoint)
+        restored = new_tpusim(files, path)
+        restored.restore(checkpoint)
+        check(tpusim_state(restored) == tpusim_state(tpusim),
+              f"{name}: TPUSim state restored after {at} instructions differs")
+        restored.run()
+        check(same_mems(restored.get_mems(), full.get_mems())
+              and tpusim_state(restored) == tpusim_state(full),
+              f"{name}: TPUSim restored after {at} instructions ended differently")
+    return steps
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or [tf.split('/')[-2]
+                             for tf in sorted(glob.glob(f"{examples_path}/[a-z]*/"))]
+    for name in names:
+        test_path = f"{examples_path}/{name}"
+        with open(f"{test_path}/open_tpu.a") as f:
+            binary = assemble_text(f.read())
+        files = (binary, f"{test_path}/input.npy", f"{test_path}/weights.npy")
+        with tempfile.TemporaryDirectory() as path:
+            cycles = check_runtpu(name, files, path)
+            steps = check_tpusim(name, files, path)
+        print(f"{name}: runtpu {cycles} cycles, sim.py {steps} instructions", flush=True)
+
+    print(f"{failures} failures")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,104 @@
+# benchmark for cosim.py: how soon it stops on a bug early in a long program,
+# against running runtpu and sim.py to the end and comparing the memories
+# run from anywhere, with HAZARD_DETECTION = False in config.py:
+#   python bench_cosim.py [matsize]
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# add base folder (OPENTGPTPU) to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import isa
+from assembler import assemble
+from cosim import cosim
+from runtpu import runtpu
+from sim import TPUSim, Verbosity
+from utils import compare_all_mems
+
+bitwidth = 32
+rows = 64
+# the program runs for a few thousand cycles, as in test/runtpu_backends
+program_length = 4000
+# the RHM the bug is put in, counting from 0
+faulty_rhm = 2
+
+# a program that loops RHM, RW, MMC, ACT and WHM over `rows` rows, with NOPs
+# between them so each one has finished before the next starts, plus a host
+# memory and weights for it. returns the file names
+def make_workload(path, matsize):
+    pad = ["NOP"] * (rows + 2*matsize + 8)
+    block = []
+    for instr in [f"RHM 0, 0, {rows}", "RW 0", f"MMC.S 0, 0, {rows}",
+                  f"ACT 0, {rows}, {rows}", f"WHM {rows}, {rows}, {rows}"]:
+        block += [instr] + pad
+    lines = block * (program_length // len(block)) + ["HLT"]
+    with open(f"{path}/bench.a", 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    assemble(f"{path}/bench.a", 0)
+
+    rng = np.random.default_rng(0)
+    np.save(f"{path}/hostmem.npy",
+            rng.integers(-128, 128, (2*rows, matsize)).astype(np.int32))
+    np.save(f"{path}/weights.npy",
+            rng.integers(-128, 128, (1, matsize, matsize)).astype(np.int32))
+    return f"{path}/bench.out", f"{path}/hostmem.npy", f"{path}/weights.npy"
+
+# a TPUSim whose `faulty_rhm`th RHM reads the wrong half of host memory.
+# returns it and the RHM's pc
+def faulty_tpusim(files, matsize, output_folder):
+    tpusim = TPUSim(*files, bitwidth, matsize, output_folder, verbosity=Verbosity.SILENT)
+    tpusim.code = tpusim.load_code()
+    tpusim.handlers = tpusim.dispatch_table()
+    ops, _, _, addrs, _ = tpusim.code
+    rhms = [pc for pc, op in enumerate(ops) if op == isa.OPCODE2BIN['RHM'][0]]
+    addrs[rhms[faulty_rhm]] = rows
+    return tpusim, rhms[faulty_rhm]
+
+# run fn quietly. returns (its result, seconds taken)
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+# run runtpu and sim.py to the end and compare, as utils.run_and_compare_all_mems
+# does. returns whether they agreed
+def full_run(files, matsize, output_folder, tpusim):
+    rtl_mems = runtpu(*files, bitwidth, matsize, output_folder, output_trace=False)
+    tpusim.execute(*tpusim.code)
+    return compare_all_mems(*rtl_mems, *tpusim.get_mems())
+
+
+if __name__ == "__main__":
+    matsize = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    with tempfile.TemporaryDirectory() as path:
+        files = make_workload(path, matsize)
+        # build the netlist once, so no run below pays for it
+        timed(runtpu, *files, bitwidth, matsize, path, output_trace=False)
+
+        _, rtl_time = timed(runtpu, *files, bitwidth, matsize, path, output_trace=False)
+        clean, clean_time = timed(cosim, *files, bitwidth, matsize, path)
+        print(f"matsize {matsize}, {program_length} instructions")
+        print(f"runtpu alone:                {rtl_time:7.2f}s")
+        print(f"cosim, no bug:               {clean_time:7.2f}s  "
+              f"({'agree' if clean is None else 'DIVERGED'})")
+
+        tpusim, fault_pc = faulty_tpusim(files, matsize, path)
+        agreed, full_time = timed(full_run, files, matsize, path, tpusim)
+        print(f"runtpu + sim.py to the end:  {full_time:7.2f}s  "
+              f"({'agree' if agreed else 'differ'})")
+
+        tpusim, fault_pc = faulty_tpusim(files, matsize, path)
+        divergence, early_time = timed(cosim, *files, bitwidth, matsize, path, tpusim=tpusim)
+        if divergence is None:
+            print(f"cosim missed the bug at PC {fault_pc}")
+            sys.exit(1)
+        print(f"cosim, bug at PC {fault_pc:<5}:      {early_time:7.2f}s  "
+              f"(stopped at cycle {divergence.cycle}, PC {divergence.pc}, "
+              f"{full_time / early_time:.1f}x sooner)")
+        print(divergence.report())
@@ -0,0 +1,97 @@
+# run every mullifier example through cosim.py and check that the RTL and
+# sim.py agree all the way to HLT. then run each again with a fault injected
+# into sim.py (its first RHM turned into a NOP) and check that cosim stops
+# at that RHM, before the end of the program. exits with 1 on a failure.
+# the examples are assembled from their open_tpu.a in memory
+# run from anywhere, with HAZARD_DETECTION = True in config.py:
+#   python check_cosim.py [example ...]
+import contextlib
+import glob
+import io
+import os
+import sys
+import tempfile
+import time
+
+# add base folder (OPENTGPTPU) to sys.path
+base = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.append(base)
+
+import config
+import isa
+from assembler import assemble_text
+from cosim import cosim
+from sim import TPUSim, Verbosity
+
+examples_path = os.path.join(base, "test/mullifier_examples")
+
+# the example's program, assembled from its source
+def example_binary(test_path):
+    with open(f"{test_path}/open_tpu.a") as f:
+        return assemble_text(f.read())
+
+# run cosim quietly, returning (its result, the cycle runtpu stopped at, the
+# time taken)
+def run_cosim(binary, test_path, output_folder, tpusim=None):
+    out = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        divergence = cosim(binary, f"{test_path}/input.npy",
+                           f"{test_path}/weights.npy", 32, 8, output_folder,
+                           tpusim=tpusim)
+    elapsed = time.perf_counter() - start
+    stopped = [l for l in out.getvalue().splitlines() if l.startswith("Simulation terminated")]
+    return divergence, int(stopped[-1].split()[-1]), elapsed
+
+# a TPUSim with its first RHM replaced by a NOP. returns it and the RHM's pc,
+# or None if the program has no RHM
+def faulty_tpusim(binary, test_path, output_folder):
+    tpusim = TPUSim(binary, f"{test_path}/input.npy",
+                    f"{test_path}/weights.npy", 32, 8, output_folder,
+                    verbosity=Verbosity.SILENT)
+    tpusim.code = tpusim.load_code()
+    tpusim.handlers = tpusim.dispatch_table()
+    ops = tpusim.code[0]
+    if isa.OPCODE2BIN['RHM'][0] not in ops:
+        return None, None
+    pc = ops.index(isa.OPCODE2BIN['RHM'][0])
+    ops[pc] = isa.OPCODE2BIN['NOP'][0]
+    return tpusim, pc
+
+
+if __name__ == "__main__":
+    if not config.HAZARD_DETECTION:
+        sys.exit("The mullifier examples only run the same on runtpu and sim.py with "
+                 "hazard detection: set HAZARD_DETECTION = True in config.py.")
+    names = sys.argv[1:] or [tf.split('/')[-2]
+                             for tf in sorted(glob.glob(f"{examples_path}/[a-z]*/"))]
+    failed = []
+    print(f"{'example':<24}{'cycles':>8}{'time':>8}{'fault pc':>10}{'stopped':>9}{'time':>8}")
+    for name in names:
+        test_path = f"{examples_path}/{name}"
+        binary = example_binary(test_path)
+        with tempfile.TemporaryDirectory() as output_folder:
+            divergence, cycles, elapsed = run_cosim(binary, test_path, output_folder)
+            if divergence is not None:
+                failed.append(name)
+                print(f"{name}: diverged\n{divergence.report()}")
+                continue
+
+            tpusim, fault_pc = faulty_tpusim(binary, test_path, output_folder)
+            if tpusim is None:
+                print(f"{name:<24}{cycles:>8}{elapsed:>7.2f}s{'no RHM':>10}")
+                continue
+            divergence, stopped, fault_elapsed = run_cosim(binary, test_path, output_folder, tpusim)
+            if divergence is None or divergence.pc != fault_pc or stopped >= cycles:
+                failed.append(name)
+                print(f"{name}: the fault at PC {fault_pc} wasn't caught there")
+                if divergence is not None:
+                    print(divergence.report())
+                continue
+            print(f"{name:<24}{cycles:>8}{elapsed:>7.2f}s{fault_pc:>10}{stopped:>9}"
+                  f"{fault_elapsed:>7.2f}s", flush=True)
+
+    print(f"{len(names) - len(failed)}/{len(names)} passed")
+    if failed:
+        print("failed:", " ".join(failed))
+    sys.exit(1 if failed else 0)
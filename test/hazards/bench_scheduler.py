@@ -0,0 +1,86 @@
+# measures what scheduler.py saves on the RTL: each program is padded in the
+# order it's written and reordered by the scheduler, with the distances from a
+# squishtest results table, and both are run through runtpu for their cycle
+# counts. the scheduled program must end with the same memories as sim.py
+# gives for the program as written
+# run from anywhere, with HAZARD_DETECTION = False in config.py:
+#   python bench_scheduler.py [results.json] [matsize] [random programs]
+# (results_m8.json here by default, as for check_hazards.py)
+import contextlib
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+# add base folder (OPENTGPTPU) to sys.path
+base = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.append(base)
+
+from assembler import assemble_text
+from check_hazards import Cycles, bitwidth, programs, rows
+from hazards import LatencyModel, decode, pad, padded_text
+from runtpu import runtpu
+from scheduler import schedule
+from sim import TPUSim
+from utils import compare_all_mems
+
+random_programs = 30
+
+def run_rtl(binary, path, matsize):
+    cycles = Cycles()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        mems = runtpu(binary, f"{path}/hostmem.npy", f"{path}/weights.npy", bitwidth,
+                      matsize, path, output_trace=False, observers=[cycles])
+    return mems, cycles.cycles
+
+def run_sim(binary, path, matsize):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        sim = TPUSim(binary, f"{path}/hostmem.npy", f"{path}/weights.npy", bitwidth,
+                     matsize, path)
+        sim.run()
+    return sim.get_mems()
+
+# the programs' ACTs are plain activations, and both orders are checked
+# against sim.py running the program as written
+def padded(instrs, model):
+    return assemble_text(padded_text(instrs, pad(instrs, model, allow_act=True)))
+
+
+if __name__ == "__main__":
+    results = sys.argv[1] if len(sys.argv) > 1 else f"{base}/test/hazards/results_m8.json"
+    matsize = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    if len(sys.argv) > 3:
+        random_programs = int(sys.argv[3])
+    model = LatencyModel.load(results, matsize, bitwidth)
+
+    failures = []
+    totals = [0, 0]
+    print(f"{'program':<12}{'in order':>10}{'scheduled':>11}{'saved':>8}")
+    with tempfile.TemporaryDirectory() as path:
+        rng = np.random.default_rng(0)
+        np.save(f"{path}/hostmem.npy",
+                rng.integers(-128, 128, (rows, matsize)).astype(np.int32))
+        np.save(f"{path}/weights.npy",
+                rng.integers(-128, 128, (4, matsize, matsize)).astype(np.int32))
+
+        for name, text in programs(matsize, random_programs).items():
+            instrs = decode(assemble_text(text))
+            expected = run_sim(assemble_text(text), path, matsize)
+            in_order, in_order_cycles = run_rtl(padded(instrs, model), path, matsize)
+            order = schedule(instrs, model, allow_act=True)
+            scheduled, cycles = run_rtl(padded([instrs[i] for i in order], model), path, matsize)
+            print(f"{name:<12}{in_order_cycles:>10}{cycles:>11}"
+                  f"{1 - cycles / in_order_cycles:>8.0%}")
+            totals[0] += in_order_cycles
+            totals[1] += cycles
+            if not compare_all_mems(*in_order, *expected):
+                failures.append(f"{name}: wrong padded in order")
+            if not compare_all_mems(*scheduled, *expected):
+                failures.append(f"{name}: wrong scheduled")
+
+    print(f"{'total':<12}{totals[0]:>10}{totals[1]:>11}{1 - totals[1] / totals[0]:>8.0%}")
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
@@ -0,0 +1,168 @@
+# check hazards.py's NOP padding against the RTL: each program is padded
+# with the distances from a squishtest results table and run through runtpu
+# and sim.py, which must end with the same memories, as in a squishtest. the
+# same program with every instruction the fixed distance apart (as the
+# generators pad) and with no padding at all are run too, for the program
+# lengths and cycle counts the padding saves, and to show the hazards are real.
+# sim.py must also end the padded program the same as the written one
+# run from anywhere, with HAZARD_DETECTION = False in config.py:
+#   python check_hazards.py [results.json] [matsize] [random programs]
+# results.json can come from test/squish/entry_point.py or sample_sweep.py.
+# the default is results_m8.json here, sample_sweep.py's table for matsize 8
+import contextlib
+import os
+import random
+import sys
+import tempfile
+
+import numpy as np
+
+# add base folder (OPENTGPTPU) to sys.path
+base = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.append(base)
+
+from assembler import assemble_text
+from hazards import FIXED_DISTANCE, LatencyModel, decode, fixed_length, pad, padded_text
+from runtpu import Observer, runtpu
+from sim import TPUSim
+from utils import compare_all_mems
+
+bitwidth = 32
+rows = 128
+random_programs = 30
+
+# records the cycle the TPU halted at
+class Cycles(Observer):
+    def on_finish(self, view):
+        self.cycles = view.cycle
+
+# independent tiles: each reads its own rows, multiplies them by its own
+# weights and writes its own result back
+def tiles(matsize, count=4):
+    lines = []
+    for t in range(count):
+        lines += [f"RHM {t*matsize}, {t*matsize}, {matsize}", f"RW {t}",
+                  f"MMC.SO {t*matsize}, {t*matsize}, {matsize}",
+                  f"ACT.R {t*matsize}, {(t + 4)*matsize}, {matsize}",
+                  f"WHM {(t + 8)*matsize}, {(t + 4)*matsize}, {matsize}"]
+    return "\n".join(lines + ["HLT"]) + "\n"
+
+# two layers, each reading the one before it's results
+def layers(matsize):
+    return "\n".join([
+        f"RHM 0, 0, {matsize}", "RW 0", "RW 1",
+        f"MMC.SO 0, 0, {matsize}", f"ACT.R 0, {matsize}, {matsize}",
+        f"MMC.SO {matsize}, {matsize}, {matsize}", f"ACT {matsize}, {2*matsize}, {matsize}",
+        f"WHM {2*matsize}, {2*matsize}, {matsize}", "HLT"]) + "\n"
+
+# two products summed in the accumulators before the activation
+def accumulate(matsize):
+    return "\n".join([
+        f"RHM 0, 0, {matsize}", f"RHM {matsize}, {matsize}, {matsize}", "RW 2", "RW 3",
+        f"MMC.SO 0, 0, {matsize}", f"MMC.S 0, {matsize}, {matsize}",
+        f"ACT.R 0, {2*matsize}, {matsize}", f"WHM {3*matsize}, {2*matsize}, {matsize}",
+        "HLT"]) + "\n"
+
+# a random straight-line program over a few rows, so its instructions
+# overlap in all sorts of ways. MMCs only come when the FIFO has a weight
+def random_program(rng, matsize, count=12):
+    lines = []
+    fifo = 0
+    for _ in range(count):
+        length = rng.choice([1, matsize // 2, matsize])
+        a, b = rng.randrange(1, 3*matsize), rng.randrange(0, 3*matsize)
+        kind = rng.choice(["RHM", "RW", "MMC", "ACT", "WHM"])
+        if kind == "RHM":
+            lines.append(f"RHM {a}, {b}, {length}")
+        elif kind == "WHM":
+            lines.append(f"WHM {a + 5*matsize}, {b}, {length}")
+        elif kind == "ACT":
+            lines.append(f"{rng.choice(['ACT', 'ACT.R'])} {b}, {a}, {length}")
+        elif kind == "RW" and fifo < 4:
+            lines.append(f"RW {rng.randrange(4)}")
+            fifo += 1
+        elif kind == "MMC" and fifo > 0:
+            flags = rng.choice(["", ".S", ".O", ".SO"])
+            fifo -= "S" in flags
+            lines.append(f"MMC{flags} {b}, {a}, {length}")
+    return "\n".join(lines + ["HLT"]) + "\n"
+
+def programs(matsize, random_count=random_programs):
+    with open(f"{base}/test/simplemult/simplemult.a") as f:
+        simplemult = f.read()
+    progs = {"simplemult": simplemult, "tiles": tiles(matsize),
+             "layers": layers(matsize), "accumulate": accumulate(matsize)}
+    for seed in range(random_count):
+        progs[f"random{seed}"] = random_program(random.Random(seed), matsize)
+    return progs
+
+# run a binary through runtpu and sim.py. returns (same memories, cycles)
+def run(binary, path, matsize):
+    cycles = Cycles()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        rtl = runtpu(binary, f"{path}/hostmem.npy", f"{path}/weights.npy", bitwidth,
+                     matsize, path, output_trace=False, observers=[cycles])
+    same = compare_all_mems(*rtl, *run_sim(binary, path, matsize))
+    return same, cycles.cycles
+
+# the memories sim.py ends a binary with
+def run_sim(binary, path, matsize):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        sim = TPUSim(binary, f"{path}/hostmem.npy", f"{path}/weights.npy", bitwidth,
+                     matsize, path)
+        sim.run()
+    return sim.get_mems()
+
+
+if __name__ == "__main__":
+    results = sys.argv[1] if len(sys.argv) > 1 else f"{base}/test/hazards/results_m8.json"
+    matsize = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    if len(sys.argv) > 3:
+        random_programs = int(sys.argv[3])
+    model = LatencyModel.load(results, matsize, bitwidth)
+    print(f"{sum(map(len, model.table.values()))} measurements for "
+          f"{len(model.table)} instruction pairs at matsize {matsize}")
+
+    failures = []
+    print(f"{'program':<12}{'written':>9}{'fixed':>8}{'padded':>8}"
+          f"{'fixed cycles':>14}{'padded cycles':>15}{'unpadded':>10}")
+    with tempfile.TemporaryDirectory() as path:
+        rng = np.random.default_rng(0)
+        np.save(f"{path}/hostmem.npy",
+                rng.integers(-128, 128, (rows, matsize)).astype(np.int32))
+        np.save(f"{path}/weights.npy",
+                rng.integers(-128, 128, (4, matsize, matsize)).astype(np.int32))
+
+        for name, text in programs(matsize, random_programs).items():
+            instrs = decode(assemble_text(text))
+            kept = [i for i, instr in enumerate(instrs) if instr.op != 0]
+            fixed_pcs, unpadded_pcs = [None] * len(instrs), [None] * len(instrs)
+            for n, i in enumerate(kept):
+                fixed_pcs[i] = n * FIXED_DISTANCE
+                unpadded_pcs[i] = n
+            # every program has ACTs, meant as plain activations. if the data
+            # made one branch or jump, padding would change where to, and
+            # sim.py would end the padded program differently from the written
+            padded = assemble_text(padded_text(instrs, pad(instrs, model, allow_act=True)))
+            moved_ok = compare_all_mems(*run_sim(padded, path, matsize),
+                                        *run_sim(assemble_text(text), path, matsize))
+
+            fixed_ok, fixed_cycles = run(assemble_text(padded_text(instrs, fixed_pcs)),
+                                         path, matsize)
+            padded_ok, padded_cycles = run(padded, path, matsize)
+            unpadded_ok, _ = run(assemble_text(padded_text(instrs, unpadded_pcs)),
+                                 path, matsize)
+            print(f"{name:<12}{len(instrs):>9}{fixed_length(instrs):>8}"
+                  f"{len(padded) // 14:>8}{fixed_cycles:>14}{padded_cycles:>15}"
+                  f"{'passes' if unpadded_ok else 'fails':>10}")
+            if not fixed_ok:
+                failures.append(f"{name}: wrong with fixed padding")
+            if not padded_ok:
+                failures.append(f"{name}: wrong with the padding from {results}")
+            if not moved_ok:
+                failures.append(f"{name}: padding changed what sim.py computes")
+
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
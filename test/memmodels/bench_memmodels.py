@@ -0,0 +1,120 @@
+# benchmark for runtpu.py's host memory and weight DRAM models on a large
+# host memory that the program only reads a few rows of. each model runs in
+# its own process so its peak memory use can be reported. making the
+# workload gets a process too, as a child starts with its parent's peak
+# run from anywhere: python bench_memmodels.py [rows [model ...]]
+import contextlib
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# add base folder (OPENTGPTPU) to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from assembler import assemble
+from memmodels import MEMORY_MODELS
+from runtpu import Observer
+
+bitwidth = 32
+matsize = 8
+# 2^22 rows of 8 32-bit values is a 128 MB host memory
+default_rows = 2**22
+
+# a program that reads 8 rows from the start, middle and end of host memory,
+# multiplies them and writes the results back next to where it read them
+def make_workload(path, rows):
+    lines = []
+    for i, addr in enumerate([0, rows // 2, rows - 16]):
+        pad = ["NOP"] * 40
+        lines += [f"RHM {addr}, {8*i}, 8"] + pad + ["RW 0"] + pad \
+               + [f"MMC.S {8*i}, {8*i}, 8"] + pad \
+               + [f"ACT {8*i}, {8*i}, 8"] + pad \
+               + [f"WHM {8*i}, {addr + 8}, 8"] + pad
+    with open(f"{path}/bench.a", 'w') as f:
+        f.write("\n".join(lines + ["HLT"]) + "\n")
+    assemble(f"{path}/bench.a", 0)
+
+    # written a chunk at a time, so making it doesn't need it all in memory
+    hostmem = np.lib.format.open_memmap(f"{path}/hostmem.npy", mode='w+',
+                                        dtype=np.int32, shape=(rows, matsize))
+    rng = np.random.default_rng(0)
+    for start in range(0, rows, 2**20):
+        stop = min(rows, start + 2**20)
+        hostmem[start:stop] = rng.integers(-128, 128, (stop - start, matsize))
+    hostmem.flush()
+    del hostmem
+    np.save(f"{path}/weights.npy",
+            rng.integers(-128, 128, (1, matsize, matsize)).astype(np.int32))
+    return f"{path}/bench.out", f"{path}/hostmem.npy", f"{path}/weights.npy"
+
+def peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# records the time and peak memory when the simulation starts and halts,
+# before runtpu converts and saves the memories
+class Phases(Observer):
+    def __init__(self):
+        self.times = {}
+
+    def on_cycle(self, view):
+        if "first cycle" not in self.times:
+            self.times["first cycle"] = (time.perf_counter(), peak_mb())
+
+    def on_finish(self, view):
+        self.times["halt"] = (time.perf_counter(), peak_mb())
+
+# run the workload with one model (in this process). prints the seconds to
+# the first cycle, to the halt and to the end of runtpu, and the peak memory
+# at the halt and at the end
+def run(path, model):
+    from runtpu import runtpu
+    phases = Phases()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        hm, wm, ub, wq, acc = runtpu(f"{path}/bench.out", f"{path}/hostmem.npy",
+                                     f"{path}/weights.npy", bitwidth, matsize,
+                                     f"{path}/{model}", output_trace=False,
+                                     observers=[phases], memory_model=model)
+    end = time.perf_counter()
+    np.savez(f"{path}/{model}/check.npz", written=hm[-16:], ub=ub, acc=acc)
+    first, halt = phases.times["first cycle"], phases.times["halt"]
+    print(f"{first[0] - start:.1f} {halt[0] - start:.1f} {end - start:.1f} "
+          f"{halt[1]:.0f} {peak_mb():.0f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--run":
+        run(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+    if len(sys.argv) == 4 and sys.argv[1] == "--make":
+        make_workload(sys.argv[2], int(sys.argv[3]))
+        sys.exit(0)
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else default_rows
+    models = sys.argv[2:] or MEMORY_MODELS
+    with tempfile.TemporaryDirectory() as path:
+        subprocess.run([sys.executable, __file__, "--make", path, str(rows)], check=True)
+        print(f"host memory: {rows} rows, {os.path.getsize(f'{path}/hostmem.npy') / 2**20:.0f} MB")
+        print(f"{'model':<8}{'setup':>8}{'to halt':>10}{'total':>9}"
+              f"{'peak at halt':>15}{'peak':>10}")
+        for model in models:
+            out = subprocess.run([sys.executable, __file__, "--run", path, model],
+                                 capture_output=True, text=True)
+            if out.returncode != 0:
+                print(f"{model:<8}failed: {out.stderr.strip().splitlines()[-1]}")
+                continue
+            setup, halt, total, halt_peak, peak = out.stdout.split()
+            print(f"{model:<8}{setup:>7}s{halt:>9}s{total:>8}s"
+                  f"{halt_peak:>12} MB{peak:>7} MB", flush=True)
+
+        results = [np.load(f"{path}/{m}/check.npz") for m in models
+                   if os.path.exists(f"{path}/{m}/check.npz")]
+        for r in results[1:]:
+            for key in r.files:
+                if not np.array_equal(results[0][key], r[key]):
+                    print(f"the models disagree on {key}")
@@ -0,0 +1,67 @@
+import contextlib
+import glob
+import os
+import statistics
+import sys
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from runtpu import runtpu, Observer
+
+# time runtpu.py's main loop on every mullifier example, with no observers
+# and with one that snapshots the UB and accumulators every cycle, which is
+# what the loop always did before observers. reports simulated cycles per
+# second.
+# run from OpenTGPTPU as current directory
+
+base_path = "test/mullifier_examples"
+repeats = 3
+
+# times the cycles between the first on_cycle and on_finish
+class CycleTimer(Observer):
+    def __init__(self):
+        self.start = None
+        self.cycles = 0
+
+    def on_cycle(self, view):
+        if self.start is None:
+            self.start = time.perf_counter()
+
+    def on_finish(self, view):
+        self.elapsed = time.perf_counter() - self.start
+        self.cycles = view.cycle
+
+# reads both memories every cycle
+class SnapshotMemories(Observer):
+    def on_cycle(self, view):
+        view.ubuffer()
+        view.accumulators()
+
+# run one example `repeats` times and return (cycles, best cycles/s)
+def bench(test_path, observers):
+    best = 0
+    for _ in range(repeats):
+        timer = CycleTimer()
+        with open(os.devnull, 'w') as devnull, \
+             contextlib.redirect_stdout(devnull):
+            runtpu(f"{test_path}/open_tpu.out", f"{test_path}/input.npy",
+                   f"{test_path}/weights.npy", 32, 8, test_path,
+                   output_trace=False, observers=observers + [timer])
+        best = max(best, timer.cycles / timer.elapsed)
+    return timer.cycles, best
+
+
+if __name__ == "__main__":
+    print(f"{'example':<24}{'cycles':>8}{'snapshots c/s':>16}{'none c/s':>12}")
+    rates = {"snapshots": [], "none": []}
+    for tf in sorted(glob.glob(f"{base_path}/[a-z]*/")):
+        name = tf.split('/')[-2]
+        test_path = f"{base_path}/{name}"
+        cycles, with_snapshots = bench(test_path, [SnapshotMemories()])
+        _, without = bench(test_path, [])
+        rates["snapshots"].append(with_snapshots)
+        rates["none"].append(without)
+        print(f"{name:<24}{cycles:>8}{with_snapshots:>16.0f}{without:>12.0f}", flush=True)
+
+    print(f"{'median':<32}{statistics.median(rates['snapshots']):>16.0f}"
+          f"{statistics.median(rates['none']):>12.0f}")
@@ -0,0 +1,62 @@
+import contextlib
+import glob
+import os
+import statistics
+import sys
+import tempfile
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from assembler import assemble
+from sim import TPUSim, Verbosity
+
+# time sim.py on every mullifier example at each verbosity level and report
+# instructions per second. Verbosity.FULL matches the old always-print
+# behaviour, so the FULL column is the "before" number.
+# run from OpenTGPTPU as current directory
+
+base_path = "test/mullifier_examples"
+repeats = 5
+
+# run one example `repeats` times and return (instructions retired, best time)
+def bench(test_path, verbosity, output_folder):
+    best = None
+    for _ in range(repeats):
+        sim = TPUSim(f"{test_path}/open_tpu.out", f"{test_path}/input.npy",
+                     f"{test_path}/weights.npy", bitwidth=32, matsize=8,
+                     output_folder=output_folder, verbosity=verbosity)
+        with open(os.devnull, 'w') as devnull, \
+             contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            sim.run()
+            elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(sim.pc_history), best
+
+
+if __name__ == "__main__":
+    levels = list(Verbosity)
+    header = f"{'example':<24}{'instrs':>8}" \
+           + "".join(f"{v.name.lower() + ' i/s':>18}" for v in levels)
+    print(header)
+
+    test_folders = sorted(glob.glob(f"{base_path}/[a-z]*/"))
+    rates = {v: [] for v in levels}
+    with tempfile.TemporaryDirectory() as output_folder:
+        for tf in test_folders:
+            name = tf.split('/')[-2]
+            test_path = f"{base_path}/{name}"
+            if not os.path.exists(f"{test_path}/open_tpu.out"):
+                assemble(f"{test_path}/open_tpu.a", 0)
+
+            row = ""
+            for v in levels:
+                instrs, elapsed = bench(test_path, v, output_folder)
+                rates[v].append(instrs / elapsed)
+                row += f"{instrs / elapsed:>18.0f}"
+            print(f"{name:<24}{instrs:>8}" + row)
+
+    # the median keeps bfsbig, whose run is dominated by saving its huge host
+    # memory, from swamping the comparison
+    print(f"{'median':<32}"
+          + "".join(f"{statistics.median(r):>18.0f}" for r in rates.values()))
@@ -0,0 +1,63 @@
+import contextlib
+import glob
+import io
+import shutil
+import sys
+import os
+import tempfile
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import config
+from assembler import assemble_text
+from runtpu import runtpu
+from cyclesim import cyclesim
+from utils import load_and_compare_all_mems
+
+# run every mullifier example through runtpu.py and cyclesim.py and check that
+# both report the same cycle count and final memories. set HAZARD_DETECTION in
+# config.py to pick the design. the programs are assembled and the results
+# written in a temporary folder, so the example folders are left as they are
+# run from anywhere. exits with 1 on a mismatch, or if no examples were found
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+
+# run one simulator quietly and return (its last line of output, time taken)
+def run_quietly(fn, *args, **kwargs):
+    out = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        fn(*args, **kwargs)
+    return out.getvalue().strip().splitlines()[-1], time.perf_counter() - start
+
+
+failed = []
+output_folder = tempfile.mkdtemp()
+test_folders = sorted(glob.glob(f"{base_path}/[a-z]*/"))
+for tf in test_folders:
+    name = tf.split('/')[-2]
+    test_path = f"{base_path}/{name}"
+    with open(f"{test_path}/open_tpu.a") as f:
+        binary = assemble_text(f.read())
+    with open(f"{output_folder}/open_tpu.out", "wb") as f:
+        f.write(binary)
+    files = (f"{output_folder}/open_tpu.out", f"{test_path}/input.npy",
+             f"{test_path}/weights.npy", 32, 8, output_folder)
+
+    rtl_line, rtl_time = run_quietly(runtpu, *files, output_trace=False)
+    cs_line, cs_time = run_quietly(cyclesim, *files,
+                                   hazard_detection=config.HAZARD_DETECTION)
+    with contextlib.redirect_stdout(io.StringIO()):
+        same_mems = load_and_compare_all_mems(output_folder, "runtpu",
+                                              output_folder, "cyclesim")
+
+    ok = same_mems and rtl_line == cs_line
+    if not ok:
+        failed.append(name)
+    print(f"{name:<24}{'ok' if ok else 'MISMATCH':<10}"
+          f"{cs_line.split()[-1]:>8} cycles{rtl_time:>10.2f}s{cs_time:>10.2f}s")
+
+shutil.rmtree(output_folder)
+print(f"{len(test_folders) - len(failed)}/{len(test_folders)} match",
+      f"(failed: {', '.join(failed)})" if failed else "")
+sys.exit(1 if failed or not test_folders else 0)
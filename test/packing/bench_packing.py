@@ -0,0 +1,57 @@
+# benchmark for packing.py against the element-by-element code in reference.py,
+# building and reading back host memory images the way runtpu.py does
+# run from anywhere: python bench_packing.py [rows ...]
+import os
+import sys
+import time
+
+import numpy as np
+
+# add base folder (OPENTGPTPU) to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import packing
+import reference
+
+row_counts = [1024, 16384, 131072]
+matsizes = [8, 32]
+bitwidths = [8, 16, 32]
+
+def best_time(f, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        f()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# time packing a (rows, matsize) host memory into its image and unpacking it
+# back to an array. returns the four times and the speedups
+def bench(rows, matsize, bitwidth):
+    rng = np.random.default_rng(0)
+    hostarray = rng.integers(-2**(bitwidth-1), 2**(bitwidth-1), (rows, matsize))
+    repeats = 3 if rows * matsize <= 2**20 else 1
+
+    old_pack = best_time(lambda: {a: reference.concat_vec(vec, bitwidth)
+                                  for a, vec in enumerate(hostarray)}, repeats)
+    new_pack = best_time(lambda: dict(enumerate(packing.pack_rows(hostarray, bitwidth))),
+                         repeats)
+    hostmem = dict(enumerate(packing.pack_rows(hostarray, bitwidth)))
+    old_unpack = best_time(lambda: np.array(reference.mem_to_rows(hostmem, bitwidth, matsize)),
+                           repeats)
+    new_unpack = best_time(lambda: packing.mem_to_rows(hostmem, bitwidth, matsize), repeats)
+    return old_pack, new_pack, old_unpack, new_unpack
+
+
+if __name__ == "__main__":
+    counts = [int(r) for r in sys.argv[1:]] or row_counts
+    print(f"{'rows':>8}{'matsize':>9}{'bits':>6}"
+          f"{'pack old':>12}{'pack new':>12}{'speedup':>9}"
+          f"{'unpack old':>12}{'unpack new':>12}{'speedup':>9}")
+    for rows in counts:
+        for matsize in matsizes:
+            for bitwidth in bitwidths:
+                op, np_, ou, nu = bench(rows, matsize, bitwidth)
+                print(f"{rows:>8}{matsize:>9}{bitwidth:>6}"
+                      f"{op:>11.3f}s{np_:>11.3f}s{op/np_:>8.1f}x"
+                      f"{ou:>11.3f}s{nu:>11.3f}s{ou/nu:>8.1f}x", flush=True)
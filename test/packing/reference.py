@@ -0,0 +1,54 @@
+# the element-by-element packing runtpu.py used before packing.py, kept to
+# check packing.py against and to compare speeds
+
+
+def concat_vec(vec, bitwidth):
+    t = 0
+    mask = int('1'*bitwidth, 2)
+    for x in reversed(vec):
+        t = (t<<bitwidth) | (int(x) & mask)
+    return t
+
+def concat_tile(tile, bitwidth):
+    val = 0
+    mask = int('1'*bitwidth, 2)
+    for row in tile:
+        for x in row:
+            val = (val<<bitwidth) | (int(x) & mask)
+    return val
+
+def make_vec_2(value, bitwidth, matsize):
+    vec = []
+    mask = int('1'*bitwidth, 2)
+    for i in range(matsize):
+        vec.append(value & mask)
+        value = value >> bitwidth
+    return list(vec)
+
+def make_tile(value, bitwidth, matsize):
+    tile = [[0] * matsize for _ in range(matsize)]
+    mask = int('1'*bitwidth, 2)
+    for i in range(matsize-1, -1, -1):
+        for j in range(matsize-1, -1, -1):
+            tile[i][j] = value & mask
+            value = value >> bitwidth
+    return tile
+
+# hostmem_to_np and ubuffer_to_np
+def mem_to_rows(mem, bitwidth, matsize, row_count=0):
+    keys = sorted(mem.keys())
+    if len(keys) > 0:
+        row_count = max(row_count, keys[-1]+1)
+    rows = [[0] * matsize for _ in range(row_count)]
+    for k in keys:
+        rows[k] = make_vec_2(mem[k], bitwidth, matsize)
+    return rows
+
+# weightsmem_to_np
+def mem_to_tiles(mem, bitwidth, matsize):
+    keys = sorted(mem.keys())
+    tiles = [[[0] * matsize for _ in range(matsize)]
+             for _ in range(keys[-1]+1 if keys else 0)]
+    for k in keys:
+        tiles[k] = make_tile(mem[k], bitwidth, matsize)
+    return tiles
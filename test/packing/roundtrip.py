@@ -0,0 +1,109 @@
+# randomized checks of packing.py: packing agrees with the element-by-element
+# code in reference.py, and unpacking gives back the packed values (mod
+# 2^bitwidth). prints each failure and exits with 1 if there were any
+# run from anywhere: python roundtrip.py [trials]
+import os
+import sys
+
+import numpy as np
+
+# add base folder (OPENTGPTPU) to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import packing
+import reference
+
+# 8/16/32 are what runtpu is run with, the others take the bit-array path
+bitwidths = [8, 16, 32, 4, 12, 64]
+matsizes = [1, 2, 4, 8, 16, 32]
+trials = 50
+
+failures = 0
+
+def check(ok, what):
+    global failures
+    if not ok:
+        failures += 1
+        print(f"FAIL: {what}")
+
+# random values across the full signed and unsigned range of bitwidth, some
+# out of range, and as ints or floats
+def random_values(rng, shape, bitwidth):
+    lo, hi = -(1 << (bitwidth-1)), 1 << bitwidth
+    if bitwidth == 64:
+        values = rng.integers(-2**63, 2**63, shape, dtype=np.int64)
+    else:
+        values = rng.integers(lo * 2, hi * 2, shape, dtype=np.int64)
+    if bitwidth < 53 and rng.random() < 0.25:
+        values = values + rng.random(shape).round(1)
+    return values
+
+# what the values should unpack as
+def wrapped(values, bitwidth):
+    return [[int(x) % (1 << bitwidth) for x in row] for row in values.tolist()]
+
+def check_rows(rng, bitwidth, matsize):
+    rows = random_values(rng, (int(rng.integers(0, 20)), matsize), bitwidth)
+    what = f"rows bitwidth={bitwidth} matsize={matsize}"
+    packed = packing.pack_rows(rows, bitwidth)
+    check(packed == [reference.concat_vec(r, bitwidth) for r in rows], f"pack {what}")
+
+    unpacked = packing.unpack_rows(packed, bitwidth, matsize)
+    check(unpacked.dtype == np.uint64 and unpacked.shape == rows.shape, f"shape {what}")
+    check(unpacked.tolist() == wrapped(rows, bitwidth), f"round trip {what}")
+    check(unpacked.tolist() == [reference.make_vec_2(v, bitwidth, matsize) for v in packed],
+          f"unpack {what}")
+
+    # bits above the row are ignored
+    extra = [v | (int(rng.integers(1, 1000)) << (matsize*bitwidth)) for v in packed]
+    check(np.array_equal(packing.unpack_rows(extra, bitwidth, matsize), unpacked),
+          f"high bits {what}")
+
+def check_tiles(rng, bitwidth, matsize):
+    tiles = random_values(rng, (int(rng.integers(0, 6)), matsize, matsize), bitwidth)
+    what = f"tiles bitwidth={bitwidth} matsize={matsize}"
+    packed = packing.pack_tiles(tiles, bitwidth)
+    check(packed == [reference.concat_tile(t, bitwidth) for t in tiles], f"pack {what}")
+
+    unpacked = packing.unpack_tiles(packed, bitwidth, matsize)
+    check(unpacked.shape == tiles.shape, f"shape {what}")
+    check(unpacked.reshape(len(tiles), matsize*matsize).tolist()
+          == wrapped(tiles.reshape(len(tiles), matsize*matsize), bitwidth),
+          f"round trip {what}")
+    check(unpacked.tolist() == [reference.make_tile(v, bitwidth, matsize) for v in packed],
+          f"unpack {what}")
+
+# memory images with holes, as the simulators return them
+def check_mems(rng, bitwidth, matsize):
+    count = int(rng.integers(0, 20))
+    addrs = rng.choice(64, count, replace=False).tolist()
+    values = packing.pack_rows(random_values(rng, (count, matsize), bitwidth), bitwidth)
+    mem = dict(zip(addrs, values))
+    row_count = int(rng.integers(0, 80))
+    what = f"mem bitwidth={bitwidth} matsize={matsize} rows={row_count} addrs={sorted(addrs)}"
+    rows = packing.mem_to_rows(mem, bitwidth, matsize, row_count)
+    check(rows.dtype == np.int64, f"dtype {what}")
+    # 64-bit values from 2^63 up come back negative
+    check(rows.view(np.uint64).tolist() == reference.mem_to_rows(mem, bitwidth, matsize, row_count),
+          f"rows {what}")
+
+    tiles = packing.pack_tiles(random_values(rng, (count, matsize, matsize), bitwidth),
+                               bitwidth)
+    mem = dict(zip(addrs, tiles))
+    check(packing.mem_to_tiles(mem, bitwidth, matsize).view(np.uint64).tolist()
+          == reference.mem_to_tiles(mem, bitwidth, matsize), f"tiles {what}")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else trials
+    rng = np.random.default_rng(0)
+    for bitwidth in bitwidths:
+        for matsize in matsizes:
+            for _ in range(n):
+                check_rows(rng, bitwidth, matsize)
+                check_tiles(rng, bitwidth, matsize)
+                check_mems(rng, bitwidth, matsize)
+        print(f"bitwidth {bitwidth}: done", flush=True)
+
+    print(f"{failures} failures")
+    sys.exit(1 if failures else 0)
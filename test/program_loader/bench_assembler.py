@@ -0,0 +1,87 @@
+# benchmark for assembling many small programs, as squishtest sweeps and
+# generators do: through .a and .out files one program at a time with every
+# line encoded from scratch (how squishtest.py used assembler.py), against
+# assembler.assemble_many, which keeps everything in memory and encodes each
+# distinct line once, on the programs written out NOP by NOP and with their
+# padding as .org/.align directives. checks all three give the same binaries
+# run from anywhere: python bench_assembler.py [programs]
+import os
+import sys
+import tempfile
+import time
+
+# add base folder (OPENTGPTPU) to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import assembler
+from program import Program, read_program
+
+ctrl_distance = 150
+
+# a distance test like squishtest.py makes: padded setup, two instructions
+# `distance` apart, padded cleanup and HLT. the padding is NOP lines, or
+# directives if `directives` is set
+def make_text(i, directives):
+    matsize = [4, 8, 16][i % 3]
+    distance = i % ctrl_distance + 1
+    setup = [f"RHM 0, 0, {matsize}", f"RW {i % 7}"]
+    instrs = [f"MMC.S 0, 0, {matsize}", f"ACT 0, {matsize}, {matsize}"]
+    cleanup = [f"WHM {matsize}, {matsize}, {matsize}"]
+    if directives:
+        lines = [f".org {ctrl_distance}"]
+        for instr in setup:
+            lines += [instr, f".align {ctrl_distance}"]
+        lines += [f"first: {instrs[0]}", f".org first + {distance}", instrs[1],
+                  f".org first + {2*ctrl_distance}"]
+        for instr in cleanup:
+            lines += [instr, f".align {ctrl_distance}"]
+        return "\n".join(lines + ["HLT"]) + "\n"
+
+    lines = ["NOP"] * ctrl_distance
+    for instr in setup:
+        lines += [instr] + ["NOP"] * (ctrl_distance - 1)
+    lines += [instrs[0]] + ["NOP"] * (distance - 1) + [instrs[1]]
+    lines += ["NOP"] * (2*ctrl_distance - distance - 1)
+    for instr in cleanup:
+        lines += [instr] + ["NOP"] * (ctrl_distance - 1)
+    return "\n".join(lines + ["HLT"]) + "\n"
+
+def through_files(texts, path):
+    binaries = []
+    for i, text in enumerate(texts):
+        assembler.assemble_line.cache_clear()
+        with open(f"{path}/{i}.a", 'w') as f:
+            f.write(text)
+        assembler.assemble(f"{path}/{i}.a", 0)
+        binaries.append(read_program(f"{path}/{i}.out").data)
+    return binaries
+
+def in_memory(texts):
+    assembler.assemble_line.cache_clear()
+    return [Program(binary).data for binary in assembler.assemble_many(texts)]
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    texts = [make_text(i, False) for i in range(count)]
+    short_texts = [make_text(i, True) for i in range(count)]
+    print(f"{count} programs, {sum(map(len, texts))} bytes of assembly, "
+          f"{sum(map(len, short_texts))} with directives")
+
+    with tempfile.TemporaryDirectory() as path:
+        start = time.perf_counter()
+        old = through_files(texts, path)
+        old_time = time.perf_counter() - start
+    start = time.perf_counter()
+    new = in_memory(texts)
+    new_time = time.perf_counter() - start
+    start = time.perf_counter()
+    short = in_memory(short_texts)
+    short_time = time.perf_counter() - start
+
+    print(f"through files:            {old_time:8.2f}s")
+    print(f"assemble_many:            {new_time:8.2f}s  ({old_time / new_time:.1f}x)")
+    print(f"assemble_many, directives:{short_time:8.2f}s  ({old_time / short_time:.1f}x)")
+    if not old == new == short:
+        print("the binaries differ")
+        sys.exit(1)
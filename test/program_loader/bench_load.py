@@ -0,0 +1,67 @@
+# benchmark for program.py's loader against the byte-at-a-time list.pop(0)
+# loop runtpu.py used before it, on squishtest-style programs (an instruction
+# every 151 words, NOPs in between)
+# run from anywhere: python bench_load.py [instructions ...]
+import os
+import sys
+import tempfile
+import time
+
+# add base folder (OPENTGPTPU) to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from assembler import assemble
+from program import read_program
+
+# 4096 fills IMem. the longer ones show how each loader scales
+lengths = [512, 4096, 16384]
+nop_distance = 150
+
+# the loop runtpu.py used before program.py
+def old_load(path):
+    with open(path, 'rb') as f:
+        ins = [x for x in f.read()]
+    instrs = []
+    width = 14
+    for i in range(int(len(ins)/width)):
+        val = 0
+        for j in range(int(width)):
+            val = (val << 8) | ins.pop(0)
+        instrs.append(val)
+    return instrs
+
+def new_load(path):
+    return read_program(path).words
+
+def make_program(path, length):
+    body = ["RHM 0, 0, 8", "RW 0", "MMC.S 0, 0, 8", "ACT 0, 8, 8", "WHM 8, 8, 8"]
+    lines = []
+    while len(lines) < length - 1:
+        lines += [body[len(lines) % len(body)]] + ["NOP"] * nop_distance
+    lines = lines[:length - 1] + ["HLT"]
+    with open(f"{path}/bench.a", 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    assemble(f"{path}/bench.a", 0)
+    return f"{path}/bench.out"
+
+def best_time(f, repeats=3):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = f()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or lengths
+    print(f"{'instructions':>14}{'pop(0)':>12}{'program.py':>12}{'speedup':>10}")
+    for length in sizes:
+        with tempfile.TemporaryDirectory() as path:
+            prog = make_program(path, length)
+            old, old_words = best_time(lambda: old_load(prog))
+            new, new_words = best_time(lambda: new_load(prog))
+            if old_words != new_words:
+                print(f"{length}: the loaders disagree")
+            print(f"{length:>14}{old*1000:>10.1f}ms{new*1000:>10.2f}ms{old/new:>9.0f}x",
+                  flush=True)
@@ -0,0 +1,112 @@
+# assemble every .a file under test/ and read the binaries back with
+# program.py: the program has one instruction per line of code, the opcodes,
+# flags and operands decode to what the source says, and the IMem words are
+# the same decoded fields put back together. then sources that have to be
+# rejected must raise AssemblyError. prints each mismatch and exits with 1 if
+# there were any
+# run from anywhere: python check_assembler.py
+import glob
+import os
+import shutil
+import sys
+import tempfile
+
+# add base folder (OPENTGPTPU) to sys.path
+base = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.append(base)
+
+import isa
+from assembler import AssemblyError, assemble, assemble_text, format_instr
+from program import read_program
+
+# sources the assembler has to reject
+bad_sources = [
+    "NOP\n.align 0\nHLT\n",
+    "NOP\n.align -4\nHLT\n",
+]
+
+# the source's code lines as (opcode, flag letters, operands)
+def source_instrs(path):
+    instrs = []
+    with open(path) as f:
+        for line in f:
+            line = line.partition('#')[0]
+            if not line.strip():
+                continue
+            mnemonic, _, operands = line.strip().partition(' ')
+            opcode, _, flags = mnemonic.partition('.')
+            instrs.append((opcode, flags,
+                           [int(op.strip(), 0) for op in operands.split(',') if op.strip()]))
+    return instrs
+
+# what the assembler should have put in each field for one source line
+def expected_fields(opcode, flags, operands):
+    flag = 0
+    for letter, mask in [('S', isa.SWITCH_MASK), ('C', isa.CONV_MASK), 
+                         ('O', isa.OVERWRITE_MASK), ('Q', isa.FUNC_SIGMOID_MASK),
+                         ('R', isa.FUNC_RELU_MASK)]:
+        if letter in flags:
+            flag |= mask
+    if opcode in ('NOP', 'HLT'):
+        return 0, 0, 0, 0
+    if opcode == 'RW':
+        return flag, 0, operands[0], 0
+    if opcode in ('RHM', 'ACT'):
+        return flag, operands[2], operands[0], operands[1]
+    return flag, operands[2], operands[1], operands[0]
+
+def check(path, tmp):
+    errors = []
+    src = os.path.join(tmp, os.path.basename(path))
+    shutil.copy(path, src)
+    try:
+        assemble(src, 0)
+    except Exception:
+        return None
+    program = read_program(src[:src.rfind('.')] + '.out')
+    instrs = source_instrs(path)
+    if len(program) != len(instrs):
+        return [f"{len(program)} instructions, {len(instrs)} lines of code"]
+
+    fields = program.fields
+    for pc, ((opcode, flags, operands), word) in enumerate(zip(instrs, program.words)):
+        op, flag, length, addr, ubaddr = (int(fields[name][pc]) for name in
+                                          ('op', 'flags', 'len', 'addr', 'ubaddr'))
+        if isa.BIN2OPCODE[op] != opcode:
+            errors.append(f"PC {pc}: decoded {isa.BIN2OPCODE[op]}, source has {opcode}")
+        elif (flag, length, addr, ubaddr) != expected_fields(opcode, flags, operands):
+            errors.append(f"PC {pc}: decoded fields don't match {opcode} {operands}")
+        if word != format_instr(op, flag, length, addr, ubaddr):
+            errors.append(f"PC {pc}: IMem word doesn't match the decoded fields")
+    return errors
+
+
+if __name__ == "__main__":
+    failures = skipped = checked = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in sorted(glob.glob(f"{base}/test/**/*.a", recursive=True)):
+            name = os.path.relpath(path, base)
+            errors = check(path, tmp)
+            if errors is None:
+                skipped += 1
+                continue
+            checked += 1
+            for e in errors:
+                failures += 1
+                print(f"{name}: {e}")
+
+    for text in bad_sources:
+        try:
+            assemble_text(text)
+        except AssemblyError:
+            continue
+        except Exception as e:
+            failures += 1
+            print(f"{text!r}: {type(e).__name__} instead of AssemblyError")
+            continue
+        failures += 1
+        print(f"{text!r}: assembled, should have raised AssemblyError")
+
+    print(f"{checked} programs checked, {skipped} that don't assemble skipped, "
+          f"{len(bad_sources)} bad sources, {failures} mismatches")
+    sys.exit(1 if failures else 0)
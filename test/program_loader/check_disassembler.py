@@ -0,0 +1,76 @@
+# checks that disassembling a binary and assembling the result gives back the
+# same binary, for every .out in the test tree, every .a in it (assembled in
+# memory), and random 14-byte words, which mostly aren't instructions the
+# assembler can write and so come out as .word
+# run from anywhere: python check_disassembler.py [random words]
+import glob
+import os
+import random
+import sys
+import time
+
+# add base folder (OPENTGPTPU) to sys.path
+BASE = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.append(BASE)
+
+import assembler
+import disassembler
+from isa import INSTRUCTION_WIDTH_BYTES, OPCODE2BIN
+from program import map_program
+
+def check(name, data, failures):
+    pc = disassembler.round_trip(data)
+    if pc is not None:
+        failures.append(f"{name}: differs at PC {pc}")
+
+# random words: a mix of valid opcodes with random fields and fully random words
+def random_words(count, seed=0):
+    rng = random.Random(seed)
+    opcodes = [int(op[0]) for op in OPCODE2BIN.values()]
+    words = []
+    for _ in range(count):
+        w = rng.getrandbits(8 * INSTRUCTION_WIDTH_BYTES)
+        if rng.random() < 0.5:
+            top = 8 * (INSTRUCTION_WIDTH_BYTES - 1)
+            w = (w & ((1 << top) - 1)) | rng.choice(opcodes) << top
+            if rng.random() < 0.5:
+                # keep only the fields instructions use
+                w &= ~(0xff << (top - 8)) | (rng.getrandbits(4) << (top - 8))
+        words.append(w.to_bytes(INSTRUCTION_WIDTH_BYTES, assembler.ENDIANNESS))
+    return b"".join(words)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    failures = []
+    start = time.perf_counter()
+
+    outs = sorted(glob.glob(f"{BASE}/test/**/*.out", recursive=True))
+    binaries = 0
+    for path in outs:
+        if os.path.getsize(path) % INSTRUCTION_WIDTH_BYTES:
+            continue  # not a program binary
+        check(os.path.relpath(path, BASE), map_program(path).tobytes(), failures)
+        binaries += 1
+
+    sources = sorted(glob.glob(f"{BASE}/test/**/*.a", recursive=True))
+    skipped = 0
+    for path in sources:
+        with open(path) as f:
+            try:
+                data = assembler.assemble_text(f.read())
+            except (ValueError, IndexError, KeyError):
+                skipped += 1  # sources the assembler doesn't take (notes, sketches)
+                continue
+        check(os.path.relpath(path, BASE), data, failures)
+
+    check("random words", random_words(count), failures)
+
+    elapsed = time.perf_counter() - start
+    print(f"{binaries} binaries, {len(sources) - skipped} sources ({skipped} that don't "
+          f"assemble skipped) and {count} random words "
+          f"round-tripped in {elapsed:.2f}s")
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
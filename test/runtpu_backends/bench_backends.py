@@ -0,0 +1,103 @@
+# benchmark for runtpu.py's simulation backends
+# run from anywhere: python bench_backends.py [matsize ...]
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# add base folder (OPENTGPTPU) to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+import runtpu
+from assembler import assemble
+
+matsizes = [4, 8, 16, 32]
+backends = ["fast", "compiled"]
+bitwidth = 32
+rows = 64
+# without hazard detection the TPU issues one instruction per cycle, so the
+# program fills most of IMem to run for a few thousand cycles
+program_length = 4000
+
+# write a program that loops RHM, RW, MMC, ACT and WHM over `rows` rows, with
+# NOPs between them so each one has finished before the next starts, plus a
+# host memory and weights for it. returns the file names
+def make_workload(path, matsize):
+    pad = ["NOP"] * (rows + 2*matsize + 8)
+    block = []
+    for instr in [f"RHM 0, 0, {rows}", "RW 0", f"MMC.S 0, 0, {rows}",
+                  f"ACT 0, {rows}, {rows}", f"WHM {rows}, {rows}, {rows}"]:
+        block += [instr] + pad
+    lines = block * (program_length // len(block)) + ["HLT"]
+    with open(f"{path}/bench.a", 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    assemble(f"{path}/bench.a", 0)
+
+    rng = np.random.default_rng(0)
+    np.save(f"{path}/hostmem.npy",
+            rng.integers(-128, 128, (2*rows, matsize)).astype(np.int32))
+    np.save(f"{path}/weights.npy",
+            rng.integers(-128, 128, (1, matsize, matsize)).astype(np.int32))
+    return f"{path}/bench.out", f"{path}/hostmem.npy", f"{path}/weights.npy"
+
+# count the sim.steps and record the time of the first and last, so the rate
+# leaves out building and compiling the design and saving the results
+@contextlib.contextmanager
+def time_steps(times):
+    patched = [runtpu.FastSimulation, runtpu.WriteTrackingSimulation]
+    originals = [cls.step for cls in patched]
+
+    def timed(step):
+        def wrapper(self, *args, **kwargs):
+            times.setdefault("first", time.perf_counter())
+            step(self, *args, **kwargs)
+            times["last"] = time.perf_counter()
+            times["steps"] = times.get("steps", 0) + 1
+        return wrapper
+
+    for cls, step in zip(patched, originals):
+        cls.step = timed(step)
+    try:
+        yield
+    finally:
+        for cls, step in zip(patched, originals):
+            cls.step = step
+
+# run the workload on one backend. returns (cycles, cycles/s, setup seconds)
+def bench(files, matsize, backend, output_folder):
+    times = {}
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, \
+         contextlib.redirect_stdout(devnull), time_steps(times):
+        runtpu.runtpu(*files, bitwidth, matsize, output_folder,
+                      output_trace=False, backend=backend)
+    # runtpu doesn't count its first step as a cycle
+    cycles = times["steps"] - 1
+    return cycles, cycles / (times["last"] - times["first"]), times["first"] - start
+
+
+if __name__ == "__main__":
+    sizes = [int(m) for m in sys.argv[1:]] or matsizes
+    if not runtpu.compiled_sim_available():
+        print("gcc or a 64-bit Python is missing, only timing the fast backend")
+        backends = ["fast"]
+
+    print(f"{'matsize':<10}{'cycles':>8}"
+          + "".join(f"{b + ' setup':>16}{b + ' cyc/s':>16}" for b in backends))
+    for matsize in sizes:
+        with tempfile.TemporaryDirectory() as path:
+            files = make_workload(path, matsize)
+            row = ""
+            results = {}
+            for b in backends:
+                cycles, rate, setup = bench(files, matsize, b, f"{path}/{b}")
+                results[b] = np.load(f"{path}/{b}/runtpu.npz")
+                row += f"{setup:>15.1f}s{rate:>16.0f}"
+            for key in results[backends[0]].files:
+                if any(not np.array_equal(results[backends[0]][key], results[b][key])
+                       for b in backends):
+                    print(f"matsize {matsize}: the backends disagree on {key}")
+            print(f"{matsize:<10}{cycles:>8}" + row, flush=True)
@@ -0,0 +1,67 @@
+# checks that runtpu's backends can take turns in one process. the netlist is
+# elaborated once and shared by every run, the compiled backend adds Outputs
+# to it the first time it runs, and the fast backend reuses the function it
+# generated, so a fast run after a compiled one must see the new block. each
+# example runs fast, compiled, fast with a trace, compiled with a trace and
+# fast again, and every run must save the memories and cycle count the first
+# one did
+# run from anywhere, with either setting of HAZARD_DETECTION in config.py:
+#   python check_backend_mix.py [example ...]   (default: test_add, test_fib, bfstiny)
+import contextlib
+import os
+import sys
+import tempfile
+
+# add base folder (OPENTGPTPU) to sys.path
+base = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.append(base)
+
+from assembler import assemble_text
+from runtpu import Observer, compiled_sim_available, runtpu
+from utils import compare_all_mems
+
+runs = [("fast", False), ("compiled", False), ("fast", True), ("compiled", True), ("fast", False)]
+
+# records the cycle the TPU halted at
+class Cycles(Observer):
+    def on_finish(self, view):
+        self.cycles = view.cycle
+
+def run(binary, test_path, backend, trace):
+    cycles = Cycles()
+    with tempfile.TemporaryDirectory() as output_folder, \
+            open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        mems = runtpu(binary, f"{test_path}/input.npy", f"{test_path}/weights.npy", 32, 8,
+                      output_folder, trace, backend=backend, observers=[cycles])
+    return mems, cycles.cycles
+
+
+if __name__ == "__main__":
+    if not compiled_sim_available():
+        sys.exit("The compiled backend needs gcc and a 64-bit Python.")
+    names = sys.argv[1:] or ["test_add", "test_fib", "bfstiny"]
+
+    failures = []
+    for name in names:
+        test_path = f"{base}/test/mullifier_examples/{name}"
+        with open(f"{test_path}/open_tpu.a") as f:
+            binary = assemble_text(f.read())
+        first = None
+        for backend, trace in runs:
+            label = f"{name}: {backend}{' with a trace' if trace else ''}"
+            try:
+                mems, cycles = run(binary, test_path, backend, trace)
+            except Exception as e:
+                failures.append(f"{label}: {type(e).__name__}: {e}")
+                continue
+            if first is None:
+                first = mems, cycles
+            elif cycles != first[1] or not compare_all_mems(*mems, *first[0]):
+                failures.append(f"{label}: differs from the first run")
+        print(f"{name:<24}{first[1] if first else '-':>8} cycles")
+
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+    print(f"{len(names)} examples, {len(runs)} runs each, all the same")
@@ -0,0 +1,78 @@
+# checks that fast-backend runs started warm (WarmFastSimulation reusing the
+# sim_func an earlier run of the same netlist generated) save the same
+# memories and cycle count as runs started cold. each example runs cold (the
+# netlist's fast_sim_func dropped first), warm twice, and with the warm path
+# turned off as if runtpu.warm_fast_sim_supported() had said no. exits with 1
+# if the probe turns the warm path down for the installed pyrtl, since then
+# no run starts warm
+# run from anywhere, with either setting of HAZARD_DETECTION in config.py:
+#   python check_warm_sim.py [example ...]
+#   (default: test_add, test_fib, test_rec_fib, bfstiny, insertion_sort10)
+import contextlib
+import os
+import sys
+import tempfile
+
+# add base folder (OPENTGPTPU) to sys.path
+base = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.append(base)
+
+import runtpu
+from assembler import assemble_text
+from utils import compare_all_mems
+
+MATSIZE, BITWIDTH = 8, 32
+
+# records the cycle the TPU halted at
+class Cycles(runtpu.Observer):
+    def on_finish(self, view):
+        self.cycles = view.cycle
+
+# a run started the way `start` says: "cold", "warm" or "unsupported"
+def run(binary, test_path, start):
+    netlist = runtpu.get_netlist(MATSIZE, BITWIDTH)
+    if start == "cold":
+        netlist.fast_sim_func = None
+    runtpu._warm_fast_sim_supported = None if start != "unsupported" else False
+    sim_func = netlist.fast_sim_func
+    cycles = Cycles()
+    with tempfile.TemporaryDirectory() as output_folder, \
+            open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        mems = runtpu.runtpu(binary, f"{test_path}/input.npy", f"{test_path}/weights.npy",
+                             BITWIDTH, MATSIZE, output_folder, False, backend="fast",
+                             observers=[cycles])
+    runtpu._warm_fast_sim_supported = None
+    # a cold run generates a new sim_func and keeps it in the netlist
+    warm = sim_func is not None and netlist.fast_sim_func is sim_func
+    return mems, cycles.cycles, warm
+
+
+if __name__ == "__main__":
+    if not runtpu.warm_fast_sim_supported():
+        sys.exit("WarmFastSimulation doesn't match this pyrtl's FastSimulation, "
+                 "so every run starts cold.")
+    names = sys.argv[1:] or ["test_add", "test_fib", "test_rec_fib", "bfstiny",
+                             "insertion_sort10"]
+    starts = ["cold", "warm", "warm", "unsupported"]
+
+    failures = []
+    for name in names:
+        test_path = f"{base}/test/mullifier_examples/{name}"
+        with open(f"{test_path}/open_tpu.a") as f:
+            binary = assemble_text(f.read())
+        first = None
+        for start in starts:
+            mems, cycles, warm = run(binary, test_path, start)
+            if warm != (start == "warm"):
+                failures.append(f"{name}: a {start} run started {'warm' if warm else 'cold'}")
+            if first is None:
+                first = mems, cycles
+            elif cycles != first[1] or not compare_all_mems(*mems, *first[0]):
+                failures.append(f"{name}: the {start} run differs from the cold one")
+        print(f"{name:<24}{first[1]:>8} cycles")
+
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+    print(f"{len(names)} examples, {len(starts)} runs each, all the same")
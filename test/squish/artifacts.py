@@ -0,0 +1,115 @@
+# a content-addressed store for the artifacts squishtests make: assembled
+# programs, the memories runtpu.py and sim.py end with, and the checkpoints
+# taken at the end of a distance test's shared prefix. everything lives in
+# one SQLite file per test folder instead of a directory tree per test.
+#
+# an artifact is keyed by a hash of everything that decides its contents
+# (see artifact_key): the assembly text, the host memory, weights, bitwidth
+# and matsize it's run with, the simulator and assembler sources and the
+# values in config.py. so identical programs under different test names are
+# assembled and simulated once, and a changed program, simulator or config
+# never reads back an old result
+
+import hashlib
+import io
+import os
+import sqlite3
+import sys
+from typing import Dict, Optional
+
+import numpy as np
+
+# add base folder (OPENTGPTPU) to sys.path
+base_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.append(base_folder)
+
+import config
+from runtpu import HARDWARE_SOURCES
+
+# the files, besides the hardware ones, whose changes can change an artifact
+SIMULATOR_SOURCES = HARDWARE_SOURCES + ["assembler.py", "runtpu.py", "sim.py",
+                                        "program.py", "packing.py",
+                                        "memmodels.py", "checkpoint.py"]
+
+# a hash of the simulator sources and config.py's values, computed once per
+# process
+_version = None
+
+def simulator_version() -> str:
+    global _version
+    if _version is None:
+        h = hashlib.sha256()
+        for name in SIMULATOR_SOURCES:
+            with open(os.path.join(base_folder, name), 'rb') as f:
+                h.update(name.encode() + b"\0" + f.read() + b"\0")
+        for name in sorted(vars(config)):
+            if name.isupper():
+                h.update(f"{name}={getattr(config, name)!r}\n".encode())
+        _version = h.hexdigest()
+    return _version
+
+# the key of an artifact made from `text` (assembly, possibly cut short to a
+# prefix) and `parts`: whatever else decides it, such as the host memory,
+# weights, bitwidth and matsize a program is run with, or the cycle a
+# checkpoint is taken at. arrays are hashed by dtype, shape and contents
+def artifact_key(text: str, *parts) -> str:
+    h = hashlib.sha256()
+    h.update(simulator_version().encode())
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(f"{part.dtype.str} {part.shape}\n".encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        else:
+            h.update(f"{part!r}\n".encode())
+    h.update(text.encode())
+    return h.hexdigest()
+
+def arrays_to_bytes(**arrays) -> bytes:
+    buf = io.BytesIO()
+    np.savez_compressed(buf, **arrays)
+    return buf.getvalue()
+
+def bytes_to_arrays(data: bytes) -> Dict[str, np.ndarray]:
+    with np.load(io.BytesIO(data)) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+# the store, at `path`. artifacts are grouped by kind ("binary", "runtpu",
+# "sim", "runtpu_checkpoint", "sim_checkpoint") and looked up by key. many
+# sweep workers can share one store: SQLite serializes their writes, and a
+# write that loses a race to an identical one changes nothing
+class ArtifactStore(object):
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=300)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS artifacts (kind TEXT, key TEXT, "
+                        "data BLOB, PRIMARY KEY (kind, key))")
+        self.db.commit()
+
+    def get(self, kind: str, key: str) -> Optional[bytes]:
+        row = self.db.execute("SELECT data FROM artifacts WHERE kind = ? AND key = ?",
+                              (kind, key)).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, kind: str, key: str, data: bytes):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?)",
+                            (kind, key, data))
+
+    # the memories saved under this key, in TPUSim.get_mems / runtpu order,
+    # or None
+    def get_mems(self, kind: str, key: str):
+        data = self.get(kind, key)
+        if data is None:
+            return None
+        arrays = bytes_to_arrays(data)
+        return tuple(arrays[m] for m in ["hm", "wm", "ub", "wq", "acc"])
+
+    def put_mems(self, kind: str, key: str, mems):
+        hm, wm, ub, wq, acc = mems
+        self.put(kind, key, arrays_to_bytes(hm=hm, wm=wm, ub=ub, wq=wq, acc=acc))
+
+    def close(self):
+        self.db.close()
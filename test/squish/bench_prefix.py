@@ -0,0 +1,118 @@
+# benchmark for prefix sharing in N-mode squishtests: ParamHandler.n_mode_driver
+# for one parameter set of every instr1_instr2 pair in entry_point.py, run with
+# every distance simulated from cycle 0 and with the shared prefix simulated
+# once and restored. checks that both find the same distance and that every
+# program they ran ended with the same memories
+# run from test/squish, with HAZARD_DETECTION = False in config.py:
+#   python bench_prefix.py [matsize] [instr1_instr2 ...]
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from entry_point import info_map, get_cols, get_i2_addrs, get_lengths
+from test_utils import ParamHandler
+from artifacts import ArtifactStore
+
+# add base folder (OPENTGPTPU) to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from config import HAZARD_DETECTION, UB_ADDR_SIZE
+
+bitwidth = 32
+base_distance = 150
+test_folders = {False: "bench_prefix_full", True: "bench_prefix_shared"}
+
+# a ParamHandler for the first parameter set entry_point.py sweeps for the
+# pair, with the most setup RWs so the prefix is as long as it gets
+def param_handler(instr_pair, matsize, test_folder, share_prefix):
+    info = info_map[instr_pair]
+    instr1, instr2 = instr_pair.split("_")
+    has = {var: var in info["vars"] for var in ["l1", "l2", "hm2", "ub2", "acc2", "col"]}
+    ph = ParamHandler(info["func"], instr1, instr2, bitwidth, matsize, True,
+                      info["setup_rw_cts"][-1], base_distance, test_folder,
+                      UB_ADDR_SIZE, share_prefix=share_prefix)
+    l1 = get_lengths(has["l1"], matsize)[0]
+    l2 = get_lengths(has["l2"], matsize)[0]
+    ph.set_l1(l1)
+    ph.set_l2(l2)
+    ph.set_argl1(info.get("argl1", l1))
+    ph.set_argl2(info.get("argl2", l2))
+    if has["hm2"]:
+        ph.set_hm2(get_i2_addrs(True, l1, l2)[0])
+    if has["ub2"]:
+        ph.set_ub2(get_i2_addrs(True, l1, l2)[0])
+    if has["acc2"]:
+        ph.set_acc2(get_i2_addrs(True, l1, l2)[0])
+    if "flag1" in info:
+        ph.set_flags1(info["flag1"])
+    if "flag2" in info:
+        ph.set_flags2(info["flag2"])
+    if has["col"]:
+        ph.set_col(get_cols(True, matsize)[0])
+    return ph
+
+# run the driver with stdout put back afterwards. returns (its result,
+# seconds taken)
+def timed_driver(ph):
+    stdout = sys.stdout
+    start = time.perf_counter()
+    try:
+        result = ph.n_mode_driver()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return result, time.perf_counter() - start
+
+# the memories runtpu.py and sim.py ended with in every test run into
+# `test_folder`, by (simulator, artifact key). the two test folders' stores
+# key a distance the same way whether its prefix was shared or not
+def store_outputs(test_folder):
+    store = ArtifactStore(f"{os.path.dirname(os.path.abspath(__file__))}/{test_folder}/artifacts.db")
+    outputs = {(kind, key): store.get_mems(kind, key)
+               for kind, key in store.db.execute("SELECT kind, key FROM artifacts "
+                                                 "WHERE kind IN ('runtpu', 'sim')")}
+    store.close()
+    return outputs
+
+if __name__ == "__main__":
+    if HAZARD_DETECTION:
+        print("Set HAZARD_DETECTION = False in config.py, N-mode squishtests need it.")
+        sys.exit(1)
+    matsize = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    pairs = sys.argv[2:] or list(info_map)
+
+    for test_folder in test_folders.values():
+        shutil.rmtree(test_folder, ignore_errors=True)
+    # build the netlist once, so no run below pays for it
+    timed_driver(param_handler(pairs[0], matsize, "bench_prefix_warmup", False))
+    shutil.rmtree("bench_prefix_warmup")
+
+    times = {False: 0, True: 0}
+    differ = 0
+    seen = set()
+    print(f"matsize {matsize}, {len(pairs)} parameter sets, base distance {base_distance}")
+    for pair in pairs:
+        results = {}
+        for share_prefix, test_folder in test_folders.items():
+            ph = param_handler(pair, matsize, test_folder, share_prefix)
+            results[share_prefix], t = timed_driver(ph)
+            times[share_prefix] += t
+        full = store_outputs(test_folders[False])
+        shared = store_outputs(test_folders[True])
+        new = full.keys() - seen
+        seen |= full.keys()
+        same = results[False] == results[True] and full.keys() == shared.keys() and \
+               all(all(np.array_equal(a, b) for a, b in zip(full[k], shared[k])) for k in new)
+        differ += not same
+        print(f"{pair:<10} distance {results[False]:>3} / {results[True]:>3}, "
+              f"{len(new)} new results  {'agree' if same else 'DIFFER'}", flush=True)
+
+    for test_folder in test_folders.values():
+        shutil.rmtree(test_folder)
+    print(f"from cycle 0:   {times[False]:8.2f}s")
+    print(f"shared prefix:  {times[True]:8.2f}s  ({times[False] / times[True]:.2f}x)")
+    print(f"{differ} parameter sets differ")
+    sys.exit(1 if differ else 0)
@@ -8,11 +8,13 @@ import json
 import time
 from pathlib import Path
 from concurrent.futures import ProcessPoolExecutor, as_completed
+from sweep import Journal, Progress, job_cost, pool_size
 
 # add base folder (OPENTGPTPU) to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
 from config import HAZARD_DETECTION, UB_ADDR_SIZE
+from runtpu import warm_up
 
 # maps an (instr1_instr2) pair to:
 #   the parametrized squishtest to call 
@@ -268,6 +270,9 @@ if __name__ == "__main__":
         test_folder = input()
     else:
         test_folder = sys.argv[1]
+    # optional cap on the number of workers, which are otherwise sized to the
+    # host's cores and memory (see sweep.pool_size)
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
 
     if Path(f"{test_folder}/results.json").exists():
         with open(f"{test_folder}/results.json") as result_file:
@@ -275,6 +280,12 @@ if __name__ == "__main__":
     else:
         d = {}
 
+    # every command finished so far is in the journal, so a sweep that was
+    # stopped before writing results.json carries on where it left off
+    os.makedirs(test_folder, exist_ok=True)
+    journal = Journal(f"{test_folder}/journal.jsonl")
+    journaled = {tuple(path): result for path, result in journal.entries()}
+
     # generate all squishtest commands:
 
     # iterate over all valid combinations of instr1_instr2 pairs
@@ -374,43 +385,72 @@ if __name__ == "__main__":
                                                 if not dict_contains_path(d, dict_path_list):
                                                     commands.append((
                                                         ph.get_driver_func(),
-                                                        dict_path_list
+                                                        dict_path_list,
+                                                        job_cost(m, setup_rw_ct, base_distance),
+                                                        (b, m)
                                                     ))
 
     # run the commands
 
     # set up the result dictionary with all the possible paths to store 
-    # beforehand so that the dictionary is always sorted
-    for (_, dict_path) in commands:
-        set_nested_dict(d, dict_path, None)
+    # beforehand so that the dictionary is always sorted. journaled results
+    # go in now, and their commands don't run again
+    for (_, dict_path, _, _) in commands:
+        set_nested_dict(d, dict_path, journaled.get(tuple(dict_path)))
+    if journaled:
+        print(f"Resuming from {journal.path}: "
+              f"{sum(tuple(p) in journaled for (_, p, _, _) in commands)} commands already done.")
+    commands = [c for c in commands if tuple(c[1]) not in journaled]
+
+    # group the commands by the TPU they run on, (bitwidth, matsize). each
+    # group gets its own workers, which build that TPU and its simulation
+    # code once when they start (runtpu.warm_up) and keep them for every 
+    # command they run, instead of each worker building every configuration
+    # as commands of different matsizes come its way
+    groups = {}
+    for command in commands:
+        groups.setdefault(command[3], []).append(command)
 
     print(f"Running squishtests for {len(commands)} commands:")
-    counter = 0
+    progress = Progress([cost for (_, _, cost, _) in commands])
     start_time = time.time()
 
-    # run each command as a separate process with a configurable number of cores
-    with ProcessPoolExecutor(max_workers=154) as executor:
-        future_to_input = {executor.submit(ph_driver): dict_path 
-                           for (ph_driver, dict_path) in commands}
-        
-        for future in as_completed(future_to_input):
-            # as each command completes, add it's result to the global result
-            # dictionary
-            dict_path = future_to_input[future]
-            result = future.result()
-            set_nested_dict(d, dict_path, result)
-
-            # regular progress update with expected completion time
-            # TODO: smarter ETA system that takes the computed matrix sizes into
-            # account
-            counter += 1
-            if counter % 25 == 0:
-                current_time = time.time()
-                elapsed_time = current_time - start_time
-                eta = elapsed_time / counter * (len(commands) - counter)
-                print(f"Completed {counter} out of {len(commands)} commands.", file=sys.stderr)
-                print(f"Time elapsed: {current_time - start_time}s", file=sys.stderr)
-                print(f"Completion ETA: {eta}s\n", file=sys.stderr)
+    # run the most expensive groups, and within them the most expensive 
+    # commands, first, so the sweep doesn't end waiting on a few large tests
+    # started last
+    for (b, m), group in sorted(groups.items(), reverse=True,
+                                key=lambda g: sum(c[2] for c in g[1])):
+        group.sort(key=lambda c: c[2], reverse=True)
+        workers = pool_size([m], max_workers)
+        print(f"b = {b}, m = {m}: {len(group)} commands on {workers} workers", 
+              file=sys.stderr)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=warm_up,
+                                 initargs=(m, b)) as executor:
+            future_to_input = {executor.submit(ph_driver): (dict_path, cost)
+                               for (ph_driver, dict_path, cost, _) in group}
+            
+            try:
+                for future in as_completed(future_to_input):
+                    # as each command completes, add it's result to the 
+                    # global result dictionary and the journal
+                    dict_path, cost = future_to_input[future]
+                    result = future.result()
+                    set_nested_dict(d, dict_path, result)
+                    journal.append(dict_path, result)
+
+                    # regular progress update with throughput and expected 
+                    # completion time
+                    progress.done(cost)
+                    if progress.jobs % 25 == 0:
+                        progress.report()
+            except BaseException:
+                # on Ctrl-C or a failed command, drop the commands that 
+                # haven't started instead of running them all before exiting.
+                # the journal has everything that finished
+                for future in future_to_input:
+                    future.cancel()
+                raise
 
     # final timing
     end_time = time.time()
@@ -433,6 +473,7 @@ if __name__ == "__main__":
     for instr1 in categories[:-1]: # hlt cannot be instr1
         for instr2 in categories:
             instrs = f"{instr1}_{instr2}"
+            os.makedirs(f"{test_folder}/{instrs}", exist_ok=True)
             with open(f"{test_folder}/{instrs}/results.json", "w") as reg_f:
                 json.dump(d[instrs], reg_f, indent=2)
             with open(f"{test_folder}/{instrs}/results_abridged.json", "w") as simp_f:
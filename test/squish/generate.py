@@ -9,6 +9,20 @@ def get_hostmem_filename(path, bitwidth, matsize):
     return os.path.join(path, f"hostmem_{bitwidth}b_{matsize}m.npy")
 
 
+# the weights make_weights saves: tile i counts up from i*matsize**2 + 1
+def weights_array(matsize, num_weights):
+    weights = np.zeros((num_weights, matsize, matsize))
+    for i in range(num_weights):
+        weights[i] = np.arange(i * matsize**2 + 1, (i+1)*matsize**2 + 1) \
+                       .reshape(matsize, matsize)        
+    return weights.astype(np.int32)
+
+# the host memory make_hostmem saves
+def hostmem_array(matsize, num_tiles):
+    hostmem = np.arange(num_tiles * matsize**2) \
+                .reshape(matsize, num_tiles * matsize).transpose()
+    return hostmem.astype(np.int32)
+
 def make_weights(path, matsize, bitwidth, num_weights):
     weights_filepath = get_weight_filename(path, bitwidth, matsize)
     if (os.path.exists(weights_filepath)):
@@ -16,11 +30,8 @@ def make_weights(path, matsize, bitwidth, num_weights):
     
     # f = open("weights.txt", "w")
     os.makedirs(path, exist_ok=True)
-    weights = np.zeros((num_weights, matsize, matsize))
-    for i in range(num_weights):
-        weights[i] = np.arange(i * matsize**2 + 1, (i+1)*matsize**2 + 1) \
-                       .reshape(matsize, matsize)        
-    np.save(weights_filepath, weights.astype(np.int32))
+    weights = weights_array(matsize, num_weights)
+    np.save(weights_filepath, weights)
     # print(f"make_weights result is {weights}", file=f)
     return weights_filepath
 
@@ -31,8 +42,7 @@ def make_hostmem(path, matsize, bitwidth, num_tiles):
     
     # f = open("hostmem.txt", "w")
     os.makedirs(path, exist_ok=True)
-    hostmem = np.arange(num_tiles * matsize**2) \
-                .reshape(matsize, num_tiles * matsize).transpose()
-    np.save(hostmem_filepath, hostmem.astype(np.int32))
+    hostmem = hostmem_array(matsize, num_tiles)
+    np.save(hostmem_filepath, hostmem)
     # print(f"make_hostmem result is {hostmem}", file=f)
     return hostmem_filepath
@@ -0,0 +1,92 @@
+# runs a sample of the squishtest sweep, for a latency table (results.json in
+# entry_point.py's layout, which hazards.py reads) in minutes rather than the
+# days the full sweep takes: every setup RW count, but both instructions of
+# length `matsize` and only the first column for RHM.S. in each memory the
+# test places instr2 in, it ends on instr1's first row, is on top of instr1,
+# starts on instr1's last row, or is clear of instr1. unlike entry_point.py it
+# also measures instructions that don't overlap at all, which is what lets
+# hazards.py put independent instructions closer together than dependent ones
+# run from test/squish: python sample_sweep.py <test folder> [matsize] [pairs]
+# where pairs is a comma separated list like rhm_mmcs,mmcs_act (default: all)
+
+import json
+import os
+import sys
+import time
+from itertools import product
+
+from entry_point import info_map, set_nested_dict, simplify_dict
+from sweep import Journal
+from test_utils import ParamHandler
+
+# add base folder (OPENTGPTPU) to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from config import HAZARD_DETECTION, UB_ADDR_SIZE
+from runtpu import warm_up
+
+bitwidth = 32
+base_distance = 150
+
+# the ParamHandlers for one instruction pair
+def sample_commands(instr_pair, matsize, test_folder):
+    info = info_map[instr_pair]
+    instr1, instr2 = instr_pair.split("_")
+    mems = [mem for mem in ("hm", "ub", "acc") if f"{mem}2" in info["vars"]]
+    l1 = matsize if "l1" in info["vars"] else 1
+    l2 = matsize if "l2" in info["vars"] else 1
+    for setup_rw_ct in info["setup_rw_cts"]:
+        # instr1 starts at l2 in every memory (see tests.py). only partly
+        # overlapping instructions catch rows written out of order, and being
+        # on top of instr1 in every memory can make instr2 repeat it exactly
+        placements = sorted({1, l2, l2 + l1 - 1, l2 + l1})
+        for addrs in product(placements, repeat=len(mems)):
+            ph = ParamHandler(info["func"], instr1, instr2, bitwidth, matsize,
+                              not HAZARD_DETECTION, setup_rw_ct, base_distance,
+                              test_folder, UB_ADDR_SIZE)
+            ph.set_l1(l1)
+            ph.set_l2(l2)
+            ph.set_argl1(info.get("argl1", l1))
+            ph.set_argl2(info.get("argl2", l2))
+            for mem, addr in zip(mems, addrs):
+                getattr(ph, f"set_{mem}2")(addr)
+            if "flag1" in info:
+                ph.set_flags1(info["flag1"])
+            if "flag2" in info:
+                ph.set_flags2(info["flag2"])
+            if "col" in info["vars"]:
+                ph.set_col(0)
+            yield ph
+
+
+if __name__ == "__main__":
+    test_folder = sys.argv[1]
+    matsize = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    pairs = sys.argv[3].split(",") if len(sys.argv) > 3 else list(info_map)
+
+    os.makedirs(test_folder, exist_ok=True)
+    journal = Journal(f"{test_folder}/journal.jsonl")
+    journaled = {tuple(path): result for path, result in journal.entries()}
+    commands = [ph for pair in pairs for ph in sample_commands(pair, matsize, test_folder)]
+    print(f"Running {len(commands)} squishtests, {len(journaled)} already done.")
+
+    warm_up(matsize, bitwidth)
+    d = {}
+    start_time = time.time()
+    stdout = sys.stdout
+    for ph in commands:
+        dict_path = ph.get_dict_path_list()
+        result = journaled.get(tuple(dict_path))
+        if result is None:
+            # the drivers send stdout to /dev/null for the simulators' output
+            result = ph.get_driver_func()()
+            sys.stdout = stdout
+            journal.append(dict_path, result)
+            print(f"{'/'.join(dict_path)}: {result}")
+        set_nested_dict(d, dict_path, result)
+    print(f"Finished {len(commands)} tests in {time.time() - start_time}s.")
+
+    with open(f"{test_folder}/results.json", "w") as reg_f:
+        json.dump(d, reg_f, indent=2)
+    with open(f"{test_folder}/results_abridged.json", "w") as simp_f:
+        json.dump({key: simplify_dict(d[key]) for key in d}, simp_f, indent=2)
@@ -4,6 +4,7 @@ from typing import List, Optional, Tuple, Dict
 import pickle
 import sys
 import os
+import tempfile
 
 import numpy as np
 
@@ -13,8 +14,9 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")
 from dataclasses import dataclass
 from enum import Enum
 import argparse
-from generate import make_hostmem, make_weights
-from assembler import assemble
+from generate import hostmem_array, weights_array
+from artifacts import ArtifactStore, artifact_key
+from assembler import assemble_text
 from runtpu import runtpu
 from sim import TPUSim
 
@@ -188,65 +190,143 @@ class Program:
             return f"{filepath}.out"
         else:
             return f"{filepath}.a"
-    
+
+    # the number of instructions at the start of a distance test that are the
+    # same for every distance: the leading NOPs, the padded setup and the first
+    # instruction under test. without hazard detection the TPU dispatches one
+    # instruction a cycle, so this is also the cycle the shared part ends at
+    def prefix_length(self) -> int:
+        return self.ctrl_distance * (1 + len(self.setup)) + 1
+
+    # the assembly the distance test's shared prefix (see prefix_length) is
+    # made of
+    def prefix_text(self) -> str:
+        return self.program_text(ProgramType.Distance, prefix=True)
+
     # make a .a file for the program at the right location
     def generate_dot_a(self, ptype: ProgramType) -> None:
-        filepath = self.get_filepath(False, ptype)
-        nop = Instruction("NOP", self.matsize, self.absolute_addresses)
-        hlt = Instruction("HLT", self.matsize, self.absolute_addresses)
-
-        with open(filepath, "w") as f:
-
-            # start with self.ctrl_distance NOPs if it's a distance test
-            # (PC 0 through PC ctrl_distance - 1)
-            if ptype == ProgramType.Distance:
-                for _ in range(self.ctrl_distance):
-                    f.write(f"{nop.to_string()}\n")
-            
-            # then write all the setup instructions. if it's a distance test, 
-            # pad with NOPs so that they are all self.ctrl_distance cycles apart
-            for i in range(len(self.setup)):
-                f.write(f"{self.setup[i].to_string()}\n")
-                if ptype == ProgramType.Distance:
-                    for _ in range(self.ctrl_distance - 1):
-                        f.write(f"{nop.to_string()}\n")
-
-            # then write all the instructions under test. if it's a distance 
-            # test, pad with NOPs so that they are self.distance instructions 
-            # apart
-            if len(self.instrs) != 2:
-                raise ValueError("Please provide exactly two instructions to test.")
-            f.write(f"{self.instrs[0].to_string()}\n")
-            if ptype == ProgramType.Distance:
-                for _ in range(self.distance - 1):
-                    f.write(f"{nop.to_string()}\n")
-            f.write(f"{self.instrs[1].to_string()}\n")
-
-            # if it's a distance test, pad with NOPs so that the first cleanup 
-            # instruction is 2*ctrl_distance lines after the first instruction 
-            # under test 
-            if ptype == ProgramType.Distance:
-                for _ in range(2*self.ctrl_distance - self.distance - 1):
-                    f.write(f"{nop.to_string()}\n")
-
-            # then write all the cleanup instructions. if it's a distance test, 
-            # pad with NOPs so that they are all self.ctrl_distance cycles apart
-            for i in range(len(self.cleanup)):
-                f.write(f"{self.cleanup[i].to_string()}\n")
-                if ptype == ProgramType.Distance:
-                    for _ in range(self.ctrl_distance - 1):
-                        f.write(f"{nop.to_string()}\n")
-
-            # finally, HLT
-            f.write(f"{hlt.to_string()}\n")
-
-
-# run the squish test given the args
+        with open(self.get_filepath(False, ptype), "w") as f:
+            f.write(self.program_text(ptype))
+
+    # the assembly for the program, one instruction or directive a line. a
+    # distance test's NOP padding is written as .org and .align directives,
+    # which the assembler expands. with `prefix`, only the lines up to and
+    # including the first instruction under test
+    def program_text(self, ptype: ProgramType, prefix: bool = False) -> str:
+        distance_test = ptype == ProgramType.Distance
+        lines = []
+
+        # start with self.ctrl_distance NOPs if it's a distance test
+        # (PC 0 through PC ctrl_distance - 1)
+        if distance_test:
+            lines.append(f".org {self.ctrl_distance}")
+        
+        # then write all the setup instructions. if it's a distance test, 
+        # pad with NOPs so that they are all self.ctrl_distance cycles apart
+        for i in range(len(self.setup)):
+            lines.append(self.setup[i].to_string())
+            if distance_test:
+                lines.append(f".align {self.ctrl_distance}")
+
+        # then write all the instructions under test. if it's a distance 
+        # test, pad with NOPs so that they are self.distance instructions 
+        # apart
+        if len(self.instrs) != 2:
+            raise ValueError("Please provide exactly two instructions to test.")
+        if distance_test:
+            lines.append(f"first: {self.instrs[0].to_string()}")
+            if prefix:
+                return "".join(f"{line}\n" for line in lines)
+            lines.append(f".org first + {self.distance}")
+        else:
+            lines.append(self.instrs[0].to_string())
+        lines.append(self.instrs[1].to_string())
+
+        # if it's a distance test, pad with NOPs so that the first cleanup 
+        # instruction is 2*ctrl_distance lines after the first instruction 
+        # under test 
+        if distance_test:
+            lines.append(f".org first + {2*self.ctrl_distance}")
+
+        # then write all the cleanup instructions. if it's a distance test, 
+        # pad with NOPs so that they are all self.ctrl_distance cycles apart
+        for i in range(len(self.cleanup)):
+            lines.append(self.cleanup[i].to_string())
+            if distance_test:
+                lines.append(f".align {self.ctrl_distance}")
+
+        # finally, HLT
+        lines.append("HLT")
+
+        return "".join(f"{line}\n" for line in lines)
+
+
+# the binary for `ptype`'s program for `program`, assembled in memory unless
+# the store has it already
+def program_binary(program: Program, ptype: ProgramType, store: ArtifactStore,
+                   reset: bool) -> bytes:
+    text = program.program_text(ptype)
+    key = artifact_key(text)
+    binary = None if reset else store.get("binary", key)
+    if binary is None:
+        binary = assemble_text(text)
+        store.put("binary", key, binary)
+    return binary
+
+# run the distance test's program on runtpu.py and sim.py, sharing the prefix
+# every distance has in common. the first distance run with a given prefix
+# saves checkpoints at its end on the way and puts them in the store, and
+# later distances start from them instead of from cycle 0. `key_parts` are
+# the artifact_key parts the program is run with. returns the two sets of
+# memories
+def run_from_prefix(program: Program, prog: bytes, hm_filename: str, wm_filename: str,
+                    key_parts: tuple, store: ArtifactStore, output_folderpath: str,
+                    fresh: bool):
+    prefix_length = program.prefix_length()
+    key = artifact_key(program.prefix_text(), *key_parts, prefix_length)
+    rtl_checkpoint = f"{program.program_dir}/prefix_runtpu.npz"
+    sim_checkpoint = f"{program.program_dir}/prefix_sim.npz"
+
+    data = None if fresh else store.get("runtpu_checkpoint", key)
+    if data is None:
+        rtl_mems = runtpu(prog, hm_filename, wm_filename, program.bitwidth,
+                          program.matsize, output_folderpath, output_trace=False,
+                          checkpoint=rtl_checkpoint, checkpoint_at=prefix_length)
+        if os.path.exists(rtl_checkpoint):
+            with open(rtl_checkpoint, "rb") as f:
+                store.put("runtpu_checkpoint", key, f.read())
+    else:
+        with open(rtl_checkpoint, "wb") as f:
+            f.write(data)
+        rtl_mems = runtpu(prog, hm_filename, wm_filename, program.bitwidth,
+                          program.matsize, output_folderpath, output_trace=False,
+                          restore=rtl_checkpoint)
+
+    sim = TPUSim(prog, hm_filename, wm_filename, program.bitwidth,
+                 program.matsize, output_folderpath)
+    data = None if fresh else store.get("sim_checkpoint", key)
+    if data is None:
+        sim.advance(prefix_length)
+        sim.checkpoint(sim_checkpoint)
+        with open(sim_checkpoint, "rb") as f:
+            store.put("sim_checkpoint", key, f.read())
+    else:
+        with open(sim_checkpoint, "wb") as f:
+            f.write(data)
+        sim.restore(sim_checkpoint)
+    sim.run()
+    return rtl_mems, sim.get_mems()
+
+
+# run the squish test given the args. with share_prefix, a distance test
+# restores the state its earlier distances saved at the end of the shared
+# prefix (see run_from_prefix) rather than simulating the prefix again
 # TODO: remove cleanup from squishtests altogether?
 def squish_test(setup: list, instrs: list, distance: int, ctrl_distance: int,
                 bitwidth: int, matsize: int, use_nops: bool, test_folder: str, 
                 name: str, reset: bool, absoluteaddrs: bool,  
-                cleanup: list = []) -> Tuple[bool, Dict[int, int]]:
+                cleanup: list = [], 
+                share_prefix: bool = False) -> Tuple[bool, Dict[int, int]]:
 
     if len(instrs) != 2:
         print("Please provide two instructions to test.")
@@ -256,91 +336,79 @@ def squish_test(setup: list, instrs: list, distance: int, ctrl_distance: int,
         print(f"Distance must be between 1 and {ctrl_distance}.")
         exit(1)
 
-    # parse args into Program object
-    program_dir = f"{os.path.dirname(__file__)}/{test_folder}/{name}"
-    program = Program(instrs, setup, cleanup, distance, bitwidth, matsize, name,
-                      reset, absoluteaddrs, program_dir, ctrl_distance) 
-
-    # make folder for the test (squish/name/) and add weights and inputs if they
-    # don't already exist
-    wm_filename = make_weights(program_dir, program.matsize, program.bitwidth, 
-                               num_weights=program.max_weight_index + 1)
-    if absoluteaddrs:
-        num_tiles = max(16, math.ceil(program.max_hm_addr/matsize))
-    else:
-        num_tiles = max(16, program.max_hm_addr)
-    hm_filename = make_hostmem(program_dir, program.matsize, program.bitwidth, 
-                               num_tiles)
-
-    test_type = ProgramType.Distance if use_nops else ProgramType.NoNop
-
-    # if -r is set, or the following don't exist, or the test name is default (test):
-    # generate .a file for d=ctrl_distance (control)
-    if reset or not os.path.exists(program.get_filepath(binary=False, ptype=ProgramType.Control)) or program.name == "test":
-        program.generate_dot_a(ProgramType.Control)
-
-    # assemble into .out file for d=ctrl_distance (control)
-    if reset or not os.path.exists(program.get_filepath(binary=True, ptype=ProgramType.Control)) or program.name == "test":
-        assemble(program.get_filepath(binary=False, ptype=ProgramType.Control), 0)
-
-    # generate .a file for the apropriate distance (distance test) or without nops
-    if reset or not os.path.exists(program.get_filepath(binary=False, ptype=test_type)) or program.name == "test":
-        program.generate_dot_a(test_type)
-
-    # assemble into .out file (distance test or without nops)
-    if reset or not os.path.exists(program.get_filepath(binary=True, ptype=test_type)) or program.name == "test":
-        assemble(program.get_filepath(binary=False, ptype=test_type), 0)
-
-    # run sim.py on control file and get the resulting memories
-    print(f"Running {name} for b = {bitwidth}, m = {matsize}")
-    print(f"Control")
-    
-    ctrl_output_folderpath = f"{program_dir}/{ProgramType.Control.value}_{bitwidth}b_{matsize}m"
-    if reset or not os.path.exists(ctrl_output_folderpath) or program.name == "test":
-        sim = TPUSim(program.get_filepath(binary=True, ptype=ProgramType.Control),
-                 hm_filename, wm_filename, bitwidth, matsize, 
-                 ctrl_output_folderpath)
-        sim.run()
-        ctrl_hm, ctrl_wm, ctrl_ub, ctrl_wq, ctrl_acc = sim.get_mems()
-    else:
-        with np.load(os.path.join(ctrl_output_folderpath, "sim.npz")) as data:
-            ctrl_hm = data["hm"]
-            ctrl_wm = data["wm"]
-            ctrl_ub = data["ub"]
-            ctrl_wq = data["wq"]
-            ctrl_acc = data["acc"]
-
-    # run runtpu.py and sim.py on test file and get the resulting memories
-    if test_type == ProgramType.NoNop:
-        print("NoNop Test")
-        test_output_folderpath = f'{program_dir}/{ProgramType.NoNop.value}_{bitwidth}b_{matsize}m'
-    else:
-        print(f"Distance Test (squish distance = {distance}, normal distance = {ctrl_distance})")
-        test_output_folderpath = f'{program_dir}/{ProgramType.Distance.value}_{bitwidth}b_{matsize}m_{distance}d'
-
-    if reset or not os.path.exists(test_output_folderpath) or program.name == "test":
-        test_hm, test_wm, test_ub, test_wq, test_acc = runtpu(
-                     program.get_filepath(binary=True, ptype=test_type),
-                     hm_filename, wm_filename, bitwidth, matsize, 
-                     test_output_folderpath, output_trace=False)
-        sim = TPUSim(program.get_filepath(binary=True, ptype=test_type),
-                     hm_filename, wm_filename, bitwidth, matsize, 
-                     test_output_folderpath)
-        sim.run()
-        ctrl_hm, ctrl_wm, ctrl_ub, ctrl_wq, ctrl_acc = sim.get_mems()
-    else:
-        with np.load(os.path.join(test_output_folderpath, "runtpu.npz")) as data:
-            test_hm = data["hm"]
-            test_wm = data["wm"]
-            test_ub = data["ub"]
-            test_wq = data["wq"]
-            test_acc = data["acc"]
-        with np.load(os.path.join(test_output_folderpath, "sim.npz")) as data:
-            ctrl_hm = data["hm"]
-            ctrl_wm = data["wm"]
-            ctrl_ub = data["ub"]
-            ctrl_wq = data["wq"]
-            ctrl_acc = data["acc"]
+    # parse args into Program object. programs are assembled in memory, but
+    # the simulators read their inputs and write their outputs as files, so
+    # they work in a scratch folder that's deleted afterwards; binaries and
+    # results are kept in the test folder's artifact store
+    store = ArtifactStore(f"{os.path.dirname(__file__)}/{test_folder}/artifacts.db")
+    scratch = tempfile.TemporaryDirectory(prefix="squish_")
+    try:
+        program_dir = scratch.name
+        program = Program(instrs, setup, cleanup, distance, bitwidth, matsize, name,
+                          reset, absoluteaddrs, program_dir, ctrl_distance)
+
+        # make weights and inputs for the test
+        weights = weights_array(program.matsize, program.max_weight_index + 1)
+        if absoluteaddrs:
+            num_tiles = max(16, math.ceil(program.max_hm_addr/matsize))
+        else:
+            num_tiles = max(16, program.max_hm_addr)
+        hostmem = hostmem_array(program.matsize, num_tiles)
+        wm_filename = f"{program_dir}/weights.npy"
+        hm_filename = f"{program_dir}/hostmem.npy"
+        np.save(wm_filename, weights)
+        np.save(hm_filename, hostmem)
+        key_parts = (hostmem, weights, bitwidth, matsize)
+
+        test_type = ProgramType.Distance if use_nops else ProgramType.NoNop
+
+        # run sim.py on control file and get the resulting memories, unless
+        # the store has them. -r runs everything again
+        print(f"Running {name} for b = {bitwidth}, m = {matsize}")
+        print(f"Control")
+
+        ctrl_key = artifact_key(program.program_text(ProgramType.Control), *key_parts)
+        ctrl_mems = None if reset else store.get_mems("sim", ctrl_key)
+        if ctrl_mems is None:
+            sim = TPUSim(program_binary(program, ProgramType.Control, store, reset),
+                         hm_filename, wm_filename, bitwidth, matsize,
+                         f"{program_dir}/{ProgramType.Control.value}")
+            sim.run()
+            ctrl_mems = sim.get_mems()
+            store.put_mems("sim", ctrl_key, ctrl_mems)
+        ctrl_hm, ctrl_wm, ctrl_ub, ctrl_wq, ctrl_acc = ctrl_mems
+
+        # run runtpu.py and sim.py on test file and get the resulting memories
+        if test_type == ProgramType.NoNop:
+            print("NoNop Test")
+        else:
+            print(f"Distance Test (squish distance = {distance}, normal distance = {ctrl_distance})")
+        test_output_folderpath = f"{program_dir}/{test_type.value}"
+
+        test_key = artifact_key(program.program_text(test_type), *key_parts)
+        rtl_mems = None if reset else store.get_mems("runtpu", test_key)
+        sim_mems = None if reset else store.get_mems("sim", test_key)
+        if rtl_mems is None or sim_mems is None:
+            prog = program_binary(program, test_type, store, reset)
+            if share_prefix and test_type == ProgramType.Distance:
+                rtl_mems, sim_mems = run_from_prefix(
+                             program, prog, hm_filename, wm_filename, key_parts,
+                             store, test_output_folderpath, fresh=reset)
+            else:
+                rtl_mems = runtpu(prog, hm_filename, wm_filename, bitwidth, matsize,
+                                  test_output_folderpath, output_trace=False)
+                sim = TPUSim(prog, hm_filename, wm_filename, bitwidth, matsize,
+                             test_output_folderpath)
+                sim.run()
+                sim_mems = sim.get_mems()
+            store.put_mems("runtpu", test_key, rtl_mems)
+            store.put_mems("sim", test_key, sim_mems)
+        # runtpu.py's memories are checked against sim.py's for the same program
+        test_hm, test_wm, test_ub, test_wq, test_acc = rtl_mems
+        ctrl_hm, ctrl_wm, ctrl_ub, ctrl_wq, ctrl_acc = sim_mems
+    finally:
+        scratch.cleanup()
+        store.close()
 
     # compare results of all memories (hostmem, weightsmem, ubuffer, accmems, 
     # fifo queue) and output a verdict
@@ -408,6 +476,9 @@ if __name__ == "__main__":
     parser.add_argument("--nops", type=bool, default=True, help="Set to false for a No-Nop test (meant for hazard-detecting"
                                                               + "version of runtpu). Set to true for a Distance test (meant"
                                                               + "for the original version of runtpu)")
+    parser.add_argument("--share_prefix", action="store_true", help="Save the state at the end of the part of a Distance test"
+                                                                  + " that every distance shares, and start later distances of"
+                                                                  + " the same test from it.")
     args = parser.parse_args()
 
     instrs: list = args.instrs
@@ -422,8 +493,10 @@ if __name__ == "__main__":
     test_folder: str = args.test_folder
     ctrl_distance: int = args.ctrl_distance
     use_nops: bool = args.nops
+    share_prefix: bool = args.share_prefix
 
     print(instrs)
     print("aa=", absoluteaddrs)
     squish_test(setup, instrs, distance, ctrl_distance, bitwidth, matsize, 
-                use_nops, test_folder, name, reset, absoluteaddrs, cleanup)
+                use_nops, test_folder, name, reset, absoluteaddrs, cleanup,
+                share_prefix)
@@ -0,0 +1,105 @@
+# scheduling for squishtest sweeps (entry_point.py): how many workers this
+# host has room for, which order to run jobs in, a journal of finished jobs so
+# an interrupted sweep picks up where it stopped, and progress reports
+
+import json
+import os
+import sys
+import time
+
+# memory one worker needs, in MB, once it has elaborated the TPU for
+# `matsize` and run a squishtest on it. measured as about 53, 79 and 173 MB of
+# peak RSS at matsizes 4, 8 and 16, rounded up
+def worker_memory_mb(matsize):
+    return 64 + matsize**2 // 2
+
+# the cores this process may run on
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+# the memory available to new processes in MB, or None where /proc/meminfo
+# can't tell
+def available_memory_mb():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return None
+
+# the number of workers to run a sweep over `matsizes` with: one per core, as
+# long as that many workers at the largest matsize fit in memory, and never
+# more than max_workers if it's given
+def pool_size(matsizes, max_workers=None):
+    workers = available_cores()
+    memory = available_memory_mb()
+    if memory is not None:
+        workers = min(workers, memory // worker_memory_mb(max(matsizes)))
+    if max_workers is not None:
+        workers = min(workers, max_workers)
+    return max(1, workers)
+
+# relative cost of one squishtest job. a distance test runs about
+# base_distance cycles for the leading NOPs, each setup instruction and the
+# two under test, plus another base_distance for the cleanup padding. the
+# time a cycle takes goes as about 1 + matsize**2/64 (the same program took
+# 1.0s, 1.9s and 4.8s at matsizes 4, 8 and 16)
+def job_cost(matsize, setup_rw_ct, base_distance):
+    return base_distance * (setup_rw_ct + 4) * (1 + matsize**2 / 64)
+
+
+# an append-only file of finished jobs, one JSON line each with the job's path
+# in the result dict and its result. every line is flushed to disk as soon as
+# the job finishes, so a sweep that's killed loses no finished work
+class Journal(object):
+    def __init__(self, path):
+        self.path = path
+
+    # the (dict path, result) of every journaled job. a sweep killed while
+    # writing a line leaves it cut short, so lines that don't parse are skipped
+    def entries(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                entries.append((entry["path"], entry["result"]))
+        return entries
+
+    def append(self, dict_path, result):
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"path": dict_path, "result": result}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+# progress through a sweep, weighing each job by its cost so the ETA holds up
+# when jobs of different matsizes finish at different rates
+class Progress(object):
+    def __init__(self, costs):
+        self.total_jobs = len(costs)
+        self.total_cost = sum(costs)
+        self.jobs = 0
+        self.cost = 0
+        self.start_time = time.time()
+
+    def done(self, cost):
+        self.jobs += 1
+        self.cost += cost
+
+    def report(self, file=sys.stderr):
+        elapsed = time.time() - self.start_time
+        rate = self.jobs / elapsed * 60 if elapsed > 0 else 0
+        eta = elapsed / self.cost * (self.total_cost - self.cost) if self.cost else 0
+        print(f"Completed {self.jobs} out of {self.total_jobs} commands "
+              f"({100 * self.cost / self.total_cost:.1f}% of the work).", file=file)
+        print(f"Time elapsed: {elapsed:.0f}s, {rate:.1f} commands/min", file=file)
+        print(f"Completion ETA: {eta:.0f}s\n", file=file, flush=True)
@@ -75,9 +75,11 @@ class Params:
 
 class ParamHandler:
     def __init__(self, func, instr1, instr2, bitwidth, matsize, use_nops, 
-                 setup_rw_ct, base_distance, test_folder, ub_addrwidth):
+                 setup_rw_ct, base_distance, test_folder, ub_addrwidth,
+                 share_prefix=True):
         
         self.func = func
+        self.share_prefix = share_prefix
         self.p = Params(instr1, instr2, bitwidth, matsize, use_nops, 
                         setup_rw_ct, base_distance, test_folder, ub_addrwidth)
 
@@ -129,6 +131,9 @@ class ParamHandler:
     # test failed at all distances in the range. It could work at a distance 
     # d >= START_DISTANCE, or it could always fail. Either way, it's a signal to
     # investigate further and/or rerun with a higher START_DISTANCE.
+    # every distance runs the same setup and first instruction, so with
+    # share_prefix only the first one simulates them. the rest start from its
+    # checkpoints (see squishtest.run_from_prefix)
     def n_mode_driver(self):
         sys.stdout = open(os.devnull, 'w')
         left = 1
@@ -155,4 +160,5 @@ class ParamHandler:
                            self.p.base_distance, self.p.bitwidth, 
                            self.p.matsize, self.p.use_nops, self.p.test_folder,
                            name=self.p.get_relative_filepath(),
-                           reset=False, absoluteaddrs=True)
+                           reset=False, absoluteaddrs=True,
+                           share_prefix=self.share_prefix)
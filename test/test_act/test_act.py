@@ -0,0 +1,17 @@
+# specify hostmem and weights for test_act
+# the weights are the identity, so MMC copies the host memory rows straight into
+# the accumulator and each ACT sees the raw host memory values
+import numpy as np
+
+def store():
+    hm = np.array([ [ -3,  5, 300, -1 ],
+                    [  0,  1,   2,  3 ],
+                    [  4,  5,   6,  7 ],
+                    [  8, -8,   7, -7 ] ])
+    weights = np.eye(4, dtype=int).reshape((1, 4, 4))
+
+    np.save("input.npy", hm)
+    np.save("weights.npy", weights)
+
+if __name__ == "__main__":
+    store()
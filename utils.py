@@ -75,12 +75,20 @@ def compare_all_mems(test_hostmem, test_weightsmem, test_ubuffer, test_wqueue,
 
 # run a test (runtpu and sim) with a specified program, hostmem, and weightmem. 
 # give it a name, and specify where to put the test results, and bitwidth and
-# matsize.
+# matsize. with lockstep, run them together with cosim.py instead, which stops
+# where they first disagree
 def run_and_compare_all_mems(prog_name, hm_name, wm_name, test_name, 
-                             output_base,bitwidth, matsize):
+                             output_base,bitwidth, matsize, lockstep=False):
     from runtpu import runtpu
     from sim import TPUSim
 
+    if lockstep:
+        from cosim import cosim
+        divergence = cosim(prog_name, hm_name, wm_name, bitwidth, matsize,
+                           output_base + "cosim")
+        print(f"Test {test_name} {'passed' if divergence is None else 'failed'}")
+        return divergence is None
+
     test_hostmem, test_weightsmem, test_ubuffer, test_wqueue, test_accmems \
         = runtpu(prog_name, hm_name, wm_name, bitwidth, matsize, 
                     output_base + "runtpu", True)